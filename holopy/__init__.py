@@ -30,11 +30,27 @@ images and calculations.
 
 """
 
-
-from . import core, scattering, fitting, inference
-from .core import load, save, load_image, save_image, detector_grid, detector_points
-from .propagation import propagate
-from .vis import show, test_disp
+import importlib
 
 __version__ = '3.1.2'
 __version_info__ = tuple([ int(num) for num in __version__.split('.')])
+
+# Subpackages (and the functions available directly from holopy) are only
+# imported when they are first used, so that importing holopy is quick for
+# jobs that only need a small part of it.
+_subpackages = ['core', 'scattering', 'fitting', 'inference', 'propagation', 'vis']
+_functions = {'load': 'core', 'save': 'core', 'load_image': 'core', 'save_image': 'core',
+              'detector_grid': 'core', 'detector_points': 'core', 'Schema': 'core',
+              'propagate': 'propagation', 'show': 'vis', 'test_disp': 'vis'}
+
+def __getattr__(name):
+    if name in _subpackages:
+        return importlib.import_module('.' + name, __name__)
+    if name in _functions:
+        value = getattr(importlib.import_module('.' + _functions[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(_subpackages) | set(_functions))
@@ -38,5 +38,6 @@ Main use cases are
 
 """
 
-from .metadata import detector_grid, detector_points, update_metadata, copy_metadata, get_spacing
-from .io import load, load_image, save, save_image
+from .metadata import (detector_grid, detector_points, update_metadata, copy_metadata,
+                       get_spacing, Schema)
+from .io import load, load_image, save, save_image, iter_images, load_stack
@@ -27,7 +27,8 @@ Error classes used in holopy
 class LoadError(Exception):
     def __init__(self, filename, message):
         self.filename = filename
-        super(LoadError, self).__init__("Error loading file " + self.filename + ": " + self.message)
+        self.message = message
+        super(LoadError, self).__init__("Error loading file " + str(filename) + ": " + message)
 
 class BadImage(Exception):
     pass
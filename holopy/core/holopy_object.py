@@ -28,6 +28,11 @@ analysis procedures.
 """
 import numpy as np
 import yaml
+try:
+    # libyaml's loader and dumper are much faster than the pure python ones
+    from yaml import CLoader as Loader, CDumper as Dumper
+except ImportError:
+    from yaml import Loader, Dumper
 
 # Metaclass black magic to eliminate need for adding yaml_tag lines to classes
 class SerializableMetaclass(yaml.YAMLObjectMetaclass):
@@ -35,8 +40,10 @@ class SerializableMetaclass(yaml.YAMLObjectMetaclass):
         super(SerializableMetaclass, cls).__init__(name, bases, kwds)
         # Replace the normal yaml constructor with one that uses the class name
         # as the yaml tag.
-        cls.yaml_loader.add_constructor('!{0}'.format(cls.__name__), cls.from_yaml)
-        cls.yaml_dumper.add_representer(cls, cls.to_yaml)
+        for loader in {cls.yaml_loader, Loader}:
+            loader.add_constructor('!{0}'.format(cls.__name__), cls.from_yaml)
+        for dumper in {cls.yaml_dumper, Dumper}:
+            dumper.add_representer(cls, cls.to_yaml)
         if '__init__' in kwds:
             cls._args = kwds['__init__'].__code__.co_varnames[1:]
 
@@ -103,7 +110,14 @@ class HoloPyObject(Serializable):
 def ordered_dump(dumper, tag, data):
     value = []
     node = yaml.nodes.MappingNode(tag, value)
+    sidecar = getattr(dumper, 'sidecar', None)
     for key, item in data._iteritems():
+        if sidecar is not None:
+            # _iteritems makes lists of 1d arrays, keep large ones as arrays
+            # so they are written to the sidecar file (see serialize.save)
+            original = getattr(data, key)
+            if isinstance(original, np.ndarray) and sidecar.wants(original):
+                item = original
         node_key = dumper.represent_data(key)
         node_value = dumper.represent_data(item)
         value.append((node_key, node_value))
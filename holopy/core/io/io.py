@@ -23,17 +23,24 @@ functions.
 """
 import os
 import glob
+import struct
+import tempfile
 import yaml
+import json
 from warnings import warn
 from scipy.misc import fromimage
 from PIL import Image as pilimage
 import xarray as xr
+import numpy as np
 import importlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from . import serialize
-from ..metadata import data_grid, get_spacing, update_metadata
+from ..holopy_object import Loader, Dumper
+from ..metadata import data_grid, get_spacing, update_metadata, make_coords
 from ..utils import is_none, ensure_array, dict_without
-from ..errors import NoMetadata, BadImage
+from ..errors import NoMetadata, BadImage, LoadError
 
 attr_coords = '_attr_coords'
 tiflist = ['.tif', '.TIF', '.tiff', '.TIFF']
@@ -64,6 +71,41 @@ def get_example_data_path(name):
 def get_example_data(name):
     return load(get_example_data_path(name))
 
+def dump_metadata(meta):
+    """
+    Encode a dict of metadata (as made by pack_attrs) as a string
+
+    JSON is used when it can represent everything in meta, since it is much
+    faster to read than yaml. Anything else (complex values, for instance)
+    falls back to yaml.
+    """
+    try:
+        return json.dumps(meta, default=_json_default)
+    except TypeError:
+        return yaml.dump(meta, Dumper=Dumper)
+
+def _json_default(obj):
+    # numpy arrays and scalars
+    if hasattr(obj, 'tolist'):
+        value = obj.tolist()
+        if not isinstance(value, complex):
+            return value
+    raise TypeError("{} cannot be stored as json".format(repr(obj)))
+
+def load_metadata(text):
+    """
+    Decode metadata written by dump_metadata, or the yaml of older versions
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return yaml.load(text, Loader=serialize.SafeLoader)
+    except yaml.constructor.ConstructorError:
+        # holopy specific tags like !complex
+        return yaml.load(text, Loader=Loader)
+
 def pack_attrs(a, do_spacing=False):
     new_attrs = {'name':a.name, attr_coords:{}}
 
@@ -80,12 +122,12 @@ def pack_attrs(a, do_spacing=False):
             new_attrs[attr_coords][attr]=False
             if not is_none(val):
                 new_attrs[attr]=val
-    new_attrs[attr_coords]=yaml.dump(new_attrs[attr_coords])
+    new_attrs[attr_coords]=dump_metadata(new_attrs[attr_coords])
     return new_attrs
 
 def unpack_attrs(a):
     new_attrs={}
-    attr_ref=yaml.load(a[attr_coords])
+    attr_ref=load_metadata(a[attr_coords])
     for attr in dict_without(attr_ref,['spacing','name']):
         if attr_ref[attr]:
             new_attrs[attr] = xr.DataArray(a[attr], coords=attr_ref[attr],dims=list(attr_ref[attr].keys()))
@@ -103,6 +145,11 @@ def load(inf, lazy=False):
     ----------
     inf : string
         String specifying an hdf5 file containing holopy data
+    lazy : bool (optional)
+        Leave arrays on disk and read them only when they are used. Indexing
+        a lazily loaded time series (see HologramSeriesWriter) reads just
+        the frames selected. Sampling results loaded this way compute their
+        summaries reading a block of samples at a time.
 
     Returns
     -------
@@ -111,12 +158,17 @@ def load(inf, lazy=False):
 
     """
     try:
-        with xr.open_dataset(default_extension(inf), engine='h5netcdf') as ds:
+        # without cache, xarray would keep every array read from a lazy
+        # file in memory
+        with xr.open_dataset(default_extension(inf), engine='h5netcdf',
+                             cache=not lazy) as ds:
             if '_source_class' in ds.attrs:
                 _source_class = ds.attrs.pop('_source_class')
                 pathtok = _source_class.split('.')
                 cls = getattr(importlib.import_module(".".join(pathtok[:-1])), pathtok[-1])
                 ds.close()
+                if lazy:
+                    return cls._load(default_extension(inf), lazy=True)
                 return cls._load(default_extension(inf))
 
             # Xarray defaults to lazy loading of datasets, but I my reading of
@@ -152,7 +204,7 @@ def load(inf, lazy=False):
 
     if os.path.splitext(inf)[1] in tiflist:
         try:
-            meta = yaml.load(pilimage.open(inf).tag[270][0])
+            meta = load_metadata(pilimage.open(inf).tag[270][0])
             if meta['spacing'] is None:
                 raise NoMetadata
             else:
@@ -243,6 +295,131 @@ def save(outf, obj):
     else:
         serialize.save(outf, obj)
 
+class HologramSeriesWriter(object):
+    """
+    Write holograms to one file, a frame at a time
+
+    Frames are stacked along a t dimension of a chunked, compressed array
+    that grows as frames are written, so a long video can be recorded
+    without holding it in memory or writing a file per frame. Metadata
+    (spacing, medium_index, etc.) is taken from the first frame and stored
+    once. The file loads with load like any saved hologram, as a (t, z, x,
+    y) DataArray; load(filename, lazy=True) reads frames only as they are
+    indexed.
+
+    Parameters
+    ----------
+    filename : str
+        File to write to. If it already holds a series, frames are appended
+        to it.
+    chunk_frames : int
+        Number of frames per stored chunk. Reading a frame decompresses its
+        whole chunk, so keep this small if frames will be read one at a time.
+    compression : int or None
+        gzip compression level (0-9), or None to store frames uncompressed
+    """
+    def __init__(self, filename, chunk_frames=1, compression=4):
+        self.filename = default_extension(filename)
+        self.chunk_frames = chunk_frames
+        self.compression = compression
+        self.nframes = 0
+        self._name = None
+        if os.path.exists(self.filename):
+            # h5netcdf imports h5py, which is slow, so only when it is needed
+            import h5netcdf
+            with h5netcdf.File(self.filename, 'r') as f:
+                self._name = [v for v in f.variables if 't' in f.variables[v].dimensions
+                              and v != 't'][0]
+                self.nframes = f.dimensions['t'].size
+                stored = f.variables[self._name]
+                dims = stored.dimensions[1:]
+                self._remember(dims, stored.shape[1:],
+                               {d: f.variables[d][:] for d in dims if d in f.variables},
+                               unpack_attrs(dict(stored.attrs)))
+
+    def _remember(self, dims, shape, coords, attrs):
+        # what every later frame has to match
+        self._dims, self._shape, self._coords, self._attrs = dims, shape, coords, attrs
+
+    def write(self, frame, t=None):
+        """
+        Append a frame to the series
+
+        Parameters
+        ----------
+        frame : xarray.DataArray
+            A hologram with the same dimensions and coordinates as the
+            frames already written (dimensions may be in any order), and no
+            metadata that differs from theirs. A plain array only has to have
+            the same shape.
+        t : float (optional)
+            Time of the frame, defaults to its index in the series
+
+        Raises
+        ------
+        ValueError
+            If frame does not match the frames already written
+        """
+        if t is None:
+            t = self.nframes
+        if self.nframes == 0:
+            self._create(frame, t)
+        else:
+            values = self._frame_values(frame)
+            import h5netcdf
+            with h5netcdf.File(self.filename, 'a') as f:
+                f.resize_dimension('t', self.nframes + 1)
+                f.variables[self._name][self.nframes] = values
+                f.variables['t'][self.nframes] = t
+        self.nframes += 1
+
+    def _frame_values(self, frame):
+        if isinstance(frame, xr.DataArray):
+            if set(frame.dims) != set(self._dims):
+                raise ValueError("Frame has dimensions {} but the series has {}".format(
+                    frame.dims, self._dims))
+            frame = frame.transpose(*self._dims)
+            for dim, coord in self._coords.items():
+                if dim in frame.coords and (frame[dim].shape != coord.shape or
+                                            not np.allclose(frame[dim], coord)):
+                    raise ValueError("Frame coordinate {} (pixel spacing or position) "
+                                     "differs from the series".format(dim))
+            # metadata the frame does not carry (e.g. lost in arithmetic) is
+            # taken to be the series'
+            for key, val in frame.attrs.items():
+                if not is_none(val) and not _same_attr(val, self._attrs.get(key)):
+                    raise ValueError("Frame {} differs from the series".format(key))
+        values = np.asarray(frame)
+        if values.shape != tuple(self._shape):
+            raise ValueError("Frame has shape {} but the series has {}".format(
+                values.shape, tuple(self._shape)))
+        return values
+
+    def _create(self, frame, t):
+        frame = frame.copy()
+        if frame.name is None:
+            frame.name = os.path.splitext(os.path.split(self.filename)[-1])[0]
+        self._name = frame.name
+        self._remember(frame.dims, frame.shape,
+                       {d: frame[d].values for d in frame.dims if d in frame.coords},
+                       dict(frame.attrs))
+        frame.attrs = pack_attrs(frame)
+        frame = frame.expand_dims('t').assign_coords(t=[t])
+        encoding = {'chunksizes': (self.chunk_frames,) + frame.shape[1:]}
+        if self.compression is not None:
+            encoding.update(zlib=True, complevel=self.compression)
+        frame.to_dataset().to_netcdf(self.filename, engine='h5netcdf', unlimited_dims=['t'],
+                                     encoding={self._name: encoding})
+
+def _same_attr(a, b):
+    if is_none(b):
+        return False
+    try:
+        a, b = ensure_array(a), ensure_array(b)
+        return a.shape == b.shape and np.allclose(a, b)
+    except TypeError:
+        return np.array_equal(a, b)
+
 def save_image(filename, im, scaling='auto', depth=8):
     """Save an ndarray or image as a tiff.
 
@@ -278,7 +455,7 @@ def save_image(filename, im, scaling='auto', depth=8):
         metadat = pack_attrs(im, do_spacing = True)
         from PIL.TiffImagePlugin import ImageFileDirectory_v2 as ifd2 #hiding this import here since it doesn't play nice in some scenarios
         tiffinfo = ifd2()
-        tiffinfo[270] = yaml.dump(metadat) #This edits the 'imagedescription' field of the tiff metadata
+        tiffinfo[270] = dump_metadata(metadat) #This edits the 'imagedescription' field of the tiff metadata
 
     if len(im.dims)>2:
         im = im.copy().isel(z=0)
@@ -315,10 +492,223 @@ def save_image(filename, im, scaling='auto', depth=8):
     else:
         pilimage.fromarray(im.values).save(filename)
 
-def load_average(filepath, refimg=None, spacing=None, medium_index=None, illum_wavelen=None, illum_polarization=None, normals=None, channel=None, image_glob='*.tif'):
+# tiff tags load_stack needs
+_tiff_tags = {256: 'width', 257: 'length', 258: 'bits', 259: 'compression',
+              270: 'description', 273: 'offsets', 277: 'samples', 279: 'counts',
+              322: 'tile_width', 339: 'format'}
+_tiff_types = {1: 'B', 2: 's', 3: 'H', 4: 'I'}
+
+def _tiff_pages(inf):
+    with open(inf, 'rb') as f:
+        order = {b'II': '<', b'MM': '>'}.get(f.read(2))
+        if order is None or struct.unpack(order + 'H', f.read(2))[0] != 42:
+            raise LoadError(inf, "Not a tiff file (or a BigTIFF, which is not supported)")
+        ifd = struct.unpack(order + 'I', f.read(4))[0]
+        pages = []
+        while ifd:
+            f.seek(ifd)
+            entries = [struct.unpack(order + 'HHI4s', f.read(12))
+                       for i in range(struct.unpack(order + 'H', f.read(2))[0])]
+            ifd = struct.unpack(order + 'I', f.read(4))[0]
+            pages.append({_tiff_tags[tag]: _tiff_value(f, order, typ, count, value)
+                          for tag, typ, count, value in entries
+                          if tag in _tiff_tags and typ in _tiff_types})
+    return order, pages
+
+def _tiff_value(f, order, typ, count, value):
+    nbytes = struct.calcsize(_tiff_types[typ]) * count
+    if nbytes > 4:
+        f.seek(struct.unpack(order + 'I', value)[0])
+        value = f.read(nbytes)
+    if typ == 2:
+        return value[:count].rstrip(b'\0').decode('latin-1')
+    return struct.unpack(order + _tiff_types[typ] * count, value[:nbytes])
+
+def _tiff_stack(inf):
+    order, pages = _tiff_pages(inf)
+    first = pages[0]
+    for page in pages:
+        if (page.get('compression', (1,))[0] != 1 or page.get('samples', (1,))[0] != 1
+                or 'tile_width' in page):
+            raise LoadError(inf, "Only uncompressed, single channel, stripped tiffs "
+                                 "can be memory mapped")
+        for key in ['width', 'length', 'bits', 'format']:
+            if page.get(key) != first.get(key):
+                raise LoadError(inf, "Pages of the tiff differ in {}".format(key))
+        ends = np.add(page['offsets'], page['counts'])
+        if (np.asarray(page['offsets'][1:]) != ends[:-1]).any():
+            raise LoadError(inf, "Strips of each tiff page must be contiguous")
+
+    kind = {1: 'u', 2: 'i', 3: 'f'}.get(first.get('format', (1,))[0])
+    # bits per sample defaults to 1 (bilevel images) when not given
+    bits = first.get('bits', (1,))[0]
+    if kind is None or bits % 8 != 0:
+        raise LoadError(inf, "Only whole byte integer or float pixels can be memory mapped")
+    dtype = np.dtype(order + kind + str(bits // 8))
+    shape = (first['length'][0], first['width'][0])
+    starts = np.array([page['offsets'][0] for page in pages])
+    mapped = np.memmap(inf, dtype=np.uint8, mode='r')
+    frame_strides = (shape[1] * dtype.itemsize, dtype.itemsize)
+    steps = np.diff(starts)
+    if len(pages) == 1 or (steps == steps[0]).all():
+        stride = steps[0] if len(pages) > 1 else 0
+        arr = np.ndarray((len(pages),) + shape, dtype, buffer=mapped, offset=starts[0],
+                         strides=(stride,) + frame_strides)
+    else:
+        # pages at irregular places in the file cannot be viewed as one array
+        arr = np.array([np.ndarray(shape, dtype, buffer=mapped, offset=start,
+                                   strides=frame_strides) for start in starts])
+    return arr, first.get('description')
+
+def load_stack(inf, spacing=None, medium_index=None, illum_wavelen=None,
+               illum_polarization=None, normals=None, name=None, shape=None, dtype=None,
+               offset=0):
+    """
+    Memory map a stack of frames from a multi-page tiff or raw binary file
+
+    Frames are not read until they are used and keep the file's data type
+    (usually an integer type), so very large acquisitions can be opened
+    and indexed without reading them all or converting them to float.
+
+    Parameters
+    ----------
+    inf : string
+        Tiff file (.tif or .tiff) with uncompressed, single channel pages
+        of the same size, or a raw file of frames stored back to back
+    spacing, medium_index, illum_wavelen, illum_polarization, normals, name
+        Metadata, as for load_image. For a tiff saved by holopy, metadata
+        not given here is taken from the file.
+    shape : (int, int)
+        Shape of each frame in a raw file (rows, columns)
+    dtype : numpy dtype
+        Type of each pixel in a raw file, e.g. '<u2' for little-endian 16 bit
+    offset : int
+        Number of header bytes before the first frame in a raw file
+
+    Returns
+    -------
+    stack : xarray.DataArray
+        Read-only (t, z, x, y) array backed by the file, like a time series
+        from HologramSeriesWriter. Pages of a tiff that are not evenly
+        spaced in the file cannot be mapped as one array and are read into
+        memory instead.
+    """
+    meta = {}
+    if os.path.splitext(inf)[1] in tiflist:
+        arr, description = _tiff_stack(inf)
+        try:
+            meta = load_metadata(description)
+        except (yaml.YAMLError, TypeError):
+            pass
+        if not isinstance(meta, dict) or attr_coords not in meta:
+            meta = {}
+    else:
+        if shape is None or dtype is None:
+            raise LoadError(inf, "shape and dtype are needed to read raw frames")
+        dtype = np.dtype(dtype)
+        nframes = (os.path.getsize(inf) - offset) // (dtype.itemsize * int(np.prod(shape)))
+        if nframes < 1:
+            raise LoadError(inf, "No complete frames after the {} byte header".format(offset))
+        arr = np.memmap(inf, dtype=dtype, mode='r', offset=offset,
+                        shape=(nframes,) + tuple(shape))
+
+    if spacing is None:
+        spacing = meta.get('spacing')
+    if spacing is None:
+        spacing = 1
+        warn("No pixel spacing provided. Setting spacing to 1, but any subsequent calculations will be wrong.")
+    if name is None:
+        name = meta.get('name') or os.path.splitext(os.path.split(inf)[-1])[0]
+    coords = make_coords((1,) + arr.shape[1:], spacing)
+    coords['t'] = np.arange(arr.shape[0])
+    stack = xr.DataArray(arr[:, np.newaxis], dims=['t', 'z', 'x', 'y'], coords=coords,
+                         name=name)
+
+    stored = unpack_attrs(meta) if meta else {}
+    given = {'medium_index': medium_index, 'illum_wavelen': illum_wavelen,
+             'illum_polarization': illum_polarization, 'normals': normals}
+    given = {key: val if val is not None else stored.get(key) for key, val in given.items()}
+    # update_metadata shares the memory map rather than reading the file
+    return update_metadata(stack, **given)
+
+def _image_paths(filepath, image_glob='*.tif'):
+    if isinstance(filepath, str):
+        if os.path.isdir(filepath):
+            paths = sorted(glob.glob(os.path.join(filepath, image_glob)))
+        elif glob.has_magic(filepath):
+            paths = sorted(glob.glob(filepath))
+        else:
+            #only a single image
+            paths = [filepath]
+    else:
+        paths = list(filepath)
+    if len(paths) < 1:
+        raise LoadError(filepath, "No images found")
+    return paths
+
+def iter_images(filepath, spacing=None, medium_index=None, illum_wavelen=None,
+                illum_polarization=None, normals=None, channel=None, image_glob='*.tif',
+                prefetch=4, workers=2):
+    """
+    Load images one at a time, reading ahead in background threads
+
+    Images are read and decoded by a pool of threads up to prefetch images
+    ahead of the one being used, so processing each image overlaps with
+    loading the next ones.
+
+    Parameters
+    ----------
+    filepath : string or list(string)
+        Directory, glob pattern (e.g. 'run1/*.tif') or list of filenames. A
+        directory yields the images in it matching image_glob. Directories and
+        patterns are read in sorted order.
+    spacing, medium_index, illum_wavelen, illum_polarization, normals, channel
+        As for load_image, applied to every image
+    image_glob : string
+        Glob used to select images (if filepath is a directory)
+    prefetch : int
+        Maximum number of images loaded ahead of the one being used
+    workers : int
+        Number of threads loading images
+
+    Yields
+    ------
+    image : xarray.DataArray
+        The images, in order
+    """
+    paths = _image_paths(filepath, image_glob)
+
+    def load_one(path):
+        return load_image(path, spacing, medium_index, illum_wavelen, illum_polarization,
+                          normals, channel)
+
+    executor = ThreadPoolExecutor(max(workers, 1))
+    pending = deque()
+    try:
+        paths = iter(paths)
+        for path in paths:
+            pending.append(executor.submit(load_one, path))
+            if len(pending) >= max(prefetch, 1):
+                break
+        while pending:
+            image = pending.popleft().result()
+            for path in paths:
+                pending.append(executor.submit(load_one, path))
+                break
+            yield image
+    finally:
+        # stop reading ahead if the caller stops early
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+def load_average(filepath, refimg=None, spacing=None, medium_index=None, illum_wavelen=None, illum_polarization=None, normals=None, channel=None, image_glob='*.tif', method='mean', bins=64, chunk_bytes=2**27, prefetch=4, workers=2):
     """
     Average a set of images (usually as a background)
 
+    Images are streamed through iter_images, so only a few are in memory at
+    a time whichever method is used.
+
     Parameters
     ----------
     filepath : string or list(string)
@@ -338,6 +728,24 @@ def load_average(filepath, refimg=None, spacing=None, medium_index=None, illum_w
         Orientation of detector. Used preferentially over refimg value if both are provided.
     image_glob : string
         Glob used to select images (if images is a directory)
+    method : 'mean', 'median' or 'approx_median'
+        How to combine the images. A median rejects particles that move
+        between images. 'median' is exact; it writes the images to a
+        temporary file and takes the median of a block of pixels at a time.
+        'approx_median' reads the images at least twice instead,
+        interpolating each pixel's median from a histogram of its values.
+    bins : int
+        Number of histogram bins per pixel for 'approx_median'. The result is
+        within (max - min) / bins of the exact median of each pixel.
+    chunk_bytes : int
+        Memory to use for each block of pixels for 'median', and for the
+        histograms of 'approx_median'. Histograms take bins bytes per pixel
+        (twice that for 256 or more images, four times for 65536 or more),
+        and the images are read once more for each block of pixels whose
+        histograms fit in chunk_bytes.
+    prefetch, workers : int
+        Read-ahead and number of threads for loading images, as for
+        iter_images
 
     Returns
     -------
@@ -345,24 +753,92 @@ def load_average(filepath, refimg=None, spacing=None, medium_index=None, illum_w
         Image which is an average of images
     """
 
-    if isinstance(filepath, str):
-        if os.path.isdir(filepath):
-            filepath = glob.glob(os.path.join(filepath, image_glob))
-        else:
-            #only a single image
-            filepath=[filepath]
-
-    if len(filepath) < 1:
-        raise LoadError(filepath, "No images found")
+    filepath = _image_paths(filepath, image_glob)
 
     if is_none(spacing):
         spacing = get_spacing(refimg)
-    
-    accumulator = load_image(filepath[0],spacing, channel=channel)
-    for image in filepath[1:]:
-        accumulator += load_image(image, spacing,channel=channel)
-    accumulator /= len(filepath)
+
+    def images():
+        return iter_images(filepath, spacing, channel=channel, prefetch=prefetch,
+                           workers=workers)
+
+    if method == 'mean':
+        accumulator = _stream_mean(images())
+    elif method == 'median':
+        accumulator = _stream_median(images(), len(filepath), chunk_bytes)
+    elif method == 'approx_median':
+        accumulator = _stream_approx_median(images, bins, chunk_bytes)
+    else:
+        raise ValueError("Unknown method {}, use 'mean', 'median' or "
+                         "'approx_median'".format(method))
 
     if not is_none(refimg):
         accumulator = update_metadata(accumulator, refimg.medium_index, refimg.illum_wavelen, refimg.illum_polarization, refimg.normals)    
     return update_metadata(accumulator, medium_index, illum_wavelen, illum_polarization, normals)
+
+def _stream_mean(images):
+    for n, image in enumerate(images, 1):
+        if n == 1:
+            first = image
+            total = image.values.astype(float)
+        else:
+            total += image.values
+    return first.copy(data=total / n)
+
+def _stream_median(images, n, chunk_bytes):
+    with tempfile.TemporaryFile() as f:
+        for i, image in enumerate(images):
+            if i == 0:
+                first = image
+                stack = np.memmap(f, dtype=image.dtype, mode='w+', shape=(n, image.size))
+            stack[i] = image.values.ravel()
+        columns = max(1, chunk_bytes // (n * stack.itemsize))
+        median = np.empty(stack.shape[1])
+        for start in range(0, stack.shape[1], columns):
+            median[start:start+columns] = np.median(stack[:, start:start+columns], axis=0)
+        del stack
+    return first.copy(data=median.reshape(first.shape))
+
+def _stream_approx_median(images, bins, chunk_bytes):
+    # first pass for the range of each pixel
+    for n, image in enumerate(images(), 1):
+        if n == 1:
+            first = image
+            lower = image.values.ravel().astype(float)
+            upper = lower.copy()
+        else:
+            np.minimum(lower, image.values.ravel(), out=lower)
+            np.maximum(upper, image.values.ravel(), out=upper)
+    width = (upper - lower) / bins
+    # counts go up to n, so keep them in the smallest type that holds it
+    count_type = np.min_scalar_type(n)
+    columns = max(1, chunk_bytes // (bins * count_type.itemsize))
+    median = np.empty(len(lower))
+    # then one more pass per block of pixels for their histograms
+    for start in range(0, len(lower), columns):
+        block = slice(start, start + columns)
+        median[block] = _approx_median_block(images(), block, n, lower[block], width[block],
+                                             np.zeros((bins, len(median[block])), count_type))
+    return first.copy(data=median.reshape(first.shape))
+
+def _approx_median_block(images, block, n, lower, width, counts):
+    bins = len(counts)
+    safe_width = np.where(width > 0, width, 1)
+    pixels = np.arange(counts.shape[1])
+    for image in images:
+        b = np.clip(((image.values.ravel()[block] - lower) / safe_width).astype(int), 0, bins - 1)
+        # each pixel appears once, so there are no repeated indices
+        counts[b, pixels] += 1
+
+    cumulative = np.cumsum(counts, axis=0, out=counts)
+
+    def order_statistic(k):
+        # the k'th smallest value is in the first bin with more than k values
+        # at or below it, place it in proportion to its rank within that bin
+        k_bin = np.argmax(cumulative > k, axis=0)
+        below = np.where(k_bin > 0, cumulative[k_bin - 1, pixels], 0)
+        in_bin = cumulative[k_bin, pixels] - below
+        return lower + (k_bin + (k - below + .5) / in_bin) * width
+
+    # like np.median, average the middle two values for an even number
+    return (order_statistic((n - 1) // 2) + order_statistic(n // 2)) / 2
@@ -26,6 +26,8 @@ analysis procedures.
 .. moduleauthor:: Tom Dimiduk <tdimiduk@physics.harvard.edu>
 """
 
+import os
+import tempfile
 import numpy as np
 import yaml
 from yaml.reader import ReaderError
@@ -33,20 +35,141 @@ import inspect
 import types
 
 from ..utils import is_none
-from ..holopy_object import SerializableMetaclass
+from ..holopy_object import SerializableMetaclass, Loader, Dumper
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
-def save(outf, obj):
+# arrays with at least this many elements are saved to a binary file next to
+# the yaml instead of as yaml lists
+sidecar_size = 10000
+
+def save(outf, obj, min_sidecar_size=None):
+    """
+    Save obj as yaml
+
+    When saving to a named file, numeric arrays with at least
+    min_sidecar_size (default sidecar_size) elements are written to a binary
+    file alongside it, named by adding '.arrays' to the file name, and the
+    yaml refers to them there. Keep the two files together. A sidecar used by
+    the yaml file being overwritten is replaced, or removed if there are no
+    large arrays this time.
+    """
     if isinstance(outf, str):
-        outf = open(outf, 'wb')
+        stale = _uses_sidecar(outf)
+        with open(outf, 'wb') as f:
+            return _save(f, obj, min_sidecar_size, stale)
+    return _save(outf, obj, min_sidecar_size)
+
+def _uses_sidecar(filename):
+    # whether the (yaml) file refers to arrays in its sidecar
+    try:
+        with open(filename, 'rb') as f:
+            return os.path.basename(filename + '.arrays').encode() in f.read()
+    except OSError:
+        return False
 
-    outf.write(yaml.dump(obj).encode())
+def _save(outf, obj, min_sidecar_size, stale_sidecar=False):
+    name = getattr(outf, 'name', None)
+    if not isinstance(name, str):
+        outf.write(yaml.dump(obj, Dumper=Dumper).encode())
+        return
+    if min_sidecar_size is None:
+        min_sidecar_size = sidecar_size
+    sidecar = ArraySidecar(name + '.arrays', min_sidecar_size, stale_sidecar)
+    dumper = type('SidecarDumper', (Dumper,), {'sidecar': sidecar})
+    try:
+        outf.write(yaml.dump(obj, Dumper=dumper).encode())
+    except BaseException:
+        sidecar.discard()
+        raise
+    sidecar.close()
 
 def load(inf):
     if isinstance(inf, str):
-        with open(inf, mode='rb') as inf:
-            return yaml.load(inf)
-    else:
-        return yaml.load(inf)
+        with open(inf, mode='rb') as f:
+            return load(f)
+    name = getattr(inf, 'name', None)
+    if isinstance(name, str):
+        # look for array sidecars next to the yaml file
+        loader = type('SidecarLoader', (Loader,),
+                      {'sidecar_dir': os.path.dirname(os.path.abspath(name))})
+        return yaml.load(inf, Loader=loader)
+    return yaml.load(inf, Loader=Loader)
+
+class ArraySidecar(object):
+    """
+    Binary file holding the large arrays of a yaml file
+
+    Arrays are written back to back (aligned to 64 bytes) as raw C ordered
+    data, so they can be memory mapped when the yaml is loaded. Arrays are
+    written to a temporary file that replaces filename on close, because
+    arrays loaded from an earlier version of the file may still be memory
+    mapped from it (and may be the very arrays being saved).
+
+    Parameters
+    ----------
+    filename : str
+        The sidecar file
+    min_size : int
+        Numeric arrays with at least this many elements go to the sidecar
+    stale : bool
+        Whether an existing filename belongs to the yaml being overwritten,
+        so it should be removed if no arrays are written. Otherwise it is
+        left alone.
+    """
+    def __init__(self, filename, min_size, stale=False):
+        self.filename = filename
+        self.min_size = min_size
+        self.stale = stale
+        self._file = None
+        self._tempname = None
+        self._offset = 0
+
+    def wants(self, array):
+        return array.size >= self.min_size and array.dtype.kind in 'biufc'
+
+    def add(self, array):
+        """
+        Write array to the file and return a description to put in the yaml
+        """
+        if self._file is None:
+            fd, self._tempname = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.filename)),
+                prefix=os.path.basename(self.filename), suffix='.tmp')
+            self._file = os.fdopen(fd, 'wb')
+        array = np.ascontiguousarray(array)
+        padding = -self._offset % 64
+        self._file.write(b'\0' * padding)
+        self._offset += padding
+        description = {'file': os.path.basename(self.filename), 'offset': self._offset,
+                       'dtype': array.dtype.str, 'shape': list(array.shape)}
+        self._file.write(array.tobytes())
+        self._offset += array.nbytes
+        return description
+
+    def close(self):
+        """
+        Move the written arrays into place, or remove a stale sidecar if
+        there were none
+        """
+        if self._file is None:
+            if self.stale and os.path.exists(self.filename):
+                os.remove(self.filename)
+            return
+        self._file.close()
+        self._file = None
+        os.replace(self._tempname, self.filename)
+
+    def discard(self):
+        """
+        Throw away the written arrays, leaving any existing sidecar alone
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self._tempname)
 
 def _pickle_method(method):
     func_name = method.__func__.__name__
@@ -66,6 +189,16 @@ copyreg.pickle(types.MethodType, _pickle_method, _unpickle_method)
 # Custom Yaml Representers
 ###################################################################
 
+# register with the default yaml classes too, so yaml.dump and yaml.load
+# keep working on holopy objects
+def _add_representer(data_type, representer):
+    for dumper in {yaml.Dumper, Dumper}:
+        dumper.add_representer(data_type, representer)
+
+def _add_constructor(tag, constructor):
+    for loader in {yaml.Loader, Loader}:
+        loader.add_constructor(tag, constructor)
+
 def ignore_aliases(data):
     try:
         # numpy arrays no longer want to be compared to None, so instead check for a none by looking for if it is an instance of NoneType
@@ -79,46 +212,58 @@ yaml.representer.SafeRepresenter.ignore_aliases = \
     staticmethod(ignore_aliases)
 
 # Represent 1d ndarrays as lists in yaml files because it makes them much
-# prettier
+# prettier. Large arrays go to the sidecar file when saving to a file.
 def ndarray_representer(dumper, data):
+    sidecar = getattr(dumper, 'sidecar', None)
+    if sidecar is not None and sidecar.wants(data):
+        return dumper.represent_mapping('!array', sidecar.add(data))
     return dumper.represent_list(data.tolist())
-yaml.add_representer(np.ndarray, ndarray_representer)
+_add_representer(np.ndarray, ndarray_representer)
+_add_representer(np.memmap, ndarray_representer)
+
+def array_constructor(loader, node):
+    description = loader.construct_mapping(node, deep=True)
+    filename = os.path.join(getattr(loader, 'sidecar_dir', ''), description['file'])
+    # copy on write, so changing the loaded array does not change the file
+    return np.memmap(filename, dtype=np.dtype(description['dtype']), mode='c',
+                     offset=description['offset'], shape=tuple(description['shape']))
+_add_constructor('!array', array_constructor)
 
 # represent tuples as lists because yaml doesn't have tuples
 def tuple_representer(dumper, data):
     return dumper.represent_list(list(data))
-yaml.add_representer(tuple, tuple_representer)
+_add_representer(tuple, tuple_representer)
 
 # represent numpy types as things that will print more cleanly
 def complex_representer(dumper, data):
     return dumper.represent_scalar('!complex', repr(data.tolist()))
-yaml.add_representer(np.complex128, complex_representer)
+_add_representer(np.complex128, complex_representer)
 def complex_constructor(loader, node):
     return complex(node.value)
-yaml.add_constructor('!complex', complex_constructor)
+_add_constructor('!complex', complex_constructor)
 
 def numpy_float_representer(dumper, data):
     return dumper.represent_float(float(data))
-yaml.add_representer(np.float64, numpy_float_representer)
+_add_representer(np.float64, numpy_float_representer)
 
 def numpy_int_representer(dumper, data):
     return dumper.represent_int(int(data))
-yaml.add_representer(np.int64, numpy_int_representer)
-yaml.add_representer(np.int32, numpy_int_representer)
+_add_representer(np.int64, numpy_int_representer)
+_add_representer(np.int32, numpy_int_representer)
 
 def numpy_dtype_representer(dumper, data):
     return dumper.represent_scalar('!dtype', data.name)
-yaml.add_representer(np.dtype, numpy_dtype_representer)
+_add_representer(np.dtype, numpy_dtype_representer)
 
 def numpy_dtype_loader(loader, node):
     name = loader.construct_scalar(node)
     return np.dtype(name)
-yaml.add_constructor('!dtype', numpy_dtype_loader)
+_add_constructor('!dtype', numpy_dtype_loader)
 
 def class_representer(dumper, data):
     return dumper.represent_scalar('!class', "{0}.{1}".format(data.__module__,
                                                               data.__name__))
-yaml.add_representer(SerializableMetaclass, class_representer)
+_add_representer(SerializableMetaclass, class_representer)
 
 def class_loader(loader, node):
     name = loader.construct_scalar(node)
@@ -127,14 +272,14 @@ def class_loader(loader, node):
     for t in tok[1:]:
         mod = mod.__getattribute__(t)
     return mod
-yaml.add_constructor('!class', class_loader)
+_add_constructor('!class', class_loader)
 
 def instancemethod_representer(dumper, data):
     func = data.__func__.__name__
     obj = data.__self__
     if isinstance(obj, SerializableMetaclass):
         obj = obj()
-    rep = yaml.dump(obj)
+    rep = yaml.dump(obj, Dumper=Dumper)
     # if the obj has arguments, we need to switch it to flow style so that it is
     # emitted properly
     tok = rep.split('\n')
@@ -143,13 +288,13 @@ def instancemethod_representer(dumper, data):
     if len(tok) > 2:
         rep = '{0} {{{1}}}'.format(tok[0], ', '.join(tok[1:]))
     return dumper.represent_scalar('!method', "{0} of {1}".format(func, rep))
-yaml.add_representer(types.MethodType, instancemethod_representer)
+_add_representer(types.MethodType, instancemethod_representer)
 
 def instancemethod_constructor(loader, node):
     name = loader.construct_scalar(node)
     tok = name.split('of')
     method = tok[0].strip()
     obj = 'dummy: '+ tok[1]
-    obj = yaml.load(obj)['dummy']
+    obj = yaml.load(obj, Loader=Loader)['dummy']
     return getattr(obj, method)
-yaml.add_constructor('!method', instancemethod_constructor)
+_add_constructor('!method', instancemethod_constructor)
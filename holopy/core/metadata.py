@@ -22,11 +22,13 @@ Classes for defining metadata about experimental or calculated results.
 
 """
 
+import hashlib
 import numpy as np
 import xarray as xr
 from warnings import warn
-from .utils import is_none, updated, repeat_sing_dims
+from .utils import is_none, updated, repeat_sing_dims, LRUCache
 from .math import to_spherical, to_cartesian
+from .holopy_object import HoloPyObject
 
 
 vector = 'vector'
@@ -158,9 +160,12 @@ def detector_points(coords = {}, x = None, y = None, z = None, r = None, theta =
     attrs = {'normals': default_norms(coords, normals)}
     return xr.DataArray(np.zeros(len(coords[keys[0]][1])), dims = ['point'], coords = coords, attrs = attrs, name = name)
 
-def update_metadata(a, medium_index=None, illum_wavelen=None, illum_polarization=None, normals=None):
+def update_metadata(a, medium_index=None, illum_wavelen=None, illum_polarization=None, normals=None, deep=False):
     """Returns a copy of an image with updated metadata in its 'attrs' field.
 
+    The copy shares its data with the input unless deep is True, only the
+    attrs are new.
+
     Parameters
     ----------
     a : xarray.DataArray
@@ -173,6 +178,8 @@ def update_metadata(a, medium_index=None, illum_wavelen=None, illum_polarization
         Updated polarization of illumination in the image.
     normals : list-like
         Updated detector orientation of the image.
+    deep : bool
+        Also copy the data, so the result can be changed without changing a.
    
     Returns
     -------
@@ -181,7 +188,7 @@ def update_metadata(a, medium_index=None, illum_wavelen=None, illum_polarization
     """
 
     attrlist = {'medium_index': medium_index, 'illum_wavelen': illum_wavelen, 'illum_polarization': to_vector(illum_polarization), 'normals': to_vector(normals)}
-    b = a.copy()
+    b = a.copy(deep=deep)
     b.attrs = updated(b.attrs, attrlist)
 
     for attr in attrlist:
@@ -193,7 +200,13 @@ def update_metadata(a, medium_index=None, illum_wavelen=None, illum_polarization
 
     return b
 
-def copy_metadata(old, new, do_coords=True):
+def copy_metadata(old, new, do_coords=True, deep=False):
+    """
+    Give new the attrs, name (and coordinate names) of old
+
+    new is changed and returned without copying its data, unless deep is
+    True, in which case a copy of new is changed instead.
+    """
     def find_and_rename(oldkey, oldval):
         for newkey, newval in new.coords.items():
             if np.array_equal(oldval.values, newval.values):
@@ -204,6 +217,8 @@ def copy_metadata(old, new, do_coords=True):
         if not hasattr(new,'coords'):
             #new is a numpy array, not xarray
             new=xr.DataArray(new, dims=['x', 'y'])
+        if deep:
+            new = new.copy(deep=True)
         new.attrs = old.attrs
         new.name = old.name
 
@@ -257,12 +272,306 @@ def sphere_coords(a, origin=(0,0,0), wavevec=1):
         out = to_spherical(x,y,z)
         return updated(out, {'r':out['r'] * wavevec, dimstr:f[dimstr]})
 
+class DetectorGeometry(object):
+    """
+    Pixel positions of a detector, prepared once for repeated calculations
+
+    Computing scattering at a detector needs the position of every pixel as a
+    flat list and the coordinates to label the result with. Building these
+    from an xarray (stacking, pulling out coordinates) costs as much every
+    time. FlatDetector and Schema make their geometry once and keep it, and
+    detector_geometry shares one between xarray detectors with the same
+    coordinates, so calculations only shift it to each scatterer's center.
+
+    Parameters
+    ----------
+    schema : xarray.DataArray
+        Detector or data to prepare
+
+    Attributes
+    ----------
+    dimstr : str
+        Name of the flattened dimension ('flat' or 'point')
+    points : array (3, N) or None
+        x, y, z of each pixel, None for detectors given in spherical
+        coordinates
+    normals : array or None
+        Values of the schema's normals
+    coords : dict
+        Coordinates for an array of per pixel vectors, as used by the
+        theories' _calc_field
+    """
+    def __init__(self, schema):
+        f = flat(schema)
+        self.dimstr = primdim(f)
+        npoints = f.sizes[self.dimstr]
+        normals = getattr(schema, 'normals', None)
+        self.normals = None if is_none(normals) else np.asarray(get_values(normals))
+
+        def readonly(arr):
+            return _readonly(np.array(np.broadcast_to(arr, (npoints,))))
+
+        if hasattr(f, 'theta') and hasattr(f, 'phi'):
+            self.points = None
+            r = f.r.values if hasattr(f, 'r') else None
+            if r is not None and not np.any(np.isfinite(r)):
+                r = None
+            self._spherical = [None if r is None else readonly(r),
+                               readonly(f.theta.values), readonly(f.phi.values)]
+        else:
+            self.points = _readonly(np.vstack([np.broadcast_to(f[c].values, (npoints,))
+                                               for c in ('x', 'y', 'z')]))
+
+        index = f[self.dimstr]
+        self.coords = {key: (self.dimstr, readonly(val.values))
+                       for key, val in index.coords.items() if key != self.dimstr}
+        self.coords[self.dimstr] = index.variable
+        self.coords[vector] = ['x', 'y', 'z']
+
+    @property
+    def size(self):
+        return self.coords[self.dimstr].size
+
+    def spherical(self, origin, wavevec=1):
+        """
+        r, theta, phi of each pixel as seen from origin
+
+        Parameters
+        ----------
+        origin : (float, float, float)
+            Position (usually a scatterer's center) to measure from
+        wavevec : float
+            r is returned in units of 1/wavevec
+
+        Returns
+        -------
+        positions : array (3, N)
+            r, theta, phi stacked as the theories' _raw_fields take them,
+            with r infinite for far field detectors
+        """
+        if self.points is None:
+            r, theta, phi = self._spherical
+            r = np.repeat(np.inf, self.size) if r is None else r * wavevec
+            return np.vstack((r, theta, phi))
+        if origin is None:
+            raise ValueError('Cannot convert detector to spherical coordinates without an origin')
+        x, y, z = self.points
+        # we define positive z opposite light propagation, so we have to invert
+        out = to_spherical(x - origin[0], y - origin[1], origin[2] - z)
+        return np.vstack((out['r'] * wavevec, out['theta'], out['phi']))
+
+# geometries of the last few xarray detectors, see detector_geometry
+_geometry_cache = LRUCache(4)
+
+def _geometry_key(schema):
+    def digest(a):
+        a = np.ascontiguousarray(a)
+        return a.dtype.str, a.shape, hashlib.sha1(a.view(np.uint8)).hexdigest()
+    # a stacked index is an object array, but the levels it is built from
+    # are coordinates too
+    coords = tuple((name, var.dims, digest(var.values))
+                   for name, var in sorted(schema.coords.items())
+                   if var.dtype != object)
+    normals = getattr(schema, 'normals', None)
+    normals = None if is_none(normals) else digest(get_values(normals))
+    return schema.dims, schema.shape, coords, normals
+
+def detector_geometry(schema):
+    """
+    The DetectorGeometry of an xarray detector, shared between detectors with
+    the same coordinates
+
+    Calculations on a plain DataArray (rather than a Schema or FlatDetector)
+    get the geometry from here, so repeating a calculation on the same
+    detector, or a copy of it, does not flatten it again. Only the
+    coordinates are compared, hashing them is much cheaper than rebuilding
+    the geometry.
+    """
+    if isinstance(schema, Schema):
+        return schema.geometry
+    key = _geometry_key(schema)
+    geometry = _geometry_cache.get(key)
+    if geometry is None:
+        geometry = DetectorGeometry(schema)
+        _geometry_cache.put(key, geometry)
+    return geometry
+
+class Schema(HoloPyObject):
+    """
+    Compact, unchangeable description of a rectangular detector and its optics
+
+    A Schema can be used anywhere a detector_grid is used as a schema. It
+    holds no array of values, and because it cannot change its flattened
+    pixel positions are worked out once and kept. calc_holo then runs on
+    plain arrays, and only wraps its result in an xarray. This avoids the
+    copying, alignment and stacking of xarray schemas in every calculation.
+
+    Parameters
+    ----------
+    shape : int or (int, int)
+        Number of pixels along x and y
+    spacing : float or (float, float)
+        Distance between adjacent pixels along x and y
+    origin : (float, float, float)
+        x and y of the first pixel, and z of the detector
+    medium_index, illum_wavelen, illum_polarization : optional
+        Optical metadata, as for update_metadata
+    normals : (float, float, float)
+        Detector orientation
+    name : str
+        Name of arrays made from this schema
+
+    Notes
+    -----
+    to_dataarray gives the equivalent detector_grid (or data, if values are
+    given), and Schema.from_dataarray describes an existing one. Use like_me
+    to make a schema with some parameters changed.
+    """
+    def __init__(self, shape, spacing, origin=(0, 0, 0), medium_index=None, illum_wavelen=None,
+                 illum_polarization=None, normals=(0, 0, 1), name='data'):
+        if np.isscalar(shape):
+            shape = np.repeat(shape, 2)
+        if np.isscalar(spacing):
+            spacing = np.repeat(spacing, 2)
+        self.shape = tuple(int(s) for s in shape)
+        self.spacing = tuple(float(s) for s in spacing)
+        self.origin = tuple(float(o) for o in origin)
+        self.medium_index = medium_index
+        self.illum_wavelen = illum_wavelen
+        self.illum_polarization = _readonly_vector(illum_polarization)
+        self.normals = _readonly_vector(normals)
+        self.name = name
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if self.__dict__.get('_frozen', False):
+            raise AttributeError("Schema cannot be changed, use like_me to make a new one")
+        super().__setattr__(name, value)
+
+    def _iteritems(self):
+        for key, val in super()._iteritems():
+            yield key, list(val) if isinstance(val, tuple) else val
+
+    def __getstate__(self):
+        # cached arrays are quick to make again, so don't pickle them
+        return {key: val for key, val in self.__dict__.items()
+                if not key.startswith('_') or key == '_frozen'}
+
+    def _cached(self, name, make):
+        # Schemas do not change, so anything derived from them can be kept
+        if name not in self.__dict__:
+            self.__dict__[name] = make()
+        return self.__dict__[name]
+
+    @property
+    def x(self):
+        return self._cached('_x', lambda: _readonly(self.origin[0] + np.arange(self.shape[0]) * self.spacing[0]))
+
+    @property
+    def y(self):
+        return self._cached('_y', lambda: _readonly(self.origin[1] + np.arange(self.shape[1]) * self.spacing[1]))
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+    @property
+    def geometry(self):
+        """
+        The DetectorGeometry of this schema, made once and kept
+        """
+        return self._cached('_geometry', lambda: DetectorGeometry(self._dataarray()))
+
+    @property
+    def points(self):
+        """
+        x, y, z of each pixel as an array (3, N), in the order of flat()
+        """
+        return self.geometry.points
+
+    @property
+    def weights(self):
+        """
+        1 - normals, the weight of each field component in a hologram
+        """
+        return self._cached('_weights', lambda: _readonly(1 - self.normals))
+
+    def to_dataarray(self, values=None):
+        """
+        The detector_grid (or data) this schema describes
+
+        Parameters
+        ----------
+        values : array (optional)
+            Values at each pixel, of shape self.shape or flattened in the
+            order of flat(). Zeros if not given.
+
+        Returns
+        -------
+        DataArray
+            Dimensions z, x, y with this schema's coordinates and metadata
+        """
+        if values is None:
+            values = np.zeros(self.shape)
+        coords = self._cached('_coords', lambda: {'z': np.array([self.origin[2]]),
+                                                  'x': self.x, 'y': self.y})
+        attrs = self._cached('_attrs', lambda: {
+            'medium_index': self.medium_index, 'illum_wavelen': self.illum_wavelen,
+            'illum_polarization': to_vector(self.illum_polarization),
+            'normals': to_vector(self.normals)})
+        return xr.DataArray(np.reshape(values, (1,) + self.shape), dims=['z', 'x', 'y'],
+                            coords=coords, attrs=dict(attrs), name=self.name)
+
+    def _dataarray(self):
+        # one xarray version of the schema, shared by the calculations that
+        # need one
+        return self._cached('_schema_dataarray', self.to_dataarray)
+
+    @classmethod
+    def from_dataarray(cls, a):
+        """
+        Describe a detector_grid (or data on one) as a Schema
+
+        Raises
+        ------
+        ValueError
+            If a is not a single evenly spaced grid of pixels in one plane
+            with a single normal
+        """
+        if (not set(a.dims) <= {'x', 'y', 'z'} or
+            not all(hasattr(a, c) for c in ('x', 'y', 'z')) or a.z.size != 1):
+            raise ValueError("Only a single evenly spaced grid of pixels can be a Schema")
+        normals = getattr(a, 'normals', None)
+        if is_none(normals):
+            normals = (0, 0, 1)
+        elif np.shape(get_values(normals)) != (3,):
+            raise ValueError("Only detectors with a single normal can be a Schema")
+        return cls(shape=(a.x.size, a.y.size), spacing=get_spacing(a),
+                   origin=(a.x.values[0], a.y.values[0], np.ravel(a.z.values)[0]),
+                   medium_index=getattr(a, 'medium_index', None),
+                   illum_wavelen=getattr(a, 'illum_wavelen', None),
+                   illum_polarization=getattr(a, 'illum_polarization', None),
+                   normals=normals, name=a.name)
+
+def _readonly(arr):
+    arr.setflags(write=False)
+    return arr
+
+def _readonly_vector(c):
+    if is_none(c):
+        return None
+    c = np.array(get_values(c))
+    if c.shape == (2,):
+        c = np.append(c, 0)
+    return _readonly(c)
+
 def get_values(a):
     return getattr(a, 'values', a)
 
 def primdim(a):
     if isinstance(a, xr.DataArray):
-        a = a.coords
+        # a point dimension need not have a coordinate of its own
+        a = set(a.coords) | set(a.dims)
     if 'flat' in a:
         return 'flat'
     if 'point' in a:
@@ -28,7 +28,6 @@ or detrending
 from ..errors import BadImage
 from ..metadata import copy_metadata, detector_grid, get_spacing, get_values
 from ..utils import is_none
-from scipy.signal import detrend as dt
 from scipy import fftpack
 from scipy.ndimage import gaussian_filter
 import numpy as np
@@ -66,6 +65,8 @@ def detrend(image):
     image : ndarray
        Image with linear trends removed
     '''
+    # scipy.signal is slow to import, so only import it when it is needed
+    from scipy.signal import detrend as dt
     return copy_metadata(image, dt(dt(image, image.dims.index('x')), image.dims.index('y')))
 
 def zero_filter(image):
@@ -0,0 +1,56 @@
+# Copyright 2011-2016, Vinothan N. Manoharan, Thomas G. Dimiduk,
+# Rebecca W. Perry, Jerome Fung, Ryan McGorty, Anna Wang, Solomon Barkley
+#
+# This file is part of HoloPy.
+#
+# HoloPy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HoloPy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HoloPy.  If not, see <http://www.gnu.org/licenses/>.
+
+import subprocess
+import sys
+
+from numpy.testing import assert_equal
+
+import holopy
+
+# generous, importing holopy itself should take a few ms
+import_budget = 1.0
+
+def test_import_is_lazy():
+    code = ("import sys, time\n"
+            "before = set(sys.modules)\n"
+            "start = time.time()\n"
+            "import holopy\n"
+            "print(time.time() - start)\n"
+            "print(' '.join(set(sys.modules) - before))\n")
+    out = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+    seconds, loaded = out.strip('\n').split('\n')
+    loaded = loaded.split()
+    for heavy in ['xarray', 'scipy', 'emcee', 'h5py', 'matplotlib', 'holopy.scattering',
+                  'holopy.inference']:
+        assert heavy not in loaded, heavy
+    assert float(seconds) < import_budget
+
+def test_core_import_skips_hdf5():
+    # h5netcdf (and h5py) are only needed once files are read or written.
+    # Some xarray versions import them anyway, so check that holopy.core
+    # imports without them rather than that they are not loaded
+    code = ("import sys\n"
+            "sys.modules['h5netcdf'] = sys.modules['h5py'] = None\n"
+            "import holopy.core\n")
+    subprocess.check_call([sys.executable, '-c', code])
+
+def test_lazy_attributes():
+    assert 'inference' in dir(holopy)
+    assert_equal(holopy.load, holopy.core.io.load)
+    assert_equal(holopy.propagate, holopy.propagation.propagate)
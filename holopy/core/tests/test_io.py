@@ -16,18 +16,24 @@
 # You should have received a copy of the GNU General Public License
 # along with HoloPy.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 import yaml
 import tempfile
 import os
 import shutil
 import numpy as np
-from numpy.testing import assert_equal, assert_allclose
+from numpy.testing import assert_equal, assert_allclose, assert_raises
 from nose.plugins.attrib import attr
 
 from .. import load, save, load_image, save_image
+from ..io import (HologramSeriesWriter, iter_images, get_example_data_path, load_stack,
+                  load_average)
+from ..io.io import pack_attrs, unpack_attrs, attr_coords
 from ..process import normalize
-from ..metadata import get_spacing
-from ..holopy_object import Serializable
+from ..metadata import get_spacing, update_metadata
+from ..holopy_object import Serializable, HoloPyObject
+from ..io import serialize
+from ..errors import LoadError
 from .common import (assert_obj_close, assert_read_matches_write, get_example_data)
 
 @attr('fast')
@@ -35,6 +41,145 @@ def test_hologram_io():
     holo = normalize(get_example_data('image0001'))
     assert_read_matches_write(holo)
 
+def test_hologram_series():
+    holo = normalize(get_example_data('image0001'))
+    t = tempfile.mkdtemp()
+    filename = os.path.join(t, 'series.h5')
+    frames = [holo.copy(data=holo.values * i) for i in range(4)]
+    writer = HologramSeriesWriter(filename, chunk_frames=2)
+    for i in range(3):
+        writer.write(frames[i], t=.1 * i)
+    # reopening appends to the same series
+    HologramSeriesWriter(filename).write(frames[3], t=.3)
+
+    series = load(filename)
+    assert_equal(series.dims, ('t',) + holo.dims)
+    assert_allclose(series.t, [0, .1, .2, .3])
+    assert_obj_close(series.isel(t=3).drop('t'), frames[3])
+
+    lazy = load(filename, lazy=True)
+    assert_equal(lazy.variable._in_memory, False)
+    assert_allclose(lazy.isel(t=2), frames[2])
+    assert_equal(lazy.illum_wavelen, holo.illum_wavelen)
+    shutil.rmtree(t)
+
+def test_hologram_series_mismatch():
+    holo = normalize(get_example_data('image0001'))
+    t = tempfile.mkdtemp()
+    filename = os.path.join(t, 'series.h5')
+    writer = HologramSeriesWriter(filename)
+    writer.write(holo)
+    # frames are stored in the series' dimension order
+    writer.write(holo.transpose(*holo.dims[::-1]) * 2)
+    assert_obj_close(load(filename).isel(t=1).drop('t'), holo * 2)
+
+    for writer in [writer, HologramSeriesWriter(filename)]:
+        with assert_raises(ValueError) as cm:
+            writer.write(holo.isel(x=slice(1, None)))
+        assert 'coordinate x' in str(cm.exception)
+        with assert_raises(ValueError) as cm:
+            writer.write(holo.values[:, 1:])
+        assert 'shape' in str(cm.exception)
+        with assert_raises(ValueError) as cm:
+            writer.write(holo.assign_coords(y=holo.y * 2))
+        assert 'coordinate y' in str(cm.exception)
+        with assert_raises(ValueError) as cm:
+            writer.write(update_metadata(holo, illum_wavelen=holo.illum_wavelen * 2))
+        assert 'illum_wavelen' in str(cm.exception)
+        with assert_raises(ValueError) as cm:
+            writer.write(update_metadata(holo, illum_polarization=(0, 1)))
+        assert 'illum_polarization' in str(cm.exception)
+        assert_raises(ValueError, writer.write, holo.isel(z=0))
+    assert_equal(load(filename).sizes['t'], 2)
+    shutil.rmtree(t)
+
+def test_iter_images():
+    paths = get_example_data_path(['bg01.jpg', 'bg02.jpg', 'bg03.jpg'])
+    pattern = os.path.join(os.path.dirname(paths[0]), 'bg0*.jpg')
+    images = list(iter_images(pattern, spacing=.1, illum_wavelen=.66, prefetch=1))
+    assert_equal(len(images), 3)
+    for path, image in zip(paths, images):
+        assert_obj_close(image, load_image(path, spacing=.1, illum_wavelen=.66))
+
+    # stopping early leaves no images loading in the background
+    frames = iter_images(paths, spacing=.1, workers=3)
+    assert_obj_close(next(frames), images[0])
+    frames.close()
+
+def test_load_stack():
+    from PIL import Image
+    frames = (np.arange(3*5*7) * 37 % 65000).astype('uint16').reshape(3, 5, 7)
+    t = tempfile.mkdtemp()
+    tif = os.path.join(t, 'stack.tif')
+    pages = [Image.fromarray(f) for f in frames]
+    pages[0].save(tif, save_all=True, append_images=pages[1:])
+    stack = load_stack(tif, spacing=.1, illum_wavelen=.66)
+    assert_equal(stack.dims, ('t', 'z', 'x', 'y'))
+    assert_equal(stack.dtype, np.uint16)
+    assert_equal(stack.values[:, 0], frames)
+    assert_equal(stack.illum_wavelen, .66)
+    # backed by the file, not a copy
+    assert not stack.values.flags.writeable
+
+    raw = os.path.join(t, 'stack.raw')
+    with open(raw, 'wb') as f:
+        f.write(b'header')
+        frames.tofile(f)
+    stack = load_stack(raw, spacing=.1, shape=(5, 7), dtype='uint16', offset=6)
+    assert_equal(stack.values[:, 0], frames)
+    assert_allclose(stack.x, np.arange(5) * .1)
+    assert not stack.values.flags.writeable
+    shutil.rmtree(t)
+
+def test_load_stack_errors():
+    from PIL import Image
+    t = tempfile.mkdtemp()
+    rgb = os.path.join(t, 'rgb.tif')
+    Image.new('RGB', (7, 5)).save(rgb)
+    packed = os.path.join(t, 'packed.tif')
+    Image.new('L', (7, 5)).save(packed, compression='packbits')
+    binary = os.path.join(t, 'binary.tif')
+    Image.new('1', (7, 5)).save(binary)
+    for tif in [rgb, packed, binary]:
+        with assert_raises(LoadError) as cm:
+            load_stack(tif, spacing=.1)
+        assert_equal(cm.exception.filename, tif)
+
+    raw = os.path.join(t, 'stack.raw')
+    np.zeros((2, 5, 7), dtype='uint16').tofile(raw)
+    with assert_raises(LoadError) as cm:
+        load_stack(raw, spacing=.1)
+    assert 'shape and dtype' in str(cm.exception)
+    open(raw, 'wb').close()
+    assert_raises(LoadError, load_stack, raw, spacing=.1, shape=(5, 7), dtype='uint16')
+    shutil.rmtree(t)
+
+def test_load_average():
+    paths = get_example_data_path(['bg01.jpg', 'bg02.jpg', 'bg03.jpg', 'image01.jpg'])
+    images = np.array([load_image(p, spacing=.1).values for p in paths])
+    assert_allclose(load_average(paths, spacing=.1), images.mean(axis=0))
+    median = load_average(paths, spacing=.1, method='median', chunk_bytes=1000)
+    assert_equal(median.values, np.median(images, axis=0))
+    approx = load_average(paths, spacing=.1, method='approx_median', bins=32)
+    bin_width = (images.max(axis=0) - images.min(axis=0)) / 32
+    assert (np.abs(approx - median) <= bin_width + 1e-12).all()
+    assert_equal(approx.name, 'bg01')
+    # histograms for a few pixels at a time give the same result
+    chunked = load_average(paths, spacing=.1, method='approx_median', bins=32,
+                           chunk_bytes=32 * 1000)
+    assert_allclose(chunked, approx)
+
+def test_metadata_encoding():
+    holo = get_example_data('image0001')
+    packed = pack_attrs(holo)
+    assert_equal(json.loads(packed[attr_coords])['illum_polarization'], {'vector': ['x', 'y', 'z']})
+    assert_obj_close(unpack_attrs(packed), holo.attrs)
+
+    # files written by older versions stored the coordinates as yaml
+    old = dict(packed)
+    old[attr_coords] = yaml.dump(json.loads(packed[attr_coords]))
+    assert_obj_close(unpack_attrs(old), holo.attrs)
+
 def test_image_io():
     holo = get_example_data('image0001')
 
@@ -113,3 +258,55 @@ Items are not equal:
             self.a = a
 
     assert yaml.dump(S('a')) == '!S {a: a}\n'
+
+class ArrayHolder(HoloPyObject):
+    def __init__(self, values, small):
+        self.values = values
+        self.small = small
+
+def test_array_sidecar():
+    t = tempfile.mkdtemp()
+    filename = os.path.join(t, 'holder.yaml')
+    holder = ArrayHolder(np.arange(50000.), np.arange(3))
+    save(filename, {'holder': holder, 'matrix': np.ones((200, 100), dtype='complex')})
+    # the yaml only refers to the big arrays
+    assert os.path.getsize(filename) < 1000
+    assert os.path.exists(filename + '.arrays')
+
+    loaded = load(filename)
+    assert isinstance(loaded['holder'].values, np.memmap)
+    assert_equal(loaded['holder'].values, holder.values)
+    assert_equal(loaded['holder'].small, [0, 1, 2])
+    assert_equal(loaded['matrix'], np.ones((200, 100), dtype='complex'))
+
+    # with a higher threshold everything stays in the yaml
+    serialize.save(filename, holder, min_sidecar_size=10**6)
+    assert_equal(load(filename).values, holder.values)
+    shutil.rmtree(t)
+
+def test_array_sidecar_resave():
+    t = tempfile.mkdtemp()
+    filename = os.path.join(t, 'holder.yaml')
+    holder = ArrayHolder(np.arange(50000.), np.arange(3))
+    save(filename, holder)
+    loaded = load(filename)
+    # saving arrays that are memory mapped from the sidecar being replaced
+    save(filename, ArrayHolder(loaded.values * 2, loaded.values))
+    assert_equal(loaded.values, holder.values)
+    resaved = load(filename)
+    assert_equal(resaved.values, holder.values * 2)
+    assert_equal(resaved.small, holder.values)
+    assert_equal(sorted(os.listdir(t)), ['holder.yaml', 'holder.yaml.arrays'])
+
+    # a save without large arrays does not leave a stale sidecar behind
+    save(filename, ArrayHolder(np.arange(3), np.arange(3)))
+    assert not os.path.exists(filename + '.arrays')
+    assert_equal(load(filename).values, [0, 1, 2])
+
+    # but a file of that name the yaml did not use is not its to remove
+    with open(filename + '.arrays', 'wb') as f:
+        f.write(b'other')
+    save(filename, ArrayHolder(np.arange(3), np.arange(3)))
+    with open(filename + '.arrays', 'rb') as f:
+        assert_equal(f.read(), b'other')
+    shutil.rmtree(t)
@@ -27,6 +27,7 @@ import shutil
 import errno
 import numpy as np
 from copy import copy
+from collections import OrderedDict
 import itertools
 
 def ensure_array(x):
@@ -130,3 +131,85 @@ def repeat_sing_dims(indict, keys = 'all'):
 
     return updated(indict, subdict)
 
+class LRUCache(object):
+    """
+    Small least recently used cache with hit statistics
+
+    Parameters
+    ----------
+    maxsize : int or None
+        Maximum number of entries to keep. When the cache is full the least
+        recently used entry is discarded. None for no limit on the number.
+    maxbytes : int (optional)
+        Maximum total size of the cached values (as counted by nbytes for
+        arrays, including arrays inside tuples and lists). Least recently
+        used entries are discarded to stay under it.
+    """
+    def __init__(self, maxsize=32, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.currbytes = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            entry = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        # reinsert so the entry becomes the most recently used
+        self._data[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value):
+        self._discard(key)
+        self._data[key] = (value, _nbytes(value))
+        self.currbytes += self._data[key][1]
+        while self._data and ((self.maxsize is not None and len(self._data) > self.maxsize) or
+                              (self.maxbytes is not None and self.currbytes > self.maxbytes)):
+            self._discard(next(iter(self._data)))
+            self.evictions += 1
+
+    def _discard(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.currbytes -= entry[1]
+
+    def discard(self, key):
+        """
+        Remove key from the cache if it is there
+        """
+        self._discard(key)
+
+    def keys(self):
+        return list(self._data)
+
+    def clear(self):
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.currbytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    @property
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'maxsize': self.maxsize, 'currsize': len(self._data),
+                'maxbytes': self.maxbytes, 'currbytes': self.currbytes}
+
+def _nbytes(value):
+    if hasattr(value, 'nbytes'):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return 0
@@ -33,7 +33,7 @@ The fitting module is used to:
 
 """
 
-from .fit import fit, rsq, chisq, FitResult, make_subset_data
+from .fit import fit, multiresolution_fit, rsq, chisq, FitResult, make_subset_data, GradientSelector, AnnularSelector
 from .model import Model, Parametrization
 from .parameter import Parameter, ComplexParameter
 from .minimizer import Nmpfit
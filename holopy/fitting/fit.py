@@ -30,14 +30,124 @@ import time
 from copy import copy, deepcopy
 
 import numpy as np
+from scipy.ndimage import gaussian_filter
 
 from ..core.holopy_object import HoloPyObject
-from holopy.core.metadata import flat, copy_metadata
+from holopy.core.metadata import flat, copy_metadata, get_values
 from holopy.core.math import chisq, rsq
+from holopy.core.process import center_find, image_gradient
 from .errors import MinimizerConvergenceFailed, InvalidMinimizer
 from .minimizer import Minimizer, Nmpfit
 
-def make_subset_data(data, random_subset=None, pixels=None, return_selection=False):
+class PixelSelector(HoloPyObject):
+    """
+    Common interface for strategies choosing which pixels to keep when fitting
+    or sampling on a subset of the data
+    """
+    def select(self, data, n_sel, rng=None):
+        """
+        Choose pixels from data
+
+        Parameters
+        ----------
+        data : xarray.DataArray
+            The full (unflattened) data to select from
+        n_sel : int
+            Number of pixels to select
+        rng : numpy Generator or RandomState (optional)
+            Source of random numbers, the global numpy random state is used
+            if not given
+
+        Returns
+        -------
+        selection : ndarray(int)
+            Indices into the flattened data of the selected pixels
+        """
+        raise NotImplementedError() # pragma: nocover
+
+    def _weighted_choice(self, weights, n_sel, rng=None):
+        if rng is None:
+            rng = np.random
+        weights = np.ravel(weights).astype(float)
+        weights = weights / weights.max()
+        # keep every pixel reachable so we can always fill n_sel
+        weights = np.maximum(weights, self.floor)
+        return rng.choice(weights.size, n_sel, replace=False,
+                          p=weights/weights.sum())
+
+def _check_grid(selector, data):
+    if not ('x' in data.dims and 'y' in data.dims):
+        raise ValueError("{} needs data on a detector grid".format(
+            selector.__class__.__name__))
+
+class GradientSelector(PixelSelector):
+    """
+    Prefer pixels where the hologram has strong fringes
+
+    Pixels are drawn with probability proportional to the local intensity
+    gradient magnitude, so flat background far from the particle is rarely
+    chosen.
+
+    Parameters
+    ----------
+    blursize : float (optional)
+        Radius in pixels of a Gaussian filter applied before taking the
+        gradient, this suppresses pixel noise. Set to 0 to skip blurring.
+    floor : float (optional)
+        Minimum weight of any pixel relative to the strongest one
+    """
+    def __init__(self, blursize=1., floor=.05):
+        self.blursize = blursize
+        self.floor = floor
+
+    def select(self, data, n_sel, rng=None):
+        _check_grid(self, data)
+        image = copy(data)
+        if self.blursize > 0:
+            image.values = gaussian_filter(image.values, self.blursize)
+        grad_col, grad_row = image_gradient(image)
+        return self._weighted_choice(np.sqrt(grad_col**2 + grad_row**2), n_sel, rng)
+
+class AnnularSelector(PixelSelector):
+    """
+    Draw pixels evenly across rings around the hologram center
+
+    Pixels are weighted by the inverse of their distance from the center, so
+    every annulus contributes about the same number of pixels, and the
+    central fringes, which carry most of the information, are densely
+    sampled.
+
+    Parameters
+    ----------
+    center : (float, float) (optional)
+        Center of the hologram in pixels (row, column) as returned by
+        :func:`.center_find`. Found with center_find if not given.
+    max_radius : float (optional)
+        Pixels further than this (in pixels) from the center get only the
+        floor weight
+    floor : float (optional)
+        Minimum weight of any pixel relative to the strongest one
+    """
+    def __init__(self, center=None, max_radius=None, floor=.01):
+        self.center = center
+        self.max_radius = max_radius
+        self.floor = floor
+
+    def select(self, data, n_sel, rng=None):
+        _check_grid(self, data)
+        center = self.center
+        if center is None:
+            center = center_find(data)
+        rows, cols = np.meshgrid(np.arange(len(data.x)), np.arange(len(data.y)),
+                                 indexing='ij')
+        r = np.sqrt((rows - center[0])**2 + (cols - center[1])**2)
+        weights = 1/np.maximum(r, 1)
+        if self.max_radius is not None:
+            weights[r > self.max_radius] = 0
+        return self._weighted_choice(weights, n_sel, rng)
+
+def make_subset_data(data, random_subset=None, pixels=None, return_selection=False, selector=None,
+                     rng=None):
     if random_subset is None and pixels is None:
         return data
     if random_subset is not None and pixels is not None:
@@ -46,7 +156,12 @@ def make_subset_data(data, random_subset=None, pixels=None, return_selection=Fal
         n_sel = pixels
     else:
         n_sel = int(np.ceil(data.size*random_subset))
-    selection = np.random.choice(data.size, n_sel, replace=False)
+    if selector is None:
+        selection = (np.random if rng is None else rng).choice(data.size, n_sel, replace=False)
+    elif rng is None:
+        selection = selector.select(data, n_sel)
+    else:
+        selection = selector.select(data, n_sel, rng=rng)
     subset = flat(data)[selection]
     subset = copy_metadata(data, subset, do_coords=False)
     if return_selection:
@@ -54,7 +169,7 @@ def make_subset_data(data, random_subset=None, pixels=None, return_selection=Fal
     else:
         return subset
 
-def fit(model, data, minimizer=Nmpfit, random_subset=None):
+def fit(model, data, minimizer=Nmpfit, random_subset=None, selector=None):
     """
     fit a model to some data
 
@@ -69,6 +184,10 @@ def fit(model, data, minimizer=Nmpfit, random_subset=None):
         The minimizer to use to do the fit
     random_subset : float (optional)
         Fit only a randomly selected fraction of the data points in data
+    selector : (optional) :class:`PixelSelector`
+        How to choose the random_subset pixels. By default they are chosen
+        uniformly, see :class:`GradientSelector` and :class:`AnnularSelector`
+        for selections favoring informative pixels.
 
     Returns
     -------
@@ -87,7 +206,7 @@ def fit(model, data, minimizer=Nmpfit, random_subset=None):
     if random_subset is None:
         data = flat(data)
     else:
-        data = make_subset_data(data, random_subset)
+        data = make_subset_data(data, random_subset, selector=selector)
 
     def residual(par_vals):
         return model.residual(par_vals, data)
@@ -104,15 +223,82 @@ def fit(model, data, minimizer=Nmpfit, random_subset=None):
         fitted_pars, minimizer_info  = cf.result, cf.details
         converged = False
 
+    # computed the same way as the residuals, so the hologram of the last
+    # minimizer step comes from the model's cache if it has one
+    values = get_values(data)
+    fitted = model.residual(fitted_pars, data) + values
+
+    if getattr(model, 'profile_alpha', False):
+        # record the alpha that was solved for so the result reports it just
+        # like a fitted alpha
+        fitted_pars['alpha'] = model.best_alpha(fitted_pars, data)
+
     fitted_scatterer = model.scatterer.make_from(fitted_pars)
 
     time_stop = time.time()
-    fitted = model._calc(fitted_pars, data)
 
-    return FitResult(fitted_pars, fitted_scatterer, chisq(fitted, data),
-                     rsq(fitted, data), converged, time_stop - time_start,
+    return FitResult(fitted_pars, fitted_scatterer, chisq(fitted, values),
+                     rsq(fitted, values), converged, time_stop - time_start,
                      model, minimizer, minimizer_info)
 
+def multiresolution_fit(model, data, minimizer=Nmpfit, min_pixels=300,
+                        stages=2, seed=None, selector=None):
+    """
+    fit a model to data, starting from a small subset of pixels and refining
+    on progressively larger subsets
+
+    Early stages converge quickly because each residual evaluation only
+    computes a few hundred pixels. Each stage starts from the parameters found
+    by the previous one, and the last stage always fits all of the data, so
+    the final result is equivalent to a fit over the full hologram.
+
+    Parameters
+    ----------
+    model : :class:`~holopy.fitting.model.Model` object
+        A model describing the scattering system which leads to your data and
+        the parameters to vary to fit it to the data
+    data : :class:`~holopy.core.marray.Marray` object
+        The data to fit
+    minimizer : (optional) :class:`~holopy.fitting.minimizer.Minimizer`
+        The minimizer to use for each stage
+    min_pixels : int (optional)
+        Number of randomly selected pixels used for the first stage
+    stages : int (optional)
+        Number of subset stages to run before the final full resolution
+        fit. Subset sizes are spaced logarithmically between min_pixels and
+        the size of the data.
+    seed : int (optional)
+        Seed for the random pixel selection. Pixels are drawn from their own
+        generator, numpy's global random state is not used or changed.
+    selector : (optional) :class:`PixelSelector`
+        How to choose the pixels of the subset stages, uniformly at random
+        by default
+
+    Returns
+    -------
+    result : :class:`FitResult`
+        The result of the final (full resolution) stage, with time covering
+        all stages
+    """
+    time_start = time.time()
+    rng = np.random.default_rng(seed)
+
+    pixel_counts = []
+    if min_pixels < data.size:
+        pixel_counts = np.logspace(np.log10(min_pixels), np.log10(data.size),
+                                   stages+1)[:-1]
+
+    stage_model = model
+    for pixels in pixel_counts:
+        subset = make_subset_data(data, pixels=int(round(pixels)),
+                                  selector=selector, rng=rng)
+        stage_model = fit(stage_model, subset, minimizer).next_model()
+
+    result = fit(stage_model, data, minimizer)
+    result.model = model
+    result.time = time.time() - time_start
+    return result
+
 
 class FitResult(HoloPyObject):
     """
@@ -24,14 +24,17 @@ Classes for defining models of scattering for fitting
 
 
 from copy import copy
+import weakref
 import numpy as np
 import inspect
 from os.path import commonprefix
 from .errors import ParameterSpecificationError
 from ..core.holopy_object import HoloPyObject
 from .parameter import Parameter, ComplexParameter
-from holopy.core.utils import ensure_listlike
-from holopy.core.metadata import get_values
+from holopy.core.utils import ensure_listlike, LRUCache
+from holopy.core.metadata import get_values, flat
+from holopy.scattering.calculations import (calc_holo, calc_holo_best_scaling, FlatDetector,
+                                            calc_holo_flat, calc_holo_flat_best_scaling)
 
 class Parametrization(HoloPyObject):
     """
@@ -63,24 +66,44 @@ class Parametrization(HoloPyObject):
             elif isinstance(par, Parameter):
                 add_par(par)
         self.make_scatterer = make_scatterer
+        self._compile()
+
+    def _compile(self):
+        # Work out once how each argument of make_scatterer is assembled, so
+        # make_from does not need to inspect make_scatterer on every call.
+        # Each entry is (arg, real, imag), where real and imag are None for
+        # arguments taken directly from the parameters, and otherwise are
+        # (is_free, name or fixed value) for the parts of a complex argument.
+        free = set(par.name for par in self.parameters)
+        def part(name):
+            if name in free:
+                return (True, name)
+            return (False, self._fixed_params[name])
+
+        self._arg_plan = []
+        for arg in inspect.signature(self.make_scatterer).parameters:
+            real, imag = arg + '.real', arg + '.imag'
+            if ((real in free or real in self._fixed_params) and
+                    (imag in free or imag in self._fixed_params) and
+                    (real in free or imag in free)):
+                self._arg_plan.append((arg, part(real), part(imag)))
+            else:
+                self._arg_plan.append((arg, None, None))
 
     def make_from(self, parameters):
         # parameters is an ordered dictionary
+        def get(part):
+            is_free, val = part
+            if is_free:
+                return parameters[val]
+            return val
+
         for_schema = {}
-        for arg in inspect.signature(self.make_scatterer).parameters:
-            if (arg + '.real') in parameters and (arg + '.imag') in parameters:
-                for_schema[arg] = (parameters[arg + '.real'] + 1.j *
-                                   parameters[arg + '.imag'])
-            elif (arg + '.real') in self._fixed_params and \
-                    (arg + '.imag') in parameters:
-                for_schema[arg] = (self._fixed_params[arg + '.real'] + 1.j *
-                                   parameters[arg + '.imag'])
-            elif (arg + '.real') in parameters and (arg + '.imag') in \
-                    self._fixed_params:
-                for_schema[arg] = (parameters[arg + '.real'] + 1.j *
-                                   self._fixed_params[arg + '.imag'])
-            else:
+        for arg, real, imag in self._arg_plan:
+            if real is None:
                 for_schema[arg] = parameters[arg]
+            else:
+                for_schema[arg] = get(real) + 1.j * get(imag)
         return self.make_scatterer(**for_schema)
 
     @property
@@ -147,53 +170,81 @@ class ParameterizedObject(Parametrization):
 
         self.parameters = parameters
         self.ties = ties
-
-    @property
-    def guess(self):
-        pars = self.obj.parameters
-        for key in list(pars.keys()):
-            if hasattr(pars[key], 'guess'):
-                if isinstance(pars[key], ComplexParameter):
-                    pars[key+'.real'] = pars[key].real.guess
-                    pars[key+'.imag'] = pars[key].imag.guess
-                else:
-                    pars[key] = pars[key].guess
-        return self.make_from(pars)
-
-    def make_from(self, parameters):
-        obj_pars = {}
-
-        for name, par in self.obj.parameters.items():
-            # if this par is in a tie group, we need to work with its tie group
-            # name since that will be what is in parameters
-            for groupname, group in self.ties.items():
-                if name in group:
-                    name = groupname
-
-            def get_val(par, name):
-                if par.fixed:
-                    return par.limit
-                else:
-                    return parameters[name]
-
+        self._compile()
+
+    def _compile(self):
+        # Precompute how to go from the values of our free parameters to a
+        # scatterer: which of obj's parameters are constants, which are copied
+        # from a free parameter, and which are complex combinations. The
+        # structure of obj itself is compiled by its class, so make_from is
+        # a direct scatter of values into place with no name parsing.
+        self._free_names = [par.name for par in self.parameters]
+        slots = {name: i for i, name in enumerate(self._free_names)}
+        group_of = {}
+        for groupname, group in self.ties.items():
+            for name in group:
+                group_of[name] = groupname
+
+        def source(par, name):
+            if par.fixed:
+                return (None, par.limit)
+            return (slots[name], None)
+
+        self._obj_keys = list(self.obj.parameters.keys())
+        self._template = []
+        self._copied = []
+        self._combined = []
+        for i, key in enumerate(self._obj_keys):
+            par = self.obj.parameters[key]
+            name = group_of.get(key, key)
             if isinstance(par, ComplexParameter):
-                par_val = (get_val(par.real, name+'.real') +
-                           1j * get_val(par.imag, name+'.imag'))
+                self._template.append(None)
+                self._combined.append((i, source(par.real, name+'.real'),
+                                       source(par.imag, name+'.imag')))
             elif isinstance(par, Parameter):
-                par_val = get_val(par, name)
+                index, val = source(par, name)
+                self._template.append(val)
+                if index is not None:
+                    self._copied.append((i, index))
             else:
-                par_val = par
-
-
-            if name in self.ties:
-                for tied_name in self.ties[name]:
-                    obj_pars[tied_name] = par_val
-            else:
-                obj_pars[name] = par_val
+                self._template.append(par)
 
+        if hasattr(self.obj, '_compile_parameters'):
+            self._obj_plan = self.obj._compile_parameters(self._obj_keys)
+        else:
+            self._obj_plan = None
 
+    @property
+    def guess(self):
+        return self.make_from({par.name: par.guess for par in self.parameters})
 
-        return self.obj.from_parameters(obj_pars)
+    def make_from(self, parameters):
+        return self.make_from_values([parameters[name] for name in self._free_names])
+
+    def make_from_values(self, values):
+        """
+        Make a scatterer from values for the free parameters
+
+        Parameters
+        ----------
+        values : list
+            Values of the free parameters of this object, in the order of
+            the parameters it was constructed with
+        """
+        obj_vals = list(self._template)
+        for dest, index in self._copied:
+            obj_vals[dest] = values[index]
+        for dest, real, imag in self._combined:
+            def get(part):
+                index, val = part
+                if index is None:
+                    return val
+                return values[index]
+            obj_vals[dest] = get(real) + 1j * get(imag)
+
+        if self._obj_plan is None:
+            return self.obj.from_parameters(dict(zip(self._obj_keys, obj_vals)))
+        return self.obj._from_compiled(self._obj_plan, obj_vals)
 
 def limit_overlaps(fraction=.1):
     """
@@ -265,8 +316,39 @@ class BaseModel(HoloPyObject):
         scatterer = self.scatterer.make_from(pars)
         return optics, scatterer
 
+    def _flat_detector(self, data):
+        """
+        data as a FlatDetector, or None if it is not on a cartesian detector
+
+        Likelihoods and residuals are computed against the same data many
+        times, so the last detector made is kept and reused.
+        """
+        last = self.__dict__.get('_last_detector')
+        if last is not None and last[0] is data:
+            return last[1]
+        try:
+            detector = FlatDetector(data)
+        except ValueError:
+            detector = None
+        self._last_detector = (data, detector)
+        return detector
+
+    def __getstate__(self):
+        state = copy(self.__dict__)
+        # the detector holds a reference to its data, don't ship it around
+        state.pop('_last_detector', None)
+        return state
+
 
 
+def _forget_schema(cache_ref, watched, schema_id):
+    cache = cache_ref()
+    if cache is not None:
+        for key in cache.keys():
+            if key[0] == schema_id:
+                cache.discard(key)
+    watched.discard(schema_id)
+
 class Model(BaseModel):
     """
     Representation of a model to fit to data
@@ -276,24 +358,80 @@ class Model(BaseModel):
     alpha : float or Parameter
         Extra scaling parameter, hopefully this will be removed by improvements
         in our theory soon.
+    profile_alpha : bool (optional)
+        Instead of fitting alpha, solve for the alpha that best matches the
+        data in every residual evaluation. The hologram is quadratic in alpha,
+        so this is done in closed form and saves the minimizer a parameter
+        (and a forward calculation per Jacobian evaluation). Only valid for
+        calc_holo models, and alpha must not also be given. Holograms not
+        compared to data need alpha among their parameters (see best_alpha).
     constraints : function or list of functions
         One or a list of constraint functions. A constraint function should take
         a scaterer as an argument and return False if you wish to disallow that
         scatterer (usually because it is un-physical for some reason)
+    cache_size : int (optional)
+        If given, remember the last cache_size computed holograms, keyed on the
+        exact parameter values and the identity of the data they were computed
+        for. Minimizers often revisit parameter sets (rejected steps, the final
+        evaluation at the best fit), and those become free. Hit statistics are
+        available from :attr:`cache_info`. Cached holograms are read-only, and
+        are dropped when the data they were computed for is garbage
+        collected. Do not change data in place while fitting it.
     """
     def __init__(self, scatterer, calc_func, medium_index=None, illum_wavelen=None, illum_polarization=None, theory='auto', alpha=None,
-                 use_random_fraction=None, constraints=[]):
+                 use_random_fraction=None, constraints=[], cache_size=None, profile_alpha=False):
         super().__init__(scatterer, medium_index, illum_wavelen, illum_polarization, theory)
         self.calc_func = calc_func
 
         self.use_random_fraction = use_random_fraction
 
+        if profile_alpha:
+            if alpha is not None:
+                raise ParameterSpecificationError("Specify either alpha or profile_alpha, not both")
+            if calc_func is not calc_holo:
+                raise ParameterSpecificationError("profile_alpha is only supported with calc_holo")
+        self.profile_alpha = profile_alpha
+
         self._use_parameter(alpha, 'alpha')
 
         if len(self.parameters) == 0:
             raise ParameterSpecificationError("You must specify at least one parameter to vary in a fit")
 
         self.constraints = ensure_listlike(constraints)
+        self.cache_size = cache_size
+        self._cache = self._new_cache()
+
+    def _new_cache(self):
+        # ids of the schemas with cached holograms, see _watch
+        self._watched = set()
+        if getattr(self, 'cache_size', None):
+            return LRUCache(self.cache_size)
+        return None
+
+    def __getstate__(self):
+        # cached holograms hold references to data, don't ship them around
+        # when pickling or copying a model
+        state = super().__getstate__()
+        state['_cache'] = None
+        state.pop('_watched', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache = self._new_cache()
+
+    @property
+    def cache_info(self):
+        """
+        Statistics for the forward model cache, or None if caching is off
+        """
+        if self._cache is None:
+            return None
+        return self._cache.info
+
+    def clear_cache(self):
+        if self._cache is not None:
+            self._cache.clear()
 
     @property
     def guess(self):
@@ -311,8 +449,55 @@ class Model(BaseModel):
                 return 1.0
             return self.alpha
 
-    def _calc(self, pars, schema):
+    def _cache_key(self, pars, schema, profile=False):
+        if self._cache is None:
+            return None
+        try:
+            key = (id(schema), tuple(sorted(pars.items())), profile)
+            hash(key)
+            self._watch(schema)
+        except TypeError:
+            # unhashable parameters, or a schema that cannot be weakly referenced
+            return None
+        return key
+
+    def _watch(self, schema):
+        # entries are keyed on id(schema), so drop them when schema is
+        # collected, before a new object can reuse its id
+        if id(schema) not in self._watched:
+            weakref.finalize(schema, _forget_schema, weakref.ref(self._cache),
+                             self._watched, id(schema))
+            self._watched.add(id(schema))
+
+    def _calc(self, pars, schema, profile=False):
+        """
+        Hologram for pars at the points of schema
+
+        A profile_alpha model needs alpha in pars (e.g. from best_alpha),
+        unless profile is set. Then schema must be the data being fit, and
+        alpha is solved for against it as in residual.
+        """
+        key = self._cache_key(pars, schema, profile)
+        if key is not None:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+        result = self._calc_uncached(pars, schema, profile)
+        if key is not None:
+            # callers share the cached array, so it must not change under them
+            get_values(result).flags.writeable = False
+            self._cache.put(key, result)
+        return result
+
+    def _calc_uncached(self, pars, schema, profile=False):
         pars = copy(pars)
+        if self.profile_alpha and 'alpha' not in pars:
+            if not profile:
+                raise ParameterSpecificationError(
+                    "alpha is profiled against the data, so it must be given "
+                    "(e.g. from best_alpha) to compute a hologram")
+        else:
+            profile = False
         alpha = self.get_par(pars=pars, name='alpha', default=1.0)
         optics, scatterer = self._optics_scatterer(pars, schema)
 
@@ -320,14 +505,35 @@ class Model(BaseModel):
         for constraint in self.constraints:
             valid = valid and constraint(scatterer)
         if not valid:
-            return np.ones_like(schema) * np.inf
+            return np.ones_like(get_values(schema)) * np.inf
 
         try:
+            if isinstance(schema, FlatDetector):
+                # only made by residual, for calc_holo models
+                if profile:
+                    return calc_holo_flat_best_scaling(schema, scatterer, theory=self.theory, **optics)[0]
+                return calc_holo_flat(schema, scatterer, scaling=alpha, theory=self.theory, **optics)
+            if profile:
+                return calc_holo_best_scaling(schema, scatterer, theory=self.theory, **optics)[0]
             return self.calc_func(schema=schema, scatterer=scatterer, scaling=alpha, theory=self.theory, **optics)
         except:
-            return np.ones_like(schema) * np.inf
+            return np.ones_like(get_values(schema)) * np.inf
+
+    def best_alpha(self, pars, data):
+        """
+        The alpha that best matches data for the given parameters, as used by
+        profile_alpha models
+        """
+        pars = copy(pars)
+        optics, scatterer = self._optics_scatterer(pars, data)
+        return calc_holo_best_scaling(data, scatterer, theory=self.theory, **optics)[1]
 
     def residual(self, pars, data):
-        return get_values(self._calc(pars, data)) - get_values(data)
+        if self.calc_func is calc_holo and flat(data) is data:
+            # compute on plain arrays, skipping xarray bookkeeping
+            detector = self._flat_detector(data)
+            if detector is not None:
+                return self._calc(pars, detector, profile=True) - detector.values
+        return get_values(self._calc(pars, data, profile=True)) - get_values(data)
 
     # TODO: Allow a layer on top of theory to do things like moving sphere
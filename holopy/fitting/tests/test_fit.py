@@ -24,11 +24,12 @@ from numpy.testing import assert_equal, assert_approx_equal, assert_allclose, as
 
 from ...scattering import Sphere, Spheres, LayeredSphere, Mie, calc_holo
 from ...core import detector_grid, load, save, update_metadata
-from ...core.process import normalize
-from .. import fit, Parameter, ComplexParameter, Parametrization, Model, FitResult
+from ...core.process import normalize, center_find
+from .. import fit, multiresolution_fit, make_subset_data, GradientSelector, AnnularSelector, Parameter, ComplexParameter, Parametrization, Model, FitResult
 from ...core.tests.common import (assert_obj_close, get_example_data, assert_read_matches_write)
-from ..errors import InvalidMinimizer
+from ..errors import InvalidMinimizer, ParameterSpecificationError
 from ..model import limit_overlaps, ParameterizedObject
+from ..minimizer import Nmpfit
 
 gold_alpha = .6497
 
@@ -217,3 +218,94 @@ def test_layered():
     model = Model(guess, calc_holo)
     res = fit(model, hs)
     assert_allclose(res.scatterer.t, (1, 1), rtol = 1e-12)
+
+def test_multiresolution_fit():
+    schema = detector_grid(shape = 100, spacing = .1)
+    s = Sphere(center = (10.2, 9.8, 10.3), r = .5, n = 1.58)
+    holo = calc_holo(schema, s, illum_wavelen = .660, medium_index = 1.33, illum_polarization = (1, 0))
+
+    par_s = Sphere(center = (Parameter(guess = 10, limit = [5,15]), Parameter(10, [5, 15]), Parameter(10, [5, 15])),
+                   r = .5, n = 1.58)
+
+    model = Model(par_s, calc_holo, alpha = Parameter(.6, [.1, 1]))
+    state = np.random.get_state()
+    result = multiresolution_fit(model, holo, min_pixels=200, stages=2, seed=40)
+    assert_allclose(result.scatterer.center, [10.2, 9.8, 10.3])
+    assert_equal(model, result.model)
+    # pixels come from the seeded generator, not the global random state
+    assert_equal(np.random.get_state()[1], state[1])
+    with warnings.catch_warnings():
+        # stopping early so the result depends on the pixels chosen
+        warnings.simplefilter("ignore")
+        rough = [multiresolution_fit(model, holo, min_pixels=200, stages=2, seed=40,
+                                     minimizer=Nmpfit(maxiter=1)) for i in range(2)]
+    assert_equal(rough[0].parameters, rough[1].parameters)
+
+def test_pixel_selectors():
+    holo = normalize(get_example_data('image0001'))
+    center = center_find(holo)
+    np.random.seed(40)
+
+    def median_distance(selector):
+        subset, selection = make_subset_data(holo, pixels=500, selector=selector,
+                                             return_selection=True)
+        assert_equal(len(np.unique(selection)), 500)
+        assert_equal(subset.size, 500)
+        rows, cols = np.unravel_index(selection, holo.shape[1:])
+        return np.median(np.sqrt((rows - center[0])**2 + (cols - center[1])**2))
+
+    uniform = median_distance(None)
+    # informative pixels cluster around the particle more tightly than a
+    # uniform draw
+    assert median_distance(GradientSelector()) < uniform
+    assert median_distance(AnnularSelector()) < uniform
+
+def test_profile_alpha():
+    schema = detector_grid(shape = 50, spacing = .1)
+    s = Sphere(center = (2.6, 2.4, 5), r = .5, n = 1.58)
+    holo = calc_holo(schema, s, illum_wavelen = .660, medium_index = 1.33,
+                     illum_polarization = (1, 0), scaling = .7)
+
+    par_s = Sphere(center = (Parameter(2.5, [1, 4]), Parameter(2.5, [1, 4]), 5),
+                   r = .5, n = 1.58)
+    model = Model(par_s, calc_holo, 1.33, .66, (1, 0), profile_alpha=True)
+    assert_equal(len(model.parameters), 2)
+    result = fit(model, holo)
+    assert_allclose(result.scatterer.center, [2.6, 2.4, 5])
+    assert_allclose(result.alpha, .7)
+
+    # alpha is only solved for against the data, other holograms need it given
+    pars = {name: val for name, val in result.parameters.items() if name != 'alpha'}
+    assert_raises(ParameterSpecificationError, model._calc, pars, schema)
+    assert_allclose(model._calc(result.parameters, schema), holo, atol=1e-5)
+
+    assert_raises(ParameterSpecificationError, Model, par_s, calc_holo,
+                  alpha=Parameter(.6, [.1, 1]), profile_alpha=True)
+
+def test_fit_reuses_cached_hologram():
+    schema = detector_grid(shape = 30, spacing = .1)
+    s = Sphere(center = (1.6, 1.4, 5), r = .5, n = 1.58)
+    holo = calc_holo(schema, s, illum_wavelen = .660, medium_index = 1.33,
+                     illum_polarization = (1, 0), scaling = .7)
+    par_s = Sphere(center = (Parameter(1.5, [1, 2]), Parameter(1.5, [1, 2]), 5),
+                   r = .5, n = 1.58)
+
+    class FinishedMinimizer(Nmpfit):
+        def minimize(self, parameters, cost_func):
+            result = super().minimize(parameters, cost_func)
+            self.finished = True
+            return result
+
+    for alpha in [Parameter(.6, [.1, 1]), None]:
+        model = Model(par_s, calc_holo, 1.33, .66, (1, 0), alpha=alpha,
+                      profile_alpha=alpha is None, cache_size=10)
+        minimizer = FinishedMinimizer()
+        calc_uncached = model._calc_uncached
+        def checked(*args):
+            # the final hologram must come from the cache
+            assert not getattr(minimizer, 'finished', False)
+            return calc_uncached(*args)
+        model._calc_uncached = checked
+        result = fit(model, holo, minimizer=minimizer)
+        assert_allclose(result.alpha, .7, rtol=1e-4)
+        assert result.chisq < 1e-8
@@ -17,18 +17,21 @@
 # along with HoloPy.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import gc
 import tempfile
 
 import numpy as np
 
 from nose.plugins.attrib import attr
-from numpy.testing import assert_equal
+from numpy.testing import assert_equal, assert_raises
 from holopy.scattering.theory import Mie
 from holopy.scattering.scatterer import Sphere, Spheres
 from holopy.fitting import Model, ComplexParameter, Parametrization
 from holopy.fitting import Parameter as par
-from holopy.core.tests.common import assert_read_matches_write
+from holopy.fitting.model import ParameterizedObject
+from holopy.core.tests.common import assert_read_matches_write, assert_pickle_roundtrip
 from holopy.scattering.calculations import calc_holo
+from holopy.core.metadata import detector_grid, update_metadata
 
 @attr('fast')
 def test_naming():
@@ -118,3 +121,54 @@ def test_io():
 
     model = Model(Sphere(par(1)), calc_holo, theory=Mie(False))
     assert_read_matches_write(model)
+
+def test_forward_cache():
+    sch = update_metadata(detector_grid(10, spacing=.1), illum_wavelen=.66,
+                          medium_index=1.33, illum_polarization=(1, 0))
+    model = Model(Sphere(n=1.59, r=par(.5), center=(.5, .5, 5)), calc_holo,
+                  cache_size=2)
+    first = model._calc({'r': .5}, sch)
+    assert_equal(model.cache_info['misses'], 1)
+    assert model._calc({'r': .5}, sch) is first
+    assert_equal(model.cache_info['hits'], 1)
+
+    # the cached hologram is shared, so it cannot be changed in place
+    def change(a):
+        a[:] = 0
+    assert_raises(ValueError, change, first.values)
+
+    # a different data object must not reuse the cached hologram
+    other = sch.copy()
+    model._calc({'r': .5}, other)
+    assert_equal(model.cache_info['misses'], 2)
+    assert_equal(model.cache_info['currsize'], 2)
+    # and its holograms go when it does, before its id can be reused
+    del other
+    gc.collect()
+    assert_equal(model.cache_info['currsize'], 1)
+    assert model._calc({'r': .5}, sch) is first
+    model._calc({'r': .6}, sch)
+    assert_equal(model.cache_info['currsize'], 2)
+
+    assert_equal(Model(Sphere(par(1)), calc_holo).cache_info, None)
+    assert_read_matches_write(model)
+
+def test_compiled_make_from():
+    r1 = par(0.5e-6)
+    sc = Spheres([Sphere(n = par(1.59), r = r1, center = np.array([10., 10., 20.])),
+                  Sphere(n = ComplexParameter(par(1.58), 1e-4), r = r1,
+                         center = [9., 11., par(21.)])])
+    po = ParameterizedObject(sc)
+    names = [p.name for p in po.parameters]
+    assert_equal(names, ['0:Sphere.n', 'Sphere.r', '1:Sphere.center[2]', '1:Sphere.n.real'])
+    values = [1.6, 0.6e-6, 21.5, 1.57]
+    built = po.make_from_values(values)
+    assert_equal(built, Spheres.from_parameters(
+        {'0:Sphere.n': 1.6, '0:Sphere.r': 0.6e-6, '0:Sphere.center[0]': 10.,
+         '0:Sphere.center[1]': 10., '0:Sphere.center[2]': 20.,
+         '1:Sphere.n': 1.57 + 1e-4j, '1:Sphere.r': 0.6e-6, '1:Sphere.center[0]': 9.,
+         '1:Sphere.center[1]': 11., '1:Sphere.center[2]': 21.5}))
+    assert_equal(po.make_from(dict(zip(names, values))), built)
+    # guesses work for tied parameters too
+    assert_equal(po.guess.r, [0.5e-6, 0.5e-6])
+    assert_pickle_roundtrip(po)
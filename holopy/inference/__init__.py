@@ -16,5 +16,7 @@
 # You should have received a copy of the GNU General Public License
 # along with HoloPy.  If not, see <http://www.gnu.org/licenses/>.
 
-from .sample import SamplingResult, TemperedSamplingResult, tempered_sample, EmceeStrategy
+from .sample import (SamplingResult, TemperedSamplingResult, tempered_sample, EmceeStrategy,
+                     AutocorrStrategy, MultiChainStrategy, resume_sampling)
 from .noise_model import AlphaModel
+from .surrogate import PCASurrogate, DelayedAcceptanceStrategy
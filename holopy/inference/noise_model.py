@@ -18,12 +18,17 @@
 
 from holopy.fitting.model import BaseModel
 from holopy.fitting.parameter import Parameter
+from holopy.inference.prior import JointPrior
+from holopy.fitting.errors import ParameterSpecificationError
 from holopy.core.holopy_object import HoloPyObject
+from holopy.core.utils import LRUCache
 from holopy.scattering.errors import MultisphereFailure, InvalidScatterer
 
 import numpy as np
 from copy import copy
-from holopy.scattering.calculations import calc_field, calc_holo
+from holopy.scattering.calculations import (calc_field, calc_holo, calc_holo_best_scaling,
+                                            interpret_theory, FlatDetector, calc_holo_flat,
+                                            calc_holo_flat_best_scaling, _calc_holos_flat)
 
 class NoiseModel(BaseModel):
     """Model probabilites of observing data
@@ -31,6 +36,8 @@ class NoiseModel(BaseModel):
     Compute probabilities that observed data could be explained by a set of
     scatterer and observation parameters.
     """
+    _coefficient_cache_bytes = None
+
     def __init__(self, scatterer, noise_sd, medium_index=None, illum_wavelen=None, illum_polarization=None, theory='auto'):
         super().__init__(scatterer, medium_index=medium_index, illum_wavelen=illum_wavelen, illum_polarization=illum_polarization, theory=theory)
         # the float cast insures we don't have noise_sd wrapped up in a needless xarray
@@ -39,11 +46,24 @@ class NoiseModel(BaseModel):
     def _pack(self, vals):
         return {par.name: val for par, val in zip(self.parameters, vals)}
 
+    @property
+    def _joint_prior(self):
+        if '_joint_prior_cache' not in self.__dict__:
+            self._joint_prior_cache = JointPrior(self.parameters)
+        return self._joint_prior_cache
+
     def lnprior(self, par_vals):
+        """
+        Log prior probability of par_vals
+
+        par_vals may be a dict of values by parameter name, a list of values
+        in the order of self.parameters, or an array with a row of values
+        for each walker (in which case an array of lnpriors is returned).
+        """
         if isinstance(par_vals, dict):
             return sum([p.lnprob(par_vals[p.name]) for p in self.parameters])
         else:
-            return sum([p.lnprob(v) for p, v in zip(self.parameters, par_vals)])
+            return self._joint_prior.lnprob(par_vals)
 
     def lnposterior(self, par_vals, data):
         lnprior = self.lnprior(par_vals)
@@ -56,6 +76,118 @@ class NoiseModel(BaseModel):
         else:
             return lnprior + self.lnlike(par_vals, data)
 
+    def lnposterior_walkers(self, walker_pars, data):
+        """
+        Compute lnposterior for many sets of parameter values at once
+
+        This is equivalent to calling lnposterior for each row of walker_pars,
+        but the data is prepared once and the scattering theory is resolved
+        once for all of them. For models that support it (AlphaModel, on
+        data from a cartesian detector, with fixed optics) the holograms of
+        all walkers come from one batched calculation, in which walkers that
+        differ only in particle positions share one theory call. Otherwise
+        walkers are evaluated one at a time, still sharing scattering
+        coefficients between walkers with the same optical properties.
+
+        Parameters
+        ----------
+        walker_pars: array (nwalkers, nparameters)
+            Parameter values for each walker, in the order of self.parameters
+        data: xarray
+            The data to compute likelihood against
+
+        Returns
+        -------
+        lnposterior: array (nwalkers)
+        """
+        theory = self._walker_theory()
+        walker_pars = np.atleast_2d(walker_pars)
+        lnprobs = self.lnprior(walker_pars)
+        ok = np.nonzero(np.isfinite(lnprobs))[0]
+        pars = [self._pack(walker_pars[i]) for i in ok]
+        lnlikes = self._lnlike_walkers(pars, data, theory)
+        if lnlikes is None:
+            lnlikes = [self._lnlike(p, data, theory=theory) for p in pars]
+        lnprobs[ok] += lnlikes
+        return lnprobs
+
+    def _lnlike_walkers(self, walker_pars, data, theory):
+        """
+        Likelihoods for a list of parameter dicts from one batched forward
+        calculation, or None if the model or data does not allow batching
+        """
+        detector = self._flat_detector(data)
+        if detector is None or len(walker_pars) == 0:
+            return None
+        walker_pars = [copy(pars) for pars in walker_pars]
+        noise_sd = np.array([pars.pop('noise_sd', self.noise_sd) for pars in walker_pars])
+        holos = self._forward_walkers(walker_pars, detector, theory)
+        if holos is None:
+            return None
+        N = detector.size
+        resid = ((holos - detector.values)**2).sum(axis=1)
+        return -N*np.log(noise_sd*np.sqrt(2*np.pi)) - resid/(2*noise_sd**2)
+
+    def _forward_walkers(self, walker_pars, detector, theory):
+        # models that can compute many holograms in one call override this
+        return None
+
+    def use_coefficient_cache(self, maxbytes=2**26):
+        """
+        Keep scattering coefficients between likelihood evaluations
+
+        Coefficients that do not depend on where the particle is (Mie an and
+        bn, or Multisphere amn, which only depend on relative positions) are
+        cached keyed on the other parameters. Walkers revisiting the same
+        sizes and indices, and later stages of a tempered run, then reuse
+        them. The cache stays with the model (with its own copy in each
+        WorkerPool process) until this is called with a different maxbytes.
+
+        Parameters
+        ----------
+        maxbytes : int or None
+            Memory cap for the cache in each process, least recently used
+            coefficients are dropped beyond it. None turns caching off.
+        """
+        if maxbytes != self._coefficient_cache_bytes:
+            self._coefficient_cache_bytes = maxbytes
+            self.__dict__.pop('_coefficient_theory', None)
+
+    @property
+    def coefficient_cache_info(self):
+        """
+        Statistics for the coefficient cache of this process, or None if
+        caching is off
+        """
+        if self._coefficient_cache_bytes is None:
+            return None
+        return self._cached_theory().coefficient_cache.info
+
+    def _cached_theory(self):
+        # the model's theory, with the cache from use_coefficient_cache
+        theory = self.__dict__.get('_coefficient_theory')
+        if theory is None:
+            theory = copy(interpret_theory(self.scatterer.guess, self.theory))
+            theory.coefficient_cache = LRUCache(None, maxbytes=self._coefficient_cache_bytes)
+            self._coefficient_theory = theory
+        return theory
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # each process builds its own cache
+        state.pop('_coefficient_theory', None)
+        return state
+
+    def _walker_theory(self, cache_size=32):
+        if self._coefficient_cache_bytes is not None:
+            return self._cached_theory()
+        theory = interpret_theory(self.scatterer.guess, self.theory)
+        if theory is self.theory:
+            # don't attach a cache to a theory object the user handed us
+            theory = copy(theory)
+        theory.coefficient_cache = LRUCache(cache_size)
+        return theory
+
     def _fields(self, pars, schema):
         def get_par(name):
             return pars.pop(name, self.par(name, schema))
@@ -65,7 +197,7 @@ class NoiseModel(BaseModel):
         except (MultisphereFailure, InvalidScatterer):
             return -np.inf
 
-    def _lnlike(self, pars, data):
+    def _lnlike(self, pars, data, theory=None):
         """
         Compute the likelihood for pars given data
 
@@ -75,12 +207,21 @@ class NoiseModel(BaseModel):
             Dictionary containing values for each parameter
         data: xarray
             The data to compute likelihood against
+        theory: ScatteringTheory (optional)
+            Theory to use instead of the model's own
         """
         noise_sd = pars.pop('noise_sd', self.noise_sd)
-        forward = self._forward(pars, data)
+        if theory is None and self._coefficient_cache_bytes is not None:
+            theory = self._cached_theory()
         N = data.size
+        detector = self._flat_detector(data)
+        if detector is not None:
+            # compute on plain arrays, skipping xarray bookkeeping
+            resid = self._forward(pars, detector, theory=theory, profile=True) - detector.values
+        else:
+            resid = self._forward(pars, data, theory=theory, profile=True) - data
         return (-N*np.log(noise_sd*np.sqrt(2*np.pi)) -
-                ((forward-data)**2).sum()/(2*noise_sd**2))
+                (resid**2).sum()/(2*noise_sd**2))
 
     def lnlike(self, par_vals, data):
         return self._lnlike(self._pack(par_vals), data)
@@ -89,19 +230,88 @@ class NoiseModel(BaseModel):
 
 
 class AlphaModel(NoiseModel):
-    def __init__(self, scatterer, noise_sd, alpha, medium_index=None, illum_wavelen=None, illum_polarization=None, theory='auto'):
+    """
+    Model holograms, including the reference wave scaling alpha
+
+    Parameters
+    ----------
+    alpha : float or Prior
+        Scaling of the reference wave
+    profile_alpha : bool (optional)
+        Instead of sampling alpha, use the alpha that best matches the data
+        for each set of scatterer parameters. The hologram is quadratic in
+        alpha so this is solved in closed form, removing alpha from the
+        sampled parameters. alpha must not also be given. Holograms not
+        compared to data need alpha among their parameters (see best_alpha).
+    """
+    def __init__(self, scatterer, noise_sd, alpha=None, medium_index=None, illum_wavelen=None, illum_polarization=None, theory='auto', profile_alpha=False):
         super().__init__(scatterer, medium_index=medium_index, illum_wavelen=illum_wavelen, illum_polarization=illum_polarization, theory=theory, noise_sd=noise_sd)
+        if profile_alpha and alpha is not None:
+            raise ParameterSpecificationError("Specify either alpha or profile_alpha, not both")
+        if not profile_alpha and alpha is None:
+            raise ParameterSpecificationError("You must specify alpha unless using profile_alpha")
+        self.profile_alpha = profile_alpha
         self._use_parameter(alpha, 'alpha')
 
-    def _forward(self, pars, schema, alpha=None):
-        if alpha is not None:
-            alpha = alpha
-        else:
+    def _forward_walkers(self, walker_pars, detector, theory):
+        """
+        Holograms (walker, pixel) for a list of parameter dicts at the points
+        of a FlatDetector, from one batched calculation
+        """
+        optical = ('medium_index', 'illum_wavelen', 'illum_polarization')
+        if any(p.name.startswith(optical) for p in self.parameters):
+            # walkers see different optics, so they cannot share a calculation
+            return None
+        scatterers, alphas = [], []
+        for pars in walker_pars:
+            if not self.profile_alpha:
+                alphas.append(self.get_par('alpha', pars))
+            optics, scatterer = self._optics_scatterer(pars, detector)
+            scatterers.append(scatterer)
+        try:
+            return _calc_holos_flat(detector, scatterers, theory=theory,
+                                    scalings=None if self.profile_alpha else alphas, **optics)
+        except (MultisphereFailure, InvalidScatterer):
+            # evaluate walkers one at a time so only the bad ones fail
+            return None
+
+    def best_alpha(self, pars, data):
+        """
+        The alpha that best matches data for the given parameters, as used by
+        profile_alpha models
+        """
+        pars = copy(pars)
+        optics, scatterer = self._optics_scatterer(pars, data)
+        return calc_holo_best_scaling(data, scatterer, theory=self.theory, **optics)[1]
+
+    def _forward(self, pars, schema, alpha=None, theory=None, profile=False):
+        """
+        Hologram for pars at the points of schema
+
+        A profile_alpha model needs alpha (in pars or as alpha, e.g. from
+        best_alpha) unless profile is set. Then schema must be the data, and
+        alpha is solved for against it as in the likelihood.
+        """
+        if theory is None:
+            theory = self.theory
+        if alpha is None and 'alpha' in pars:
+            alpha = pars.pop('alpha')
+        elif alpha is None and not self.profile_alpha:
             alpha = self.get_par('alpha', pars)
+        if alpha is None and not profile:
+            raise ParameterSpecificationError(
+                "alpha is profiled against the data, so it must be given "
+                "(e.g. from best_alpha) to compute a hologram")
 
         optics, scatterer = self._optics_scatterer(pars, schema)
 
+        if isinstance(schema, FlatDetector):
+            calc, calc_best_scaling = calc_holo_flat, calc_holo_flat_best_scaling
+        else:
+            calc, calc_best_scaling = calc_holo, calc_holo_best_scaling
         try:
-            return calc_holo(schema, scatterer, theory=self.theory, **optics)
+            if alpha is None:
+                return calc_best_scaling(schema, scatterer, theory=theory, **optics)[0]
+            return calc(schema, scatterer, theory=theory, scaling=alpha, **optics)
         except (MultisphereFailure, InvalidScatterer):
             return -np.inf
@@ -25,6 +25,7 @@ from holopy.fitting.errors import ParameterSpecificationError
 
 import numpy as np
 from numpy import random
+from scipy.special import ndtr, ndtri
 
 
 
@@ -55,8 +56,10 @@ class Uniform(Prior):
     def guess(self):
         return (self.upper_bound + self.lower_bound)/2
 
-    def sample(self, size=None):
-        return random.uniform(self.lower_bound, self.upper_bound, size)
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = random
+        return rng.uniform(self.lower_bound, self.upper_bound, size)
 
 
 class Gaussian(Prior):
@@ -81,15 +84,18 @@ class Gaussian(Prior):
     def guess(self):
         return self.mu
 
-    def sample(self, size=None):
-        return random.normal(self.mu, self.sd, size=size)
+    def sample(self, size=None, rng=None):
+        if rng is None:
+            rng = random
+        return rng.normal(self.mu, self.sd, size=size)
 
 
 class BoundedGaussian(Gaussian):
     # Note: this is not normalized
     def __init__(self, mu, sd, lower_bound=-np.inf, upper_bound=np.inf, name=None):
         if mu < lower_bound or mu > upper_bound:
-            raise OutOfBoundsError(mu, lower_bound, upper_bound)
+            raise ParameterSpecificationError("Specified mu of {} is not within bounds [{}, {}]".format(
+                mu, lower_bound, upper_bound))
         self.lower_bound = lower_bound
         self.upper_bound = upper_bound
 
@@ -102,14 +108,114 @@ class BoundedGaussian(Gaussian):
             return super(BoundedGaussian, self).lnprob(p)
 
 
-    def sample(self, size=None):
-        val = super(BoundedGaussian, self).sample(size)
-        out = True
-        while np.any(out):
-            out = np.where(np.logical_and(val < self.lower_bound, val > self.upper_bound))
-            val[out] = super(BoundedGaussian, self).sample(len(out[0]))
+    def sample(self, size=None, rng=None):
+        return truncated_normal(self.mu, self.sd, self.lower_bound, self.upper_bound, size, rng)
 
-        return val
+
+def truncated_normal(mu, sd, lower_bound, upper_bound, size=None, rng=None):
+    """
+    Draw from a normal distribution restricted to [lower_bound, upper_bound]
+
+    Draws are made by inverting the cumulative distribution, so this is as
+    fast for bounds far out in a tail as for bounds that cut off almost
+    nothing. Arguments broadcast like those of numpy.random.normal. Draws
+    come from rng (a numpy Generator or RandomState) if it is given, and the
+    global numpy random state otherwise.
+    """
+    if rng is None:
+        rng = random
+    a = (np.asarray(lower_bound, dtype=float) - mu) / sd
+    b = (np.asarray(upper_bound, dtype=float) - mu) / sd
+    # work in the lower tail, where the cdf does not round to 1
+    flip = a > -b
+    a, b = np.where(flip, -b, a), np.where(flip, -a, b)
+    z = ndtri(rng.uniform(ndtr(a), ndtr(b), size))
+    z = np.clip(np.where(flip, -z, z), np.where(flip, -b, a), np.where(flip, -a, b))
+    return mu + sd * z
+
+
+class JointPrior(object):
+    """
+    Independent priors on several parameters, evaluated together
+
+    lnprob and sample work on whole (walker, parameter) arrays, so a batch
+    of walkers needs a few array operations rather than a python call per
+    parameter per walker.
+
+    Parameters
+    ----------
+    priors : list of Prior
+        One prior per parameter, in the order of the columns of the arrays
+        this will be used with. Priors other than Uniform and (Bounded)
+        Gaussian are supported, but evaluated one value at a time.
+    """
+    def __init__(self, priors):
+        self.priors = list(priors)
+        n = len(self.priors)
+        self._lower = np.full(n, -np.inf)
+        self._upper = np.full(n, np.inf)
+        self._lnprob = 0
+        gaussian, others = [], []
+        for i, p in enumerate(self.priors):
+            if isinstance(p, Uniform):
+                self._lower[i], self._upper[i] = p.lower_bound, p.upper_bound
+                self._lnprob += p._lnprob
+            elif isinstance(p, Gaussian):
+                self._lower[i] = getattr(p, 'lower_bound', -np.inf)
+                self._upper[i] = getattr(p, 'upper_bound', np.inf)
+                self._lnprob += p._lnprob_normalization
+                gaussian.append(i)
+            else:
+                others.append(i)
+        self._gaussian = np.array(gaussian, dtype=int)
+        self._mu = np.array([self.priors[i].mu for i in gaussian])
+        self._twice_var = np.array([2*self.priors[i].sdsq for i in gaussian])
+        self._others = others
+
+    def lnprob(self, values):
+        """
+        Joint log prior probability
+
+        Parameters
+        ----------
+        values : array (parameter) or (walker, parameter)
+
+        Returns
+        -------
+        lnprob : float or array (walker)
+        """
+        values = np.asarray(values, dtype=float)
+        single = values.ndim == 1
+        values = np.atleast_2d(values)
+        g = values[:, self._gaussian]
+        lnprob = self._lnprob - ((g - self._mu)**2 / self._twice_var).sum(axis=1)
+        for i in self._others:
+            lnprob += [self.priors[i].lnprob(v) for v in values[:, i]]
+        out = ((values < self._lower) | (values > self._upper)).any(axis=1)
+        lnprob[out] = -np.inf
+        if single:
+            return lnprob[0]
+        return lnprob
+
+    def sample(self, size=None, rng=None):
+        """
+        Draw from each prior
+
+        Parameters
+        ----------
+        size : int (optional)
+            Number of draws
+        rng : numpy Generator or RandomState (optional)
+            Source of random numbers, the global numpy random state is used
+            if not given
+
+        Returns
+        -------
+        samples : array (parameter) or (size, parameter)
+        """
+        if rng is None:
+            return np.array([p.sample(size=size) for p in self.priors]).T
+        return np.array([p.sample(size=size, rng=rng) for p in self.priors]).T
 
 
 def updated(prior, v, extra_uncertainty=0):
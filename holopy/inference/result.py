@@ -20,21 +20,37 @@ Results of sampling
 
 .. moduleauthor:: Thomas G. Dimiduk <tom@dimiduk.net>
 """
+import os
 from copy import copy
 from collections import OrderedDict
+from collections.abc import Sequence
 
 import yaml
 import xarray as xr
 import numpy as np
 import scipy.special
 import h5py
+import h5netcdf
 
-from holopy.core.holopy_object import HoloPyObject
+from holopy.core.holopy_object import HoloPyObject, Loader, Dumper
 from holopy.core.io.io import pack_attrs, unpack_attrs
 
 _res_ds_contents = ['samples', 'lnprobs', 'data']
 
+# number of sample values lazy results read from disk at a time
+_chunk_values = 2**20
+
 class SamplingResult(HoloPyObject):
+    """
+    Samples of a posterior, with the model and strategy that produced them
+
+    Results loaded with lazy=True keep their samples on disk. Their MAP,
+    mean, median and sigma_intervals are then computed reading a block of
+    steps at a time, so summarizing a result never holds the whole chain
+    in memory (the values are the same as for a loaded result).
+    """
+    lazy = False
+
     def __init__(self, dataset, model, strategy):
         self.dataset = dataset
         self.model = model
@@ -54,16 +70,91 @@ class SamplingResult(HoloPyObject):
 
     @property
     def MAP(self):
-        m = self.samples[np.unravel_index(self.lnprobs.argmax(), self.lnprobs.shape)]
+        if self.lazy:
+            index = self._chunked_argmax()
+        else:
+            index = np.unravel_index(self.lnprobs.argmax(), self.lnprobs.shape)
+        m = self.samples[index]
         return xr.DataArray(m, dims=['parameter'], coords={'parameter': m.parameter}, attrs={})
 
+    @property
+    def _sample_dims(self):
+        # walker and chain, plus chain_group for results of several ensembles
+        return [d for d in self.samples.dims if d != 'parameter']
+
     @property
     def mean(self):
-        return self.samples.mean(dim=['walker', 'chain'])
+        if self.lazy:
+            total, n = 0, 0
+            for chunk in self._sample_chunks():
+                total = total + chunk.sum(axis=0)
+                n += len(chunk)
+            return self._parameter_array(total / n)
+        return self.samples.mean(dim=self._sample_dims)
 
     @property
     def median(self):
-        return self.samples.median(dim=['walker', 'chain'])
+        if self.lazy:
+            return self._parameter_array(chunked_percentile(self._sample_chunks, [50])[0])
+        return self.samples.median(dim=self._sample_dims)
+
+    def _parameter_array(self, values):
+        return xr.DataArray(values, dims=['parameter'],
+                            coords={'parameter': self.samples.parameter.values})
+
+    def _step_blocks(self, var):
+        # var a block of steps at a time, read from disk only as needed
+        nsteps = var.sizes['chain']
+        step = max(1, _chunk_values // max(var.size // max(nsteps, 1), 1))
+        for start in range(0, nsteps, step):
+            yield start, var.isel(chain=slice(start, start + step))
+
+    def _sample_chunks(self):
+        # samples as (sample, parameter) arrays, a block of steps at a time
+        dims = self._sample_dims + ['parameter']
+        for start, block in self._step_blocks(self.samples):
+            block = block.transpose(*dims).values
+            yield block.reshape(-1, block.shape[-1])
+
+    def _chunked_argmax(self):
+        # like argmax, ties go to the first maximum in the full array's order
+        # (not the first block), so lazy and eager results agree
+        axis = self.lnprobs.dims.index('chain')
+        shape = self.lnprobs.shape
+        best, index = -np.inf, None
+        for start, block in self._step_blocks(self.lnprobs):
+            block = block.values
+            i = np.argmax(block)
+            candidate = list(np.unravel_index(i, block.shape))
+            candidate[axis] += start
+            if (index is None or block.flat[i] > best or (block.flat[i] == best and
+                    np.ravel_multi_index(candidate, shape) < np.ravel_multi_index(index, shape))):
+                best, index = block.flat[i], candidate
+        return tuple(index)
+
+    def rhat(self, burn_in=0):
+        """
+        Gelman-Rubin statistic comparing the independent ensembles of a
+        result with a chain_group dimension
+
+        Values close to 1 (say below 1.1) mean the ensembles have converged
+        to the same distribution.
+
+        Parameters
+        ----------
+        burn_in : int
+            Number of steps at the start of each chain to leave out
+
+        Returns
+        -------
+        rhat : xarray (parameter)
+        """
+        if 'chain_group' not in self.samples.dims:
+            raise ValueError("R-hat needs samples from several independent chain groups")
+        samples = self.samples.isel(chain=slice(burn_in, None))
+        samples = samples.transpose('chain_group', 'walker', 'chain', 'parameter')
+        return xr.DataArray(gelman_rubin(samples.values), dims=['parameter'],
+                            coords={'parameter': samples.parameter})
 
     def values(self, sigma_interval=1):
         def uncval(mp, interval):
@@ -76,9 +167,14 @@ class SamplingResult(HoloPyObject):
         return {p.name: uncval(MAP, si) for p, MAP, si in zip(self.model.parameters, self.MAP, self.sigma_intervals([-sigma_interval, sigma_interval]).T)}
 
     def sigma_intervals(self, sigmas=[-2, -1, 1, 2]):
+        def percent(s):
+            return 50 * (1+scipy.special.erf(s/np.sqrt(2)))
+        if self.lazy:
+            p = chunked_percentile(self._sample_chunks, [percent(s) for s in sigmas])
+            return xr.DataArray(p, dims=['sigma', 'parameter'],
+                                coords={'sigma': sigmas, 'parameter': self.samples.parameter.values})
         def quantile(s):
-            q = 50 * (1+scipy.special.erf(s/np.sqrt(2)))
-            p = self.samples.reduce(np.percentile, q=q, dim=['walker', 'chain'])
+            p = self.samples.reduce(np.percentile, q=percent(s), dim=self._sample_dims)
             p.coords['sigma'] = s
             return p
         return xr.concat([quantile(s) for s in sigmas], dim='sigma')
@@ -89,15 +185,18 @@ class SamplingResult(HoloPyObject):
 
     def _serialization_ds(self):
         ds = copy(self.dataset)
-        ds.attrs['model'] = yaml.dump(self.model)
-        ds.attrs['strategy'] = yaml.dump(self.strategy)
+        ds.attrs['model'] = yaml.dump(self.model, Dumper=Dumper)
+        ds.attrs['strategy'] = yaml.dump(self.strategy, Dumper=Dumper)
         ds.attrs['_source_class'] = self._source_class
         ds.data.attrs = pack_attrs(ds.data)
         autocorr_to_sentinal(ds.samples)
         autocorr_to_sentinal(ds.lnprobs)
         if 'flat' in ds:
-            ds.rename({'flat': 'point'}, inplace=True)
-            ds['point'].values = np.arange(len(ds.point))
+            # keep x, y, z as plain coordinates so the data is still usable
+            levels = {name: ('point', ds.indexes['flat'].get_level_values(name))
+                      for name in ds.indexes['flat'].names}
+            ds = ds.drop('flat').rename({'flat': 'point'})
+            ds = ds.assign_coords(point=np.arange(ds.dims['point']), **levels)
         return ds
 
     @property
@@ -110,13 +209,16 @@ class SamplingResult(HoloPyObject):
         ds.to_netcdf(filename, engine='h5netcdf')
 
     @classmethod
-    def _load(cls, ds):
+    def _load(cls, ds, lazy=False):
         if isinstance (ds, str):
-            ds = xr.open_dataset(ds, engine='h5netcdf')
+            # without cache, a lazy result reads its samples each time they
+            # are used instead of keeping them in memory
+            ds = xr.open_dataset(ds, engine='h5netcdf', cache=not lazy)
         ds.data.attrs = unpack_attrs(ds.data.attrs)
-        model = yaml.load(ds.attrs.pop('model'))
-        strategy = yaml.load(ds.attrs.pop('strategy'))
+        model = yaml.load(ds.attrs.pop('model'), Loader=Loader)
+        strategy = yaml.load(ds.attrs.pop('strategy'), Loader=Loader)
         r = cls(dataset=ds, model=model, strategy=strategy)
+        r.lazy = lazy
         autocorr_from_sentinal(r.samples)
         autocorr_from_sentinal(r.lnprobs)
         return r
@@ -126,6 +228,14 @@ def get_stage_names(inf):
     del d['end_result']
     return d
 
+def write_tempered_header(filename, strategy, model=None):
+    # make up a dummy xarray so that we have somewhere to store the strategy
+    attrs = {'strategy': yaml.dump(strategy, Dumper=Dumper),
+             '_source_class': "holopy.inference.TemperedSamplingResult"}
+    if model is not None:
+        attrs['model'] = yaml.dump(model, Dumper=Dumper)
+    xr.Dataset({}, attrs=attrs).to_netcdf(filename, engine='h5netcdf')
+
 class TemperedSamplingResult(SamplingResult):
     def __init__(self, end_result, stage_results, strategy):
         self.end_result = end_result
@@ -141,10 +251,12 @@ class TemperedSamplingResult(SamplingResult):
     def dataset(self):
         return self.end_result.dataset
 
+    @property
+    def lazy(self):
+        return self.end_result.lazy
+
     def _save(self, filename):
-        # make up a dummy xarray so that we have somewhere to store the strategy
-        s = xr.Dataset({}, attrs={'strategy': yaml.dump(self.strategy), '_source_class': self._source_class})
-        s.to_netcdf(filename, engine='h5netcdf')
+        write_tempered_header(filename, self.strategy)
 
         def write(ds, group, mode='a'):
             ds.to_netcdf(filename, engine='h5netcdf', group=group, mode=mode)
@@ -156,9 +268,17 @@ class TemperedSamplingResult(SamplingResult):
 
 
     @classmethod
-    def _load(cls, inf):
+    def _load(cls, inf, lazy=False):
         with xr.open_dataset(inf, engine='h5netcdf') as top:
-            strategy = yaml.load(top.attrs['strategy'])
+            strategy = yaml.load(top.attrs['strategy'], Loader=Loader)
+
+        if lazy:
+            # leave the file open and read each stage when it is first used
+            end_result = SamplingResult._load(
+                xr.open_dataset(inf, engine='h5netcdf', group='end_result', cache=False),
+                lazy=True)
+            stages = LazyStageResults(inf, list(get_stage_names(inf)))
+            return TemperedSamplingResult(end_result, stages, strategy)
 
         with xr.open_dataset(inf, engine='h5netcdf', group='end_result') as end:
             # we have to force the load, since the lazy load does not get
@@ -173,6 +293,161 @@ class TemperedSamplingResult(SamplingResult):
 
         return TemperedSamplingResult(end_result, stages, strategy)
 
+class LazyStageResults(Sequence):
+    """
+    The stage results of a saved TemperedSamplingResult, each opened (as a
+    lazy SamplingResult) the first time it is used
+    """
+    def __init__(self, filename, groups):
+        self.filename = filename
+        self.groups = groups
+        self._results = {}
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = range(len(self))[i]
+        if i not in self._results:
+            ds = xr.open_dataset(self.filename, engine='h5netcdf', group=self.groups[i],
+                                 cache=False)
+            self._results[i] = SamplingResult._load(ds, lazy=True)
+        return self._results[i]
+
+class ChainWriter(object):
+    """
+    Write an emcee chain to a file while it is being sampled
+
+    The file has the layout of a saved SamplingResult (or, with group, of one
+    stage of a saved TemperedSamplingResult), with the chain dimension
+    growing every time the writer is called. The sampler's random state is
+    stored alongside, so an interrupted run can continue where it stopped.
+
+    Parameters
+    ----------
+    filename : str
+        File to write to. If it already contains a chain, sampling will
+        resume from the end of that chain.
+    group : str (optional)
+        netCDF group to write the chain into
+    every : int
+        Number of sampler steps between writes
+    """
+    def __init__(self, filename, group=None, every=10):
+        self.filename = filename
+        self.group = group
+        self.every = every
+        self.nsteps = 0
+        self._naccepted = 0
+        self._sampler_steps = 0
+        self._header = None
+        if self._in_file():
+            with self._open() as ds:
+                self.nsteps = ds.dims['chain']
+                self._naccepted = ds.naccepted.values
+
+    def _in_file(self):
+        if not os.path.exists(self.filename):
+            return False
+        with h5py.File(self.filename, 'r') as f:
+            g = f if self.group is None else f.get(self.group)
+            return g is not None and 'samples' in g
+
+    def _open(self):
+        return xr.open_dataset(self.filename, engine='h5netcdf', group=self.group)
+
+    def prepare(self, model, strategy, data):
+        """
+        Set what to record with the chain, before starting a sampler
+        """
+        self._header = model, strategy, data
+        self._sampler_steps = 0
+
+    @property
+    def data(self):
+        """
+        The data the chain in the file was sampled against
+        """
+        with self._open() as ds:
+            data = ds.data.load()
+        data.attrs = unpack_attrs(data.attrs)
+        return data
+
+    def resume_state(self):
+        """
+        Get the state of the sampler at the end of the chain in the file
+
+        Returns
+        -------
+        pos : array (walker, parameter)
+            Last position of each walker
+        lnprob : array (walker)
+            lnposterior at pos
+        rstate : tuple
+            State of the sampler's random number generator
+        """
+        with self._open() as ds:
+            pos = ds.samples[:, -1].values
+            lnprob = ds.lnprobs[:, -1].values
+            rstate = ('MT19937', ds.attrs['rng_keys'].astype('uint32'),
+                      int(ds.attrs['rng_pos']), int(ds.attrs['rng_has_gauss']),
+                      float(ds.attrs['rng_cached_gaussian']))
+        return pos, lnprob, rstate
+
+    def write(self, sampler):
+        """
+        Append the steps sampler has taken since the last write
+        """
+        end = sampler.iterations
+        if end == self._sampler_steps:
+            return
+        chain = sampler.chain[:, self._sampler_steps:end]
+        lnprobs = sampler.lnprobability[:, self._sampler_steps:end]
+        naccepted = self._naccepted + sampler.naccepted
+        state = sampler.random_state
+        rng_attrs = {'rng_keys': state[1], 'rng_pos': state[2],
+                     'rng_has_gauss': state[3], 'rng_cached_gaussian': state[4]}
+        if self.nsteps == 0:
+            model, strategy, data = self._header
+            ds = xr.Dataset({
+                'samples': xr.DataArray(chain, dims=['walker', 'chain', 'parameter'],
+                                        coords={'parameter': [p.name for p in model.parameters]}),
+                'lnprobs': xr.DataArray(lnprobs, dims=['walker', 'chain']),
+                'naccepted': xr.DataArray(naccepted, dims=['walker']),
+                'data': data})
+            ds = SamplingResult(ds, model, strategy)._serialization_ds()
+            ds.attrs.update(rng_attrs)
+            mode = 'a' if os.path.exists(self.filename) else 'w'
+            ds.to_netcdf(self.filename, engine='h5netcdf', group=self.group,
+                         mode=mode, unlimited_dims=['chain'])
+        else:
+            with h5netcdf.File(self.filename, 'a') as f:
+                g = f if self.group is None else f[self.group]
+                g.resize_dimension('chain', self.nsteps + chain.shape[1])
+                g.variables['samples'][:, self.nsteps:, :] = chain
+                g.variables['lnprobs'][:, self.nsteps:] = lnprobs
+                g.variables['naccepted'][:] = naccepted
+                for key, val in rng_attrs.items():
+                    g.attrs[key] = val
+        self.nsteps += chain.shape[1]
+        self._sampler_steps = end
+
+    def result(self):
+        """
+        Load everything written so far as a SamplingResult
+        """
+        with self._open() as ds:
+            ds.load()
+        acceptance = float(ds.naccepted.sum()) / (ds.dims['walker'] * ds.dims['chain'])
+        ds = ds.drop('naccepted')
+        for key in ['rng_keys', 'rng_pos', 'rng_has_gauss', 'rng_cached_gaussian']:
+            del ds.attrs[key]
+        for var in ['samples', 'lnprobs']:
+            ds[var].attrs['acceptance_fraction'] = acceptance
+        return SamplingResult._load(ds)
+
 def autocorr_to_sentinal(d):
     if 'autocorr' in d.attrs and d.attrs['autocorr'] == None:
         d.attrs['autocorr'] = -1
@@ -183,6 +458,92 @@ def autocorr_from_sentinal(d):
         d.attrs['autocorr'] = None
     return d
 
+def chunked_percentile(chunks, q, bins=1024):
+    """
+    np.percentile(x, q, axis=0) of the rows of a large array x, read in pieces
+
+    The result is exact, it does not depend on how x is split up. Each
+    piece is read three times: for the range of each column, for a histogram
+    of each column, and to keep the values in the histogram bins holding
+    the wanted order statistics. Only those values and one piece are held
+    in memory at a time.
+
+    Parameters
+    ----------
+    chunks : function
+        Called with no arguments, returns an iterator over pieces of x, as
+        (row, column) arrays
+    q : list of float
+        Percentiles to compute, between 0 and 100
+
+    Returns
+    -------
+    percentiles : array (len(q), column)
+    """
+    n, lower, upper = 0, np.inf, -np.inf
+    for chunk in chunks():
+        n += len(chunk)
+        lower = np.minimum(lower, chunk.min(axis=0))
+        upper = np.maximum(upper, chunk.max(axis=0))
+    width = np.where(upper > lower, (upper - lower) / bins, 1)
+    ncols = len(lower)
+
+    def bin_of(chunk):
+        return np.clip(((chunk - lower) / width).astype(int), 0, bins - 1)
+
+    counts = np.zeros((bins, ncols), dtype=int)
+    for chunk in chunks():
+        b = bin_of(chunk)
+        for j in range(ncols):
+            counts[:, j] += np.bincount(b[:, j], minlength=bins)
+    below = np.cumsum(counts, axis=0) - counts
+
+    # np.percentile's linear interpolation between order statistics
+    position = np.asarray(q, dtype=float) / 100 * (n - 1)
+    first = np.floor(position).astype(int)
+    ranks = np.concatenate((first, np.minimum(first + 1, n - 1)))
+    wanted = [np.searchsorted(below[:, j] + counts[:, j], ranks, side='right')
+              for j in range(ncols)]
+
+    kept = [[] for j in range(ncols)]
+    for chunk in chunks():
+        b = bin_of(chunk)
+        for j in range(ncols):
+            kept[j].append(chunk[np.isin(b[:, j], wanted[j]), j])
+
+    result = np.zeros((len(position), ncols))
+    for j in range(ncols):
+        values = np.sort(np.concatenate(kept[j]))
+        used = np.unique(wanted[j])
+        # index of each order statistic among the kept values
+        skipped = below[wanted[j], j] - np.array([counts[used[used < w], j].sum()
+                                                  for w in wanted[j]])
+        stats = values[ranks - skipped]
+        low, high = stats[:len(position)], stats[len(position):]
+        result[:, j] = low + (position - first) * (high - low)
+    return result
+
+def gelman_rubin(samples):
+    """
+    Gelman-Rubin potential scale reduction factor
+
+    Parameters
+    ----------
+    samples : array (group, walker, step, parameter)
+        Samples from several independent groups of walkers. The walkers of
+        a group are pooled and the group is treated as one chain.
+
+    Returns
+    -------
+    rhat : array (parameter)
+    """
+    samples = samples.reshape(samples.shape[0], -1, samples.shape[-1])
+    n = samples.shape[1]
+    within = samples.var(axis=1, ddof=1).mean(axis=0)
+    between = n * samples.mean(axis=1).var(axis=0, ddof=1)
+    pooled = (n - 1) / n * within + between / n
+    return np.sqrt(pooled / within)
+
 class UncertainValue(HoloPyObject):
     """
     Represent an uncertain value
@@ -20,16 +20,19 @@ Sample posterior probabilities given model and data
 
 .. moduleauthor:: Thomas G. Dimiduk <tom@dimiduk.net>
 """
+import os
+import inspect
 import multiprocessing
 
+import yaml
 import xarray as xr
 import numpy as np
 from emcee import EnsembleSampler
-import emcee
 
-from holopy.core.holopy_object import HoloPyObject
+from holopy.core.holopy_object import HoloPyObject, Loader
 from holopy.fitting import make_subset_data
-from holopy.inference.result import SamplingResult, TemperedSamplingResult
+from holopy.inference.result import (SamplingResult, TemperedSamplingResult, ChainWriter,
+                                     write_tempered_header, gelman_rubin)
 
 from . import prior
 
@@ -40,58 +43,250 @@ def autothreads(threads='auto', quiet=False):
         threads = 1
     return threads
 
+# model and data held by each WorkerPool worker process
+_worker_state = {}
+
+def _init_worker(model, barrier):
+    _worker_state['model'] = model
+    _worker_state['barrier'] = barrier
+
+def _load_worker_data(job):
+    data, cache_bytes = job
+    _worker_state['data'] = data
+    if hasattr(_worker_state['model'], 'use_coefficient_cache'):
+        _worker_state['model'].use_coefficient_cache(cache_bytes)
+    # block until every worker has its copy, so each worker gets exactly one
+    _worker_state['barrier'].wait()
+
+def _worker_cache_info(_):
+    info = getattr(_worker_state['model'], 'coefficient_cache_info', None)
+    # as in _load_worker_data, make sure each worker answers once
+    _worker_state['barrier'].wait()
+    return info
+
+def _worker_lnposterior(walker_pars):
+    model = _worker_state['model']
+    data = _worker_state['data']
+    if hasattr(model, 'lnposterior_walkers'):
+        return list(model.lnposterior_walkers(walker_pars, data))
+    return [model.lnposterior(p, data) for p in walker_pars]
+
+class WorkerPool(object):
+    """
+    Pool of processes that keeps a model loaded between sampling runs
+
+    The model is sent to each worker once, when the pool starts. Each run
+    then only sends its data (typically a small pixel subset) to the
+    workers, so a TemperedStrategy can reuse one pool for all of its stages
+    instead of starting new processes for each one.
+
+    Parameters
+    ----------
+    model : NoiseModel
+        The model that will be sampled with this pool
+    processes : int or 'auto'
+        Number of worker processes, 'auto' uses one per cpu
+
+    Notes
+    -----
+    Pass the pool to EmceeStrategy.sample, TemperedStrategy.sample or
+    tempered_sample and close it (or use it as a context manager) when done.
+    """
+    def __init__(self, model, processes='auto'):
+        self.model = model
+        self.processes = autothreads(processes)
+        self.data = None
+        barrier = multiprocessing.Barrier(self.processes)
+        self._pool = multiprocessing.Pool(self.processes, initializer=_init_worker,
+                                          initargs=(model, barrier))
+
+    def load_data(self, data):
+        """
+        Send data to every worker, replacing any previously loaded data
+
+        Workers also pick up the model's current coefficient cache setting
+        (see NoiseModel.use_coefficient_cache).
+        """
+        cache_bytes = getattr(self.model, '_coefficient_cache_bytes', None)
+        self._pool.map(_load_worker_data, [(data, cache_bytes)]*self.processes, chunksize=1)
+        self.data = data
+
+    def coefficient_cache_info(self):
+        """
+        Coefficient cache statistics summed over the workers, or None if the
+        workers are not caching
+        """
+        infos = self._pool.map(_worker_cache_info, range(self.processes), chunksize=1)
+        return _sum_cache_info([i for i in infos if i is not None])
+
+    def map(self, func, walker_pars):
+        # emcee calls this with its lnprobfn, but the workers already know
+        # the model and data, so only the walker positions are sent
+        chunks = np.array_split(np.array(walker_pars), self.processes)
+        results = self._pool.map(_worker_lnposterior, [c for c in chunks if len(c)])
+        return [r for chunk in results for r in chunk]
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _sum_cache_info(infos):
+    if not infos:
+        return None
+    total = {key: sum(info[key] for info in infos)
+             for key in ['hits', 'misses', 'evictions', 'currsize', 'currbytes']}
+    # limits apply to each process separately
+    total['maxbytes'] = infos[0]['maxbytes']
+    total['processes'] = len(infos)
+    return total
+
+def _coefficient_cache_attrs(model, pool=None):
+    if pool is not None and hasattr(pool, 'coefficient_cache_info'):
+        info = pool.coefficient_cache_info()
+    else:
+        info = getattr(model, 'coefficient_cache_info', None)
+        info = _sum_cache_info([info] if info is not None else [])
+    if info is None:
+        return {}
+    return {'coefficient_cache_' + key: value for key, value in info.items()
+            if value is not None}
+
 def sample_one_sigma_gaussian(result):
     v = result.values()
     new_pars = [prior.updated(p, v[p.name]) for p in result.model.parameters]
-    return np.vstack([p.sample(size=result.strategy.nwalkers)] for p in new_pars).T
+    return prior.JointPrior(new_pars).sample(size=result.strategy.nwalkers)
 
 def tempered_sample(model, data, nwalkers=100, min_pixels=50, max_pixels=2000,
                     samples=600, next_initial_dist=sample_one_sigma_gaussian,
-                    stages=3, stage_len=30, seed=None, threads='auto'):
+                    stages=3, stage_len=30, seed=None, threads='auto', selector=None,
+                    vectorize=False, pool=None, checkpoint=None, coefficient_cache_mb=64):
     if seed is not None:
         np.random.seed(seed)
-    s = TemperedStrategy(next_initial_dist, nwalkers, min_pixels, max_pixels, stages=stages, stage_len=stage_len, seed=seed, threads=threads)
-    return s.sample(model, data, samples)
+    s = TemperedStrategy(next_initial_dist, nwalkers, min_pixels, max_pixels, stages=stages, stage_len=stage_len, seed=seed, threads=threads, selector=selector, vectorize=vectorize, coefficient_cache_mb=coefficient_cache_mb)
+    return s.sample(model, data, samples, pool=pool, checkpoint=checkpoint)
+
+def resume_sampling(checkpoint, data, nsamples):
+    """
+    Continue an interrupted sampling run from its checkpoint file
+
+    Parameters
+    ----------
+    checkpoint : str
+        The file the interrupted run was given as checkpoint
+    data : xarray
+        The data that was being sampled. Stages that had already started
+        reuse the pixels stored in the checkpoint.
+    nsamples : int
+        Total number of samples the run was asked for
+
+    Returns
+    -------
+    result : SamplingResult or TemperedSamplingResult
+        If the run's strategy had a seed, the same result the run would have
+        returned had it not stopped. Without one, stages that had not started
+        draw their pixels and starting walkers from numpy's global random
+        state, so the run continues along a different (equally valid) path.
+    """
+    with xr.open_dataset(checkpoint, engine='h5netcdf') as top:
+        model = yaml.load(top.attrs['model'], Loader=Loader)
+        strategy = yaml.load(top.attrs['strategy'], Loader=Loader)
+    if 'checkpoint' not in inspect.signature(strategy.sample).parameters:
+        raise ValueError("{} does not support checkpoints, so its runs cannot be "
+                         "resumed".format(type(strategy).__name__))
+    return strategy.sample(model, data, nsamples, checkpoint=checkpoint)
 
 class EmceeStrategy(HoloPyObject):
-    def __init__(self, nwalkers=100, pixels=2000, threads='auto', cleanup_threads=True, seed=None):
+    def __init__(self, nwalkers=100, pixels=2000, threads='auto', cleanup_threads=True, seed=None, selector=None, vectorize=False):
         self.nwalkers = nwalkers
         self.pixels = pixels
         self.threads = threads
         self.cleanup_threads = cleanup_threads
         self.seed = seed
+        self.selector = selector
+        self.vectorize = vectorize
 
     def make_guess(self, parameters):
-        return np.vstack([p.sample(size=(self.nwalkers)) for p in parameters]).T
-
-    def sample(self, model, data, nsamples, walker_initial_pos=None):
-        if self.pixels is not None:
-            data = make_subset_data(data, pixels=self.pixels)
+        return prior.JointPrior(parameters).sample(size=self.nwalkers)
+
+    def sample(self, model, data, nsamples, walker_initial_pos=None, pool=None,
+               checkpoint=None, checkpoint_every=10):
+        """
+        Sample model's posterior for data
+
+        Parameters
+        ----------
+        checkpoint : str or ChainWriter (optional)
+            File to write the chain to while sampling. If it already holds
+            the start of a chain, sampling continues from where it stopped,
+            with the pixels it was using.
+        checkpoint_every : int
+            Number of steps between writes to checkpoint
+        """
+        if checkpoint is not None and not isinstance(checkpoint, ChainWriter):
+            checkpoint = ChainWriter(checkpoint, every=checkpoint_every)
+        if checkpoint is not None and checkpoint.nsteps:
+            data = checkpoint.data
+        elif self.pixels is not None:
+            data = make_subset_data(data, pixels=self.pixels, selector=self.selector)
         if walker_initial_pos is None:
             walker_initial_pos = self.make_guess(model.parameters)
+        if checkpoint is not None:
+            checkpoint.prepare(model, self, data)
         sampler = sample_emcee(model=model, data=data, nwalkers=self.nwalkers,
                                walker_initial_pos=walker_initial_pos, nsamples=nsamples,
-                               threads=self.threads, cleanup_threads=self.cleanup_threads, seed=self.seed)
+                               threads=self.threads, cleanup_threads=self.cleanup_threads, seed=self.seed,
+                               vectorize=self.vectorize, pool=pool, checkpoint=checkpoint)
 
-        try:
-            acor = sampler.acor
-        except emcee.autocorr.AutocorrError:
-            acor = None
+        if checkpoint is not None:
+            # the sampler may only hold the end of the chain, so use the file
+            result = checkpoint.result()
+            acor = chain_autocorr(result.samples.values)
+            result.samples.attrs['autocorr'] = acor
+            result.lnprobs.attrs['autocorr'] = acor
+            return result
 
+        return self._result(sampler, model, data)
+
+    def _result(self, sampler, model, data, attrs={}):
         samples = emcee_samples_DataArray(sampler, model.parameters)
         lnprobs = emcee_lnprobs_DataArray(sampler)
-        return SamplingResult(xr.Dataset({'samples': samples, 'lnprobs': lnprobs, 'data': data}),
+        return SamplingResult(xr.Dataset({'samples': samples, 'lnprobs': lnprobs, 'data': data},
+                                         attrs=attrs),
                               model=model, strategy=self)
 
 
 class TemperedStrategy(EmceeStrategy):
-    def __init__(self, next_initial_dist=sample_one_sigma_gaussian, nwalkers=100, min_pixels=50, max_pixels=1000, threads='auto', stages=3, stage_len=30, seed=None):
+    """
+    Sample on increasingly large pixel subsets, starting each stage from the
+    last one's posterior
+
+    Parameters
+    ----------
+    coefficient_cache_mb : float or None
+        Memory (in MB, per process) for scattering coefficients shared by all
+        stages (see NoiseModel.use_coefficient_cache). Its statistics end up
+        in the end result's attrs. None turns the cache off. The model's own
+        cache setting is restored when sampling finishes.
+
+    Other parameters are as for EmceeStrategy.
+    """
+    def __init__(self, next_initial_dist=sample_one_sigma_gaussian, nwalkers=100, min_pixels=50, max_pixels=1000, threads='auto', stages=3, stage_len=30, seed=None, selector=None, vectorize=False, coefficient_cache_mb=64):
 
         self.seed = seed
         self.stages = stages
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self.selector = selector
+        self.vectorize = vectorize
         self.stage_strategies = []
         for p in np.logspace(np.log10(min_pixels), np.log10(max_pixels), stages+1):
-            self.stage_strategies.append(EmceeStrategy(nwalkers=nwalkers, pixels=int(round(p)), threads=threads, seed=seed))
+            self.stage_strategies.append(EmceeStrategy(nwalkers=nwalkers, pixels=int(round(p)), threads=threads, seed=seed, selector=selector, vectorize=vectorize))
             if seed is not None:
                 seed += 1
 
@@ -99,25 +294,232 @@ class TemperedStrategy(EmceeStrategy):
         self.stage_len=stage_len
         self.nwalkers=nwalkers
         self.next_initial_dist = next_initial_dist
+        self.coefficient_cache_mb = coefficient_cache_mb
+
+    def sample(self, model, data, nsamples, pool=None, checkpoint=None, checkpoint_every=10):
+        """
+        Sample model's posterior for data, in stages of increasing pixel count
+
+        Parameters
+        ----------
+        checkpoint : str (optional)
+            File to write each stage's chain to while sampling, laid out like
+            a saved TemperedSamplingResult. If it is from an interrupted run,
+            finished stages are loaded from it and sampling continues from
+            where it stopped.
+        checkpoint_every : int
+            Number of steps between writes to checkpoint
+        """
+        def stage_checkpoint(group):
+            if checkpoint is None:
+                return None
+            return ChainWriter(checkpoint, group=group, every=checkpoint_every)
+
+        if checkpoint is not None and not os.path.exists(checkpoint):
+            write_tempered_header(checkpoint, self, model)
+
+        cache = self.coefficient_cache_mb is not None and hasattr(model, 'use_coefficient_cache')
+        if cache:
+            model_cache_bytes = model._coefficient_cache_bytes
+            model.use_coefficient_cache(int(self.coefficient_cache_mb * 2**20))
+        # share one set of worker processes between all the stages
+        own_pool = (pool is None and not self.vectorize and
+                    autothreads(self.threads) > 1)
+        try:
+            if own_pool:
+                pool = WorkerPool(model, self.threads)
+            stage_results = []
+            guess = self.make_guess(model.parameters)
+            for i, stage in enumerate(self.stage_strategies[:-1]):
+                result = stage.sample(model, data, nsamples=self.stage_len, walker_initial_pos=guess, pool=pool,
+                                      checkpoint=stage_checkpoint('stage_results[{}]'.format(i)))
+                guess = self.next_initial_dist(result)
+                stage_results.append(result)
+
+            result = self.stage_strategies[-1].sample(model=model, data=data, nsamples=nsamples, walker_initial_pos=guess, pool=pool,
+                                                      checkpoint=stage_checkpoint('end_result'))
+            result.dataset.attrs.update(_coefficient_cache_attrs(model, pool))
+        finally:
+            if own_pool and pool is not None:
+                pool.close()
+            if cache:
+                model.use_coefficient_cache(model_cache_bytes)
 
-    def sample(self, model, data, nsamples):
-        stage_results = []
-        guess = self.make_guess(model.parameters)
-        for stage in self.stage_strategies[:-1]:
-            result = stage.sample(model, data, nsamples=self.stage_len, walker_initial_pos=guess)
-            guess = self.next_initial_dist(result)
-            stage_results.append(result)
+        return TemperedSamplingResult(end_result=result, stage_results=stage_results, strategy=self)
 
-        result = self.stage_strategies[-1].sample(model=model, data=data, nsamples=nsamples, walker_initial_pos=guess)
 
-        return TemperedSamplingResult(end_result=result, stage_results=stage_results, strategy=self)
+class AutocorrStrategy(EmceeStrategy):
+    """
+    Sample until the chain holds a target number of independent samples
+
+    The chain length is chosen as sampling proceeds from estimates of the
+    autocorrelation time, see sample_emcee_autocorr. The estimates and the
+    reason sampling stopped are kept in the result's attrs.
+
+    Parameters
+    ----------
+    independent_samples : int
+        Number of independent samples wanted after burn in
+    max_samples : int
+        Hard cap on the chain length
+    estimated_autocorr : float
+        Initial guess of the autocorrelation time, in steps
+    burn_in : float
+        Number of autocorrelation times to treat as burn in
+    """
+    def __init__(self, nwalkers=100, pixels=2000, independent_samples=1000, max_samples=10000,
+                 estimated_autocorr=10, burn_in=5, threads='auto', cleanup_threads=True,
+                 seed=None, selector=None, vectorize=False):
+        super().__init__(nwalkers=nwalkers, pixels=pixels, threads=threads,
+                         cleanup_threads=cleanup_threads, seed=seed, selector=selector,
+                         vectorize=vectorize)
+        self.independent_samples = independent_samples
+        self.max_samples = max_samples
+        self.estimated_autocorr = estimated_autocorr
+        self.burn_in = burn_in
+
+    def sample(self, model, data, nsamples=None, walker_initial_pos=None, pool=None):
+        """
+        Sample model's posterior for data
+
+        nsamples, if given, replaces max_samples as the cap on chain length
+        """
+        if self.pixels is not None:
+            data = make_subset_data(data, pixels=self.pixels, selector=self.selector)
+        if walker_initial_pos is None:
+            walker_initial_pos = self.make_guess(model.parameters)
+        if nsamples is None:
+            nsamples = self.max_samples
+        sampler, trail = sample_emcee_autocorr(
+            model, data, self.nwalkers, self.independent_samples, walker_initial_pos,
+            estimated_autocorr=self.estimated_autocorr, max_samples=nsamples,
+            burn_in=self.burn_in, threads=self.threads, cleanup_threads=self.cleanup_threads,
+            seed=self.seed, vectorize=self.vectorize, pool=pool)
+        return self._result(sampler, model, data, attrs=trail)
+
+
+class MultiChainStrategy(EmceeStrategy):
+    """
+    Sample with several independent ensembles, each in its own process
+
+    All ensembles sample the same pixel subset. Their samples are merged
+    into one SamplingResult with a chain_group dimension, whose rhat method
+    compares the ensembles (the Gelman-Rubin statistic over the second half
+    of the chains is also kept in the result's attrs).
+
+    Parameters
+    ----------
+    nchains : int
+        Number of independent ensembles
+    processes : int or 'auto'
+        Number of processes to run ensembles in, 'auto' for one per core (up
+        to nchains). With 1 (or None) the ensembles run one after another
+        in this process.
+    seed : int (optional)
+        Seed for a numpy SeedSequence, from which the pixel selection and
+        each ensemble's initial walkers and moves get their own independent
+        stream. The global numpy random state is never used, so runs are
+        reproducible whatever else is sampling in the same process.
+
+    Other parameters are as for EmceeStrategy. Each ensemble evaluates its
+    walkers in its own process, so there is no threads argument.
+    """
+    def __init__(self, nchains=4, nwalkers=100, pixels=2000, processes='auto', seed=None,
+                 selector=None, vectorize=False):
+        super().__init__(nwalkers=nwalkers, pixels=pixels, threads=None, seed=seed,
+                         selector=selector, vectorize=vectorize)
+        self.nchains = nchains
+        self.processes = processes
 
+    def sample(self, model, data, nsamples, walker_initial_pos=None):
+        """
+        Sample model's posterior for data
 
-def get_acor(sampler):
-    try:
-        return sampler.acor
-    except emcee.autocorr.AutocorrError:
+        walker_initial_pos, if given, is used by every ensemble. By default
+        each ensemble draws its own from the priors.
+        """
+        seeds = np.random.SeedSequence(self.seed).spawn(self.nchains + 1)
+        if self.pixels is not None:
+            data = make_subset_data(data, pixels=self.pixels, selector=self.selector,
+                                    rng=np.random.default_rng(seeds[0]))
+        jobs = [(model, data, self.nwalkers, nsamples, walker_initial_pos, self.vectorize, seed)
+                for seed in seeds[1:]]
+        processes = min(autothreads(self.processes), self.nchains)
+        if processes > 1:
+            with multiprocessing.Pool(processes) as pool:
+                chains = pool.map(_sample_chain_group, jobs)
+        else:
+            chains = [_sample_chain_group(job) for job in jobs]
+
+        chain = np.array([c[0] for c in chains])
+        lnprob = np.array([c[1] for c in chains])
+        attrs = {"acceptance_fraction": np.mean([c[2] for c in chains]),
+                 "autocorr": chain_autocorr(chain.reshape((-1,) + chain.shape[2:]))}
+        samples = xr.DataArray(chain, dims=['chain_group', 'walker', 'chain', 'parameter'],
+                               coords={'parameter': [p.name for p in model.parameters]},
+                               attrs=attrs)
+        lnprobs = xr.DataArray(lnprob, dims=['chain_group', 'walker', 'chain'], attrs=dict(attrs))
+        rhat = gelman_rubin(chain[:, :, nsamples//2:])
+        return SamplingResult(xr.Dataset({'samples': samples, 'lnprobs': lnprobs, 'data': data},
+                                         attrs={'rhat': rhat}),
+                              model=model, strategy=self)
+
+def _sample_chain_group(job):
+    # one ensemble of MultiChainStrategy, random numbers only from seed
+    model, data, nwalkers, nsamples, walker_initial_pos, vectorize, seed = job
+    guess_seed, sampler_seed = seed.spawn(2)
+    if walker_initial_pos is None:
+        walker_initial_pos = prior.JointPrior(model.parameters).sample(
+            size=nwalkers, rng=np.random.default_rng(guess_seed))
+    sampler = _make_sampler(model, data, nwalkers, None, None, vectorize, None)
+    sampler.random_state = np.random.RandomState(np.random.MT19937(sampler_seed)).get_state()
+    sampler.run_mcmc(walker_initial_pos, nsamples)
+    return sampler.chain, sampler.lnprobability, sampler.acceptance_fraction.mean()
+
+
+def autocorr_time(chain, c=5):
+    """
+    Estimate the integrated autocorrelation time of each parameter
+
+    The autocorrelation function is averaged over walkers, as recommended for
+    ensemble samplers by Goodman & Weare, and summed up to the first window
+    M with M >= c * tau(M) (Sokal's automatic windowing).
+
+    Parameters
+    ----------
+    chain : array (walker, step, parameter)
+        Samples to estimate the autocorrelation time of
+    c : float
+        Window size, in autocorrelation times
+
+    Returns
+    -------
+    tau : array (parameter)
+        Autocorrelation time in steps, inf for parameters that never change
+    """
+    nsteps = chain.shape[1]
+    x = chain - chain.mean(axis=1, keepdims=True)
+    n = 2**int(np.ceil(np.log2(2*nsteps)))
+    f = np.fft.rfft(x, n=n, axis=1)
+    acf = np.fft.irfft(f * np.conj(f), n=n, axis=1)[:, :nsteps].mean(axis=0)
+    tau = np.full(chain.shape[2], np.inf)
+    for i in range(chain.shape[2]):
+        if acf[0, i] <= 0:
+            continue
+        taus = 2 * np.cumsum(acf[:, i] / acf[0, i]) - 1
+        window = np.arange(nsteps) >= c * taus
+        tau[i] = taus[np.argmax(window)] if window.any() else taus[-1]
+    return tau
+
+def chain_autocorr(chain, min_autocorrs=50):
+    # None if chain is too short to trust the estimate
+    tau = autocorr_time(chain)
+    if chain.shape[1] < min_autocorrs * tau.max():
         return None
+    return tau
+
+def get_acor(sampler):
+    return chain_autocorr(sampler.chain)
 
 def emcee_samples_DataArray(sampler, parameters):
     return xr.DataArray(sampler.chain, dims=['walker', 'chain', 'parameter'],
@@ -131,35 +533,147 @@ def emcee_lnprobs_DataArray(sampler):
                                "autocorr": get_acor(sampler)})
 
 def sample_emcee_autocorr(model, data, nwalkers, independent_samples, walker_initial_pos,
-                          estimated_autocorr, threads='auto'):
-    def target_chain_len(autocorr):
-        return estimated_burn_in + max(desired_samples/self.nwalkers, 10) * estimated_autocorr
+                          estimated_autocorr=10, max_samples=10000, burn_in=5,
+                          min_autocorrs=50, threads='auto', cleanup_threads=True, seed=None,
+                          vectorize=False, pool=None):
+    """
+    Sample model's posterior until the chain holds enough independent samples
+
+    The chain is run in chunks. After each chunk the integrated
+    autocorrelation time tau is estimated from the chain so far, and the
+    chain length needed becomes the larger of burn_in*tau +
+    independent_samples*tau/nwalkers (each walker contributes one independent
+    sample every tau steps after burn in) and min_autocorrs*tau (needed to
+    trust the estimate of tau). Each chunk grows the chain by at least 10%.
+    Sampling stops once the chain is that long, or at max_samples steps.
+
+    Parameters
+    ----------
+    independent_samples : int
+        Number of independent samples wanted after burn in
+    estimated_autocorr : float
+        Guess of tau used to choose the length of the first chunk
+    max_samples : int
+        Hard cap on the number of steps
+    burn_in : float
+        Number of autocorrelation times to treat as burn in
+
+    Other parameters are as for sample_emcee
+
+    Returns
+    -------
+    sampler : EnsembleSampler
+    trail : dict
+        Chain length, estimated tau and chain length needed after each
+        chunk, the reason sampling stopped and the number of independent
+        samples obtained
+    """
+    def chain_len(tau):
+        return max(burn_in*tau + independent_samples*tau/nwalkers, min_autocorrs*tau)
+
+    sampler = _make_sampler(model, data, nwalkers, threads, seed, vectorize, pool)
+
+    pos, lnprob, rstate = walker_initial_pos, None, None
+    tau = estimated_autocorr
+    steps, taus, needed = [], [], []
+    while True:
+        # grow by at least 10% so creeping estimates don't cost a chunk per step
+        target = int(np.ceil(min(max(chain_len(tau), 1.1*sampler.iterations), max_samples)))
+        pos, lnprob, rstate = sampler.run_mcmc(pos, target - sampler.iterations,
+                                               rstate0=rstate, lnprob0=lnprob)[:3]
+        tau = autocorr_time(sampler.chain).max()
+        steps.append(sampler.iterations)
+        taus.append(tau)
+        needed.append(chain_len(tau))
+        if chain_len(tau) <= sampler.iterations:
+            stop = 'converged'
+            break
+        if sampler.iterations >= max_samples:
+            stop = 'max_samples'
+            break
+
+    _cleanup_sampler(sampler, pool, vectorize, cleanup_threads)
+
+    trail = {'autocorr_steps': np.array(steps), 'autocorr_estimates': np.array(taus),
+             'autocorr_needed_steps': np.array(needed), 'autocorr_stop': stop,
+             'independent_samples': max(nwalkers*(sampler.iterations/tau - burn_in), 0)}
+    return sampler, trail
+
+class WalkerBatch(object):
+    """
+    Stand in for a pool that evaluates all of emcee's walkers in one call
+
+    emcee maps its lnprobfn over the walkers with pool.map. This instead hands
+    the whole ensemble to model.lnposterior_walkers, so the model can share
+    work between walkers.
+    """
+    def __init__(self, model, data):
+        self.model = model
+        self.data = data
+
+    def map(self, func, walker_pars):
+        return self.model.lnposterior_walkers(np.array(walker_pars), self.data)
 
-    samples = target_chain_len(estimated_autocorr)
-
-    sampler = sample_emcee(model, data, nwalkers, walker_initial_pos, )
+def sample_emcee(model, data, nwalkers, nsamples, walker_initial_pos,
+                 threads='auto', cleanup_threads=True, seed=None, vectorize=False,
+                 pool=None, checkpoint=None):
+    """
+    Sample model's posterior for data with emcee
+
+    If vectorize is True, threads is ignored and all walkers are evaluated
+    together in this process with model.lnposterior_walkers. If a WorkerPool
+    is given as pool, threads and vectorize are ignored and the pool is left
+    running for further use.
+
+    If checkpoint (a prepared ChainWriter) is given, the chain is written to
+    it every checkpoint.every steps. If it already holds steps, sampling
+    resumes from the end of them and only the remaining steps are run.
+    """
+    lnprob0 = rstate0 = None
+    if checkpoint is not None and checkpoint.nsteps:
+        walker_initial_pos, lnprob0, rstate0 = checkpoint.resume_state()
+        nsamples = max(nsamples - checkpoint.nsteps, 0)
+
+    sampler = _make_sampler(model, data, nwalkers, threads, seed, vectorize, pool)
+
+    if checkpoint is None:
+        sampler.run_mcmc(walker_initial_pos, nsamples)
+    else:
+        steps = sampler.sample(walker_initial_pos, lnprob0=lnprob0, rstate0=rstate0,
+                               iterations=nsamples)
+        for i, _ in enumerate(steps):
+            if (i + 1) % checkpoint.every == 0:
+                checkpoint.write(sampler)
+        checkpoint.write(sampler)
+
+    _cleanup_sampler(sampler, pool, vectorize, cleanup_threads)
 
-    acor = sampler.acor
-    # if the actual autocorr is larger than our estimate, run some more samples
-    if target_chain_len(sampler.acor) > samples:
-        more = target_chain_len(sampler.acor) - samples
-        sampler.run_mcmc(None, more)
+    return sampler
 
-def sample_emcee(model, data, nwalkers, nsamples, walker_initial_pos,
-                 threads='auto', cleanup_threads=True, seed=None):
-    sampler = EnsembleSampler(nwalkers, len(list(model.parameters)),
-                              model.lnposterior,
-                              threads=autothreads(threads), args=[data])
+def _make_sampler(model, data, nwalkers, threads, seed, vectorize, pool):
+    if pool is not None:
+        if pool.model is not model:
+            raise ValueError("pool was created for a different model")
+        pool.load_data(data)
+        sampler = EnsembleSampler(nwalkers, len(list(model.parameters)),
+                                  model.lnposterior, args=[data], pool=pool)
+    elif vectorize:
+        sampler = EnsembleSampler(nwalkers, len(list(model.parameters)),
+                                  model.lnposterior, args=[data],
+                                  pool=WalkerBatch(model, data))
+    else:
+        sampler = EnsembleSampler(nwalkers, len(list(model.parameters)),
+                                  model.lnposterior,
+                                  threads=autothreads(threads), args=[data])
     if seed is not None:
         np.random.seed(seed)
         seed_state = np.random.mtrand.RandomState(seed).get_state()
         sampler.random_state=seed_state
+    return sampler
 
-    sampler.run_mcmc(walker_initial_pos, nsamples)
-
-    if sampler.pool is not None and cleanup_threads:
+def _cleanup_sampler(sampler, pool, vectorize, cleanup_threads):
+    # only shut down pools that emcee started for us
+    if pool is None and not vectorize and sampler.pool is not None and cleanup_threads:
         sampler.pool.terminate()
         sampler.pool.join()
 
-    return sampler
-
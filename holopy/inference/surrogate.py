@@ -0,0 +1,286 @@
+# Copyright 2011-2016, Vinothan N. Manoharan, Thomas G. Dimiduk,
+# Rebecca W. Perry, Jerome Fung, Ryan McGorty, Anna Wang, Solomon Barkley
+#
+# This file is part of HoloPy.
+#
+# HoloPy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HoloPy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HoloPy.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Cheap emulators of forward models, and sampling that uses them to save
+exact model evaluations without changing the posterior sampled.
+"""
+
+import xarray as xr
+import numpy as np
+
+from holopy.core.metadata import flat
+from holopy.fitting import make_subset_data
+from holopy.inference.prior import JointPrior
+from holopy.inference.result import SamplingResult
+from holopy.inference.sample import EmceeStrategy, chain_autocorr
+
+
+class PCASurrogate(object):
+    """
+    Emulate a NoiseModel's holograms of one set of data
+
+    Holograms are computed with the exact model at ntrain points drawn from
+    the priors and reduced to their leading principal components. The
+    component weights are interpolated between training points with cubic
+    radial basis functions (plus a linear term), so evaluating the surrogate
+    costs a few small matrix products instead of a scattering calculation.
+
+    Parameters
+    ----------
+    model : NoiseModel
+        The model to emulate
+    data : xarray
+        The data (usually a pixel subset) the surrogate will be compared to
+    ntrain : int
+        Number of exact holograms to build the surrogate from
+    variance : float
+        Fraction of the variance of the training holograms to keep when
+        choosing how many principal components to use
+    seed : int or numpy Generator (optional)
+        Seed for drawing the training points, or the generator to draw them
+        from. numpy's global random state is not used or changed.
+
+    Notes
+    -----
+    The surrogate has lnposterior and lnposterior_walkers like the model, so it
+    can also be sampled directly with sample_emcee for a fast approximate
+    posterior.
+    """
+    def __init__(self, model, data, ntrain=200, variance=0.9999, seed=None):
+        rng = np.random.default_rng(seed)
+        self.model = model
+        self.data = flat(data)
+        self._data_values = self.data.values.ravel()
+        names = [p.name for p in model.parameters]
+        # noise_sd does not change the hologram, so leave it out of the fit
+        self._inputs = [i for i, name in enumerate(names) if name != 'noise_sd']
+
+        train = JointPrior(model.parameters).sample(size=ntrain, rng=rng)
+        inputs, holos = [], []
+        for vals in train:
+            pars = model._pack(vals)
+            pars.pop('noise_sd', None)
+            holo = model._forward(pars, self.data, profile=True)
+            if np.all(np.isfinite(holo)):
+                inputs.append(vals[self._inputs])
+                holos.append(np.asarray(holo).ravel())
+        self.training_evaluations = len(train)
+        inputs, holos = np.array(inputs), np.array(holos)
+
+        self._mean = holos.mean(axis=0)
+        u, s, vt = np.linalg.svd(holos - self._mean, full_matrices=False)
+        kept = np.cumsum(s**2) / (s**2).sum()
+        self.ncomponents = int(np.searchsorted(kept, variance) + 1)
+        self._basis = vt[:self.ncomponents]
+        weights = (holos - self._mean).dot(self._basis.T)
+
+        self._lower = inputs.min(axis=0)
+        self._scale = np.where(np.ptp(inputs, axis=0) > 0, np.ptp(inputs, axis=0), 1)
+        self._centers = self._normalize(inputs)
+        n, d = self._centers.shape
+        lhs = np.zeros((n + d + 1, n + d + 1))
+        lhs[:n, :n] = _cubic(self._centers, self._centers)
+        lhs[:n, n:] = _linear_terms(self._centers)
+        lhs[n:, :n] = lhs[:n, n:].T
+        rhs = np.vstack((weights, np.zeros((d + 1, self.ncomponents))))
+        self._coefficients = np.linalg.lstsq(lhs, rhs, rcond=None)[0]
+
+    @property
+    def parameters(self):
+        return self.model.parameters
+
+    def _normalize(self, inputs):
+        return (inputs - self._lower) / self._scale
+
+    def forward(self, walker_pars):
+        """
+        Emulated holograms for each row of walker_pars, as a (walker, pixel)
+        array with pixels in the order of the flattened data
+        """
+        x = self._normalize(np.atleast_2d(walker_pars)[:, self._inputs])
+        n = len(self._centers)
+        weights = (_cubic(x, self._centers).dot(self._coefficients[:n]) +
+                   _linear_terms(x).dot(self._coefficients[n:]))
+        return self._mean + weights.dot(self._basis)
+
+    def lnposterior_walkers(self, walker_pars, data=None):
+        """
+        Approximate lnposterior for each row of walker_pars
+
+        data is accepted for compatibility with models, the surrogate always
+        compares against the data it was built for.
+        """
+        walker_pars = np.atleast_2d(walker_pars)
+        lnprobs = self.model.lnprior(walker_pars)
+        ok = np.isfinite(lnprobs)
+        if not ok.any():
+            return lnprobs
+        noise_sd = np.array([self.model._pack(p).get('noise_sd', self.model.noise_sd)
+                             for p in walker_pars[ok]])
+        resid = ((self.forward(walker_pars[ok]) - self._data_values)**2).sum(axis=1)
+        N = self._data_values.size
+        lnprobs[ok] += (-N*np.log(noise_sd*np.sqrt(2*np.pi)) - resid/(2*noise_sd**2))
+        return lnprobs
+
+    def lnposterior(self, par_vals, data=None):
+        return self.lnposterior_walkers([par_vals])[0]
+
+
+def _cubic(x, centers):
+    r = np.sqrt(((x[:, np.newaxis, :] - centers[np.newaxis, :, :])**2).sum(axis=-1))
+    return r**3
+
+def _linear_terms(x):
+    return np.hstack((np.ones((len(x), 1)), x))
+
+
+def sample_delayed_acceptance(model, surrogate, data, nwalkers, nsamples,
+                              walker_initial_pos, a=2., seed=None):
+    """
+    Sample model's exact posterior, screening proposals with a surrogate
+
+    Uses the affine invariant stretch move of emcee with delayed acceptance
+    (Christen & Fox 2005): each proposal is first accepted or rejected using
+    the surrogate's posterior, and only proposals that pass are evaluated
+    with the exact model, which makes the final decision. The chain samples
+    the exact posterior however poor the surrogate is; a good surrogate just
+    means fewer wasted exact evaluations.
+
+    Parameters
+    ----------
+    model : NoiseModel
+        Exact model
+    surrogate : PCASurrogate (or anything with lnposterior_walkers)
+        Cheap approximation to model
+    a : float
+        Scale of the stretch move
+    seed : int (optional)
+        Seed for the sampler's random numbers
+
+    Returns
+    -------
+    chain : array (walker, chain, parameter)
+    lnprobs : array (walker, chain)
+        Exact lnposterior of the samples
+    stats : dict
+        Acceptance fraction and counts of exact and surrogate evaluations
+    """
+    def exact(walker_pars):
+        if hasattr(model, 'lnposterior_walkers'):
+            return model.lnposterior_walkers(walker_pars, data)
+        return np.array([model.lnposterior(p, data) for p in walker_pars])
+
+    rng = np.random.RandomState(seed)
+    pos = np.array(walker_initial_pos, dtype=float)
+    ndim = pos.shape[1]
+    lnp = exact(pos)
+    lnq = surrogate.lnposterior_walkers(pos, data)
+    n_exact = n_surrogate = nwalkers
+    n_screened = n_accepted = 0
+
+    chain = np.zeros((nwalkers, nsamples, ndim))
+    lnprobs = np.zeros((nwalkers, nsamples))
+    halves = np.arange(nwalkers) % 2
+    for step in range(nsamples):
+        for half in (0, 1):
+            active = np.nonzero(halves == half)[0]
+            others = np.nonzero(halves != half)[0]
+            z = ((a - 1) * rng.rand(len(active)) + 1)**2 / a
+            partners = pos[others[rng.randint(len(others), size=len(active))]]
+            proposed = partners - z[:, np.newaxis] * (partners - pos[active])
+
+            # first stage: the surrogate, including the stretch move's factor
+            lnq_new = surrogate.lnposterior_walkers(proposed, data)
+            n_surrogate += len(active)
+            first = np.log(rng.rand(len(active))) < ((ndim - 1) * np.log(z) +
+                                                     lnq_new - lnq[active])
+            if not first.any():
+                continue
+            n_screened += first.sum()
+
+            # second stage: correct the surrogate's error with the exact model
+            passed = active[first]
+            lnp_new = exact(proposed[first])
+            n_exact += first.sum()
+            second = np.log(rng.rand(len(passed))) < (lnp_new - lnp[passed] -
+                                                      (lnq_new[first] - lnq[passed]))
+            accepted = passed[second]
+            pos[accepted] = proposed[first][second]
+            lnp[accepted] = lnp_new[second]
+            lnq[accepted] = lnq_new[first][second]
+            n_accepted += second.sum()
+        chain[:, step] = pos
+        lnprobs[:, step] = lnp
+
+    stats = {'acceptance_fraction': n_accepted / float(nwalkers * nsamples),
+             'surrogate_acceptance_fraction': n_screened / float(nwalkers * nsamples),
+             'exact_evaluations': n_exact, 'surrogate_evaluations': n_surrogate}
+    return chain, lnprobs, stats
+
+
+class DelayedAcceptanceStrategy(EmceeStrategy):
+    """
+    Sample with a surrogate model screening proposals for the exact model
+
+    A PCASurrogate is built for the pixel subset being sampled and used as the
+    first stage of sample_delayed_acceptance. The samples follow the exact
+    posterior; the counts of exact evaluations made (including the ones
+    used to train the surrogate) are kept in the result's attrs.
+
+    Parameters
+    ----------
+    ntrain : int
+        Number of exact holograms to build the surrogate from
+    variance : float
+        Fraction of the training holograms' variance the surrogate keeps
+
+    Other parameters are as for EmceeStrategy. Walkers are all evaluated in
+    this process, so there is no threads argument.
+    """
+    def __init__(self, nwalkers=100, pixels=2000, ntrain=200, variance=0.9999, seed=None,
+                 selector=None):
+        super().__init__(nwalkers=nwalkers, pixels=pixels, threads=None, seed=seed,
+                         selector=selector)
+        self.ntrain = ntrain
+        self.variance = variance
+
+    def sample(self, model, data, nsamples, walker_initial_pos=None):
+        # pixels, starting positions and training points all come from one
+        # generator seeded with self.seed
+        rng = np.random.default_rng(self.seed)
+        if self.pixels is not None:
+            data = make_subset_data(data, pixels=self.pixels, selector=self.selector, rng=rng)
+        if walker_initial_pos is None:
+            walker_initial_pos = JointPrior(model.parameters).sample(size=self.nwalkers, rng=rng)
+        surrogate = PCASurrogate(model, data, ntrain=self.ntrain, variance=self.variance,
+                                 seed=rng)
+        chain, lnprobs, stats = sample_delayed_acceptance(
+            model, surrogate, data, self.nwalkers, nsamples, walker_initial_pos,
+            seed=self.seed)
+
+        attrs = {"acceptance_fraction": stats['acceptance_fraction'],
+                 "autocorr": chain_autocorr(chain)}
+        samples = xr.DataArray(chain, dims=['walker', 'chain', 'parameter'],
+                               coords={'parameter': [p.name for p in model.parameters]},
+                               attrs=attrs)
+        lnprobs = xr.DataArray(lnprobs, dims=['walker', 'chain'], attrs=dict(attrs))
+        stats['training_evaluations'] = surrogate.training_evaluations
+        stats['surrogate_components'] = surrogate.ncomponents
+        return SamplingResult(xr.Dataset({'samples': samples, 'lnprobs': lnprobs, 'data': data},
+                                         attrs=stats),
+                              model=model, strategy=self)
@@ -20,19 +20,22 @@
 
 import warnings
 import numpy as np
-from numpy.testing import assert_equal
+from numpy.testing import assert_equal, assert_raises
 from holopy.inference import prior, sample
 from holopy.core.process import normalize
 from holopy.core.tests.common import assert_obj_close, get_example_data
-from holopy.scattering import Sphere, Mie
+from holopy.scattering import Sphere, Mie, calc_holo
+from holopy.scattering.calculations import calc_holo_best_scaling
+from holopy.core.metadata import detector_grid, update_metadata, flat
 from holopy.fitting import model
+from holopy.fitting.errors import ParameterSpecificationError
 from holopy.inference.noise_model import AlphaModel,NoiseModel
 
 #GOLD:log(sqrt(0.5/pi))-1/2
 gold_sigma=-1.4189385332
 
 #GOLD:inference result - depends on both seeds
-gold_alpha=np.array([0.700926])
+gold_alpha=np.array([0.649683])
 gold_nsteps=10
 gold_frac=0.925
 
@@ -50,3 +53,49 @@ def test_subset_tempering():
         warnings.simplefilter('ignore')
         inf = sample.tempered_sample(mod, holo, nwalkers=4, samples=10, stages=1, stage_len=10, threads=None, seed=40)
     assert_obj_close(inf.MAP,gold_alpha, rtol=1e-3)
+
+def test_profile_alpha_lnlike():
+    schema = update_metadata(detector_grid(20, .1), illum_wavelen=.66,
+                             medium_index=1.33, illum_polarization=(1, 0))
+    holo = calc_holo(schema, Sphere(r=.5, n=1.58, center=[1, 1, 5]), scaling=.6)
+    mod = AlphaModel(Sphere(r=prior.Uniform(.4, .6), n=1.58, center=[1, 1, 5]),
+                     noise_sd=.1, profile_alpha=True)
+    assert_equal(len(mod.parameters), 1)
+    N = holo.size
+    assert_obj_close(mod.lnlike([.5], flat(holo)), -N*np.log(.1*np.sqrt(2*np.pi)))
+
+def test_flat_lnlike():
+    schema = update_metadata(detector_grid(20, .1), illum_wavelen=.66,
+                             medium_index=1.33, illum_polarization=(1, 0))
+    holo = flat(calc_holo(schema, Sphere(r=.5, n=1.58, center=[1, 1, 5]), scaling=.6))
+    holo += np.random.RandomState(0).normal(0, .01, holo.shape)
+    for profile in [False, True]:
+        mod = AlphaModel(Sphere(r=prior.Uniform(.4, .6), n=1.58, center=[1, 1, 5]),
+                         noise_sd=.01, profile_alpha=profile,
+                         alpha=None if profile else prior.Uniform(.4, 1))
+        pars = [.51] if profile else [.51, .6]
+        lnlike = mod.lnlike(pars, holo)
+        # the same likelihood computed through xarray
+        mod._flat_detector = lambda data: None
+        assert_obj_close(lnlike, float(mod.lnlike(pars, holo)))
+
+def test_alpha_scales_hologram():
+    schema = update_metadata(detector_grid(20, .1), illum_wavelen=.66,
+                             medium_index=1.33, illum_polarization=(1, 0))
+    holo = calc_holo(schema, Sphere(r=.5, n=1.58, center=[1, 1, 5]), scaling=.6)
+    holo += np.random.RandomState(0).normal(0, .01, holo.shape)
+    profiled = AlphaModel(Sphere(r=prior.Uniform(.4, .6), n=1.58, center=[1, 1, 5]),
+                          noise_sd=.01, profile_alpha=True)
+    fixed = AlphaModel(Sphere(r=prior.Uniform(.4, .6), n=1.58, center=[1, 1, 5]),
+                       noise_sd=.01, alpha=prior.Uniform(.4, 1))
+    best = calc_holo_best_scaling(holo, Sphere(r=.51, n=1.58, center=[1, 1, 5]))[1]
+    for data in [holo, flat(holo)]:
+        # sampling alpha at the profiled value gives the profiled likelihood
+        assert_obj_close(fixed.lnlike([.51, best], data), profiled.lnlike([.51], data))
+        assert fixed.lnlike([.51, .9], data) < profiled.lnlike([.51], data)
+
+    # away from the data a profiled model has nothing to solve alpha against
+    assert_raises(ParameterSpecificationError, profiled._forward, {'r': .51}, schema)
+    assert_obj_close(profiled.best_alpha({'r': .51}, holo), best)
+    assert_obj_close(profiled._forward({'r': .51, 'alpha': best}, schema),
+                     fixed._forward({'r': .51, 'alpha': best}, schema))
@@ -24,6 +24,7 @@ import numpy as np
 
 from holopy.inference import prior
 from holopy.inference.result import UncertainValue
+from holopy.fitting.errors import ParameterSpecificationError
 from holopy.core.tests.common import assert_obj_close
 #GOLD:log(sqrt(0.5/pi))-1/2
 gold_sigma=-1.4189385332
@@ -52,3 +53,22 @@ def test_updated():
     u=prior.updated(p,d)
     assert_equal(u.guess,1)
     assert_obj_close(u.lnprob(0),gold_sigma)
+
+def test_bounded_gaussian_sample():
+    g = prior.BoundedGaussian(1, 1, 0, 1.5)
+    s = g.sample(1000)
+    assert s.min() >= 0 and s.max() <= 1.5
+    # bounds far out in a tail
+    s = prior.truncated_normal(0, 1, 5, 6, size=1000)
+    assert s.min() >= 5 and s.max() <= 6
+    assert_raises(ParameterSpecificationError, prior.BoundedGaussian, 3, 1, 0, 2)
+
+def test_joint_prior():
+    priors = [prior.Uniform(0, 1), prior.Gaussian(1, 2), prior.BoundedGaussian(1, .5, 0, 1.2)]
+    joint = prior.JointPrior(priors)
+    values = np.random.uniform(-.5, 1.5, (50, 3))
+    gold = [sum(p.lnprob(v) for p, v in zip(priors, row)) for row in values]
+    assert_obj_close(joint.lnprob(values), gold)
+    assert_obj_close(joint.lnprob(values[0]), gold[0])
+    assert_equal(joint.sample(7).shape, (7, 3))
+    assert_equal(joint.sample().shape, (3,))
@@ -16,13 +16,19 @@
 # You should have received a copy of the GNU General Public License
 # along with HoloPy.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import tempfile
+
 import numpy as np
-from numpy.testing import assert_allclose
+from numpy.testing import assert_allclose, assert_raises, assert_equal
 
 from holopy.fitting.model import BaseModel
-from holopy.inference import prior, AlphaModel
-from holopy.inference.sample import sample_emcee, EmceeStrategy, tempered_sample
+from holopy.inference import prior, AlphaModel, resume_sampling
+from holopy.inference.sample import (sample_emcee, EmceeStrategy, tempered_sample, WorkerPool,
+                                     AutocorrStrategy, MultiChainStrategy, autocorr_time)
 from holopy.core.metadata import detector_grid
+from holopy.core.io import save, load
+from holopy.inference import result
 from holopy.fitting import make_subset_data
 from holopy.scattering import Sphere, calc_holo
 
@@ -49,3 +55,239 @@ def test_EmceeStrategy():
     strat = EmceeStrategy(10, None, None, seed=40)
     r = strat.sample(mod, data, 500)
     assert_allclose(r.MAP, .5, rtol=.001)
+
+def test_vectorized_walkers():
+    sch = detector_grid(8, .1)
+    scat = Sphere(n=1.59, r=.5, center=(.4, .4, 5))
+    holo = calc_holo(sch, scat, illum_wavelen=.66, medium_index=1.33,
+                     illum_polarization=(1, 0))
+    mod = AlphaModel(Sphere(n=1.59, r=.5, center=(prior.Uniform(0, .8),
+                                                  prior.Uniform(0, .8), 5)),
+                     noise_sd=.1, alpha=prior.Uniform(.5, 1), illum_wavelen=.66,
+                     medium_index=1.33, illum_polarization=(1, 0))
+    p0 = EmceeStrategy(6, None, seed=3).make_guess(mod.parameters)
+    assert_allclose(mod.lnposterior_walkers(p0, holo),
+                    [mod.lnposterior(p, holo) for p in p0])
+
+    # walkers differing only in position share a single theory call
+    theory = mod._walker_theory()
+    calls = []
+    raw_fields = theory._raw_fields
+    def counted(*args, **kwargs):
+        calls.append(args[0].shape)
+        return raw_fields(*args, **kwargs)
+    theory._raw_fields = counted
+    mod._walker_theory = lambda: theory
+    outside = np.vstack([p0, [[.4, .4, 2]]])
+    lnprobs = mod.lnposterior_walkers(outside, holo)
+    assert_equal(len(calls), 1)
+    assert_equal(calls[0][1], 6 * 64)
+    assert_equal(lnprobs[-1], -np.inf)
+    assert_allclose(lnprobs[:-1], [mod.lnposterior(p, holo) for p in p0])
+    del mod._walker_theory
+
+    profiled = AlphaModel(Sphere(n=1.59, r=.5, center=(prior.Uniform(0, .8),
+                                                       prior.Uniform(0, .8), 5)),
+                          noise_sd=.1, illum_wavelen=.66,
+                          medium_index=1.33, illum_polarization=(1, 0),
+                          profile_alpha=True)
+    assert_allclose(profiled.lnposterior_walkers(p0[:, :2], holo),
+                    [profiled.lnposterior(p, holo) for p in p0[:, :2]])
+
+    looped = sample_emcee(mod, holo, 6, 3, p0, threads=None, seed=40)
+    batched = sample_emcee(mod, holo, 6, 3, p0, seed=40, vectorize=True)
+    assert_allclose(batched.lnprobability, looped.lnprobability)
+    assert_allclose(batched.chain, looped.chain)
+
+def test_worker_pool():
+    mod = SimpleModel(prior.Uniform(0, 1))
+    p0 = np.linspace(0, 1, 10).reshape((10, 1))
+    looped = sample_emcee(mod, data, 10, 20, p0, threads=None, seed=40)
+    with WorkerPool(mod, 2) as pool:
+        pooled = sample_emcee(mod, data, 10, 20, p0, seed=40, pool=pool)
+        # the pool stays usable, with new data loaded into the same workers
+        again = sample_emcee(mod, np.array(.3), 10, 20, p0, seed=40, pool=pool)
+        assert_raises(ValueError, sample_emcee, SimpleModel(), data, 10, 20, p0,
+                      pool=pool)
+    assert_allclose(pooled.lnprobability, looped.lnprobability)
+    assert_allclose(again.chain[again.lnprobability==again.lnprobability.max()],
+                    .3, rtol=.05)
+
+def test_checkpoint_resume():
+    sch = detector_grid(6, .1)
+    holo = calc_holo(sch, Sphere(n=1.59, r=.5, center=(.3, .3, 5)), illum_wavelen=.66,
+                     medium_index=1.33, illum_polarization=(1, 0))
+    mod = AlphaModel(Sphere(n=1.59, r=.5, center=(prior.Uniform(0, .6),
+                                                  prior.Uniform(0, .6), 5)),
+                     noise_sd=.1, alpha=prior.Uniform(.5, 1), illum_wavelen=.66,
+                     medium_index=1.33, illum_polarization=(1, 0))
+    strat = EmceeStrategy(6, 20, threads=None, seed=12)
+    p0 = strat.make_guess(mod.parameters)
+    # same pixel subset for both runs
+    np.random.seed(3)
+    full = strat.sample(mod, holo, 7, walker_initial_pos=p0)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, 'chain.h5')
+        np.random.seed(3)
+        partial = strat.sample(mod, holo, 4, walker_initial_pos=p0,
+                               checkpoint=filename, checkpoint_every=3)
+        assert_equal(partial.samples.shape, (6, 4, 3))
+        resumed = resume_sampling(filename, holo, 7)
+    assert_allclose(resumed.samples, full.samples)
+    assert_allclose(resumed.lnprobs, full.lnprobs)
+    assert_allclose(resumed.data, full.data)
+    assert_allclose(resumed.samples.acceptance_fraction,
+                    full.samples.acceptance_fraction)
+
+    # a seeded tempered run continues exactly where it stopped
+    kwargs = dict(nwalkers=6, min_pixels=10, max_pixels=20, stages=1, stage_len=3,
+                  seed=40, threads=None)
+    full = tempered_sample(mod, holo, samples=7, **kwargs)
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, 'tempered.h5')
+        tempered_sample(mod, holo, samples=4, checkpoint=filename, **kwargs)
+        resumed = resume_sampling(filename, holo, 7)
+    assert_allclose(resumed.end_result.samples, full.end_result.samples)
+    assert_allclose(resumed.stage_results[0].samples, full.stage_results[0].samples)
+
+    # strategies that cannot write checkpoints cannot resume from them
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, 'autocorr.h5')
+        result.write_tempered_header(filename, AutocorrStrategy(6, 20), mod)
+        with assert_raises(ValueError) as cm:
+            resume_sampling(filename, holo, 7)
+    assert 'AutocorrStrategy' in str(cm.exception)
+
+def test_autocorr_time():
+    # AR(1) chains x[t] = phi x[t-1] + noise have tau = (1 + phi) / (1 - phi)
+    np.random.seed(7)
+    phi = .5
+    noise = np.random.normal(size=(20, 4000, 1))
+    chain = np.zeros_like(noise)
+    for t in range(1, chain.shape[1]):
+        chain[:, t] = phi * chain[:, t-1] + noise[:, t]
+    assert_allclose(autocorr_time(chain), 3, rtol=.1)
+    assert_equal(autocorr_time(np.ones((4, 100, 1))), [np.inf])
+
+def test_AutocorrStrategy():
+    mod = SimpleModel(prior.Uniform(0, 1))
+    strat = AutocorrStrategy(10, None, independent_samples=100, threads=None, seed=40)
+    r = strat.sample(mod, data)
+    assert_equal(r.dataset.attrs['autocorr_stop'], 'converged')
+    nsteps = r.samples.shape[1]
+    assert_equal(r.dataset.attrs['autocorr_steps'][-1], nsteps)
+    assert r.dataset.attrs['autocorr_needed_steps'][-1] <= nsteps
+    assert r.dataset.attrs['independent_samples'] >= 100
+
+    capped = strat.sample(mod, data, nsamples=60)
+    assert_equal(capped.dataset.attrs['autocorr_stop'], 'max_samples')
+    assert_equal(capped.samples.shape[1], 60)
+
+def test_MultiChainStrategy():
+    mod = SimpleModel(prior.Uniform(0, 1))
+    r = MultiChainStrategy(3, 10, None, processes=2, seed=40).sample(mod, data, 200)
+    assert_equal(r.samples.dims, ('chain_group', 'walker', 'chain', 'parameter'))
+    assert_equal(r.samples.shape, (3, 10, 200, 1))
+    assert (r.samples[0] != r.samples[1]).any()
+    assert_allclose(r.rhat(burn_in=100), 1, atol=.1)
+    assert_equal(r.dataset.attrs['rhat'].shape, (1,))
+    assert_allclose(r.mean, .5, atol=.05)
+    assert_equal(r.sigma_intervals().shape, (4, 1))
+
+    # the same seed gives the same samples however the ensembles are run,
+    # and whatever the global random state is doing
+    np.random.seed(1)
+    serial = MultiChainStrategy(3, 10, None, processes=None, seed=40).sample(mod, data, 200)
+    assert_equal(serial.samples.values, r.samples.values)
+    assert_raises(ValueError, EmceeStrategy(10, None, None, seed=40).sample(mod, data, 10).rhat)
+
+def test_lazy_result():
+    sch = detector_grid(6, .1)
+    holo = calc_holo(sch, Sphere(n=1.59, r=.5, center=(.3, .3, 5)), illum_wavelen=.66,
+                     medium_index=1.33, illum_polarization=(1, 0))
+    mod = AlphaModel(Sphere(n=1.59, r=prior.Uniform(.4, .6), center=(.3, .3, 5)),
+                     noise_sd=.1, alpha=prior.Uniform(.5, 1), illum_wavelen=.66,
+                     medium_index=1.33, illum_polarization=(1, 0))
+    tempered = tempered_sample(mod, holo, nwalkers=6, min_pixels=10, max_pixels=20,
+                               samples=12, stages=2, stage_len=5, threads=None, seed=3)
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, 'result.h5')
+        save(filename, tempered)
+        eager = load(filename)
+        lazy = load(filename, lazy=True)
+        assert lazy.lazy and not eager.lazy
+        assert_equal(len(lazy.stage_results._results), 0)
+        # read a few steps at a time
+        chunk_values = result._chunk_values
+        result._chunk_values = 20
+        try:
+            for r, l in [(eager, lazy), (eager.stage_results[1], lazy.stage_results[1])]:
+                assert_allclose(l.MAP, r.MAP)
+                assert_allclose(l.mean, r.mean)
+                assert_allclose(l.median, r.median)
+                assert_allclose(l.sigma_intervals(), r.sigma_intervals())
+        finally:
+            result._chunk_values = chunk_values
+        assert_equal(sorted(lazy.stage_results._results), [1])
+        # samples are read from the file each time, not kept
+        lazy.samples.values
+        assert not lazy.samples.variable._in_memory
+        lazy.end_result.dataset.close()
+        lazy.stage_results[1].dataset.close()
+
+def test_lazy_result_ties():
+    mod = SimpleModel(prior.Uniform(0, 1))
+    r = EmceeStrategy(4, None, None, seed=40).sample(mod, data, 10)
+    # equal maxima in the first and last block of steps, the first in
+    # (walker, step) order is the last step of walker 0
+    lnprobs = np.zeros(r.lnprobs.shape)
+    lnprobs[3, 0] = lnprobs[0, 9] = 1
+    r.dataset['lnprobs'].values = lnprobs
+    r.model = AlphaModel(Sphere(n=1.59, r=prior.Uniform(.4, .6), center=(.3, .3, 5)),
+                         noise_sd=.1, alpha=.8)
+    r.dataset['data'] = detector_grid(2, .1)
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, 'result.h5')
+        save(filename, r)
+        eager = load(filename)
+        lazy = load(filename, lazy=True)
+        chunk_values = result._chunk_values
+        result._chunk_values = 8
+        try:
+            # two steps of four walkers per block
+            assert_equal(len(list(lazy._sample_chunks())), 5)
+            assert_equal(lazy.MAP.values, eager.samples.values[0, 9])
+            assert_equal(lazy.MAP.values, eager.MAP.values)
+            q = [2.5, 50, 97.5]
+            assert_allclose(result.chunked_percentile(lazy._sample_chunks, q),
+                            np.percentile(eager.samples.values.reshape(-1, 1), q, axis=0))
+        finally:
+            result._chunk_values = chunk_values
+        lazy.dataset.close()
+
+def test_coefficient_cache():
+    sch = detector_grid(8, .1)
+    holo = calc_holo(sch, Sphere(n=1.59, r=.5, center=(.4, .4, 5)), illum_wavelen=.66,
+                     medium_index=1.33, illum_polarization=(1, 0))
+    mod = AlphaModel(Sphere(n=1.59, r=.5, center=(prior.Uniform(0, .8),
+                                                  prior.Uniform(0, .8), 5)),
+                     noise_sd=.1, alpha=prior.Uniform(.5, 1), illum_wavelen=.66,
+                     medium_index=1.33, illum_polarization=(1, 0))
+    kwargs = dict(nwalkers=6, min_pixels=10, max_pixels=20, samples=3, stages=1,
+                  stage_len=3, seed=40)
+    plain = tempered_sample(mod, holo, threads=None, coefficient_cache_mb=None, **kwargs)
+    assert 'coefficient_cache_hits' not in plain.end_result.dataset.attrs
+
+    cached = tempered_sample(mod, holo, threads=None, **kwargs)
+    attrs = cached.end_result.dataset.attrs
+    # only the position varies, so every sphere after the first reuses its coefficients
+    assert_equal(attrs['coefficient_cache_misses'], 1)
+    assert attrs['coefficient_cache_hits'] > 0
+    assert_allclose(cached.end_result.lnprobs, plain.end_result.lnprobs)
+    # sampling leaves the model's own setting alone
+    assert_equal(mod.coefficient_cache_info, None)
+
+    pooled = tempered_sample(mod, holo, threads=2, **kwargs)
+    assert_equal(pooled.end_result.dataset.attrs['coefficient_cache_processes'], 2)
+    assert_allclose(pooled.end_result.lnprobs, plain.end_result.lnprobs)
@@ -0,0 +1,64 @@
+# Copyright 2011-2016, Vinothan N. Manoharan, Thomas G. Dimiduk,
+# Rebecca W. Perry, Jerome Fung, Ryan McGorty, Anna Wang, Solomon Barkley
+#
+# This file is part of HoloPy.
+#
+# HoloPy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HoloPy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HoloPy.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_equal
+
+from holopy.core.metadata import detector_grid, flat
+from holopy.inference import prior, AlphaModel
+from holopy.inference.surrogate import (PCASurrogate, sample_delayed_acceptance,
+                                        DelayedAcceptanceStrategy)
+from holopy.scattering import Sphere, calc_holo
+
+def setup_model():
+    holo = calc_holo(detector_grid(10, .1), Sphere(n=1.59, r=.5, center=(.5, .5, 5)),
+                     illum_wavelen=.66, medium_index=1.33, illum_polarization=(1, 0))
+    holo += np.random.RandomState(2).normal(0, .02, holo.shape)
+    mod = AlphaModel(Sphere(n=1.59, r=.5, center=(prior.Uniform(.4, .6),
+                                                  prior.Uniform(.4, .6), 5)),
+                     noise_sd=.02, alpha=prior.Uniform(.9, 1.1), illum_wavelen=.66,
+                     medium_index=1.33, illum_polarization=(1, 0))
+    return mod, flat(holo)
+
+def test_surrogate_matches_model():
+    mod, holo = setup_model()
+    state = np.random.get_state()
+    surrogate = PCASurrogate(mod, holo, ntrain=60, seed=4)
+    assert surrogate.ncomponents < 60
+    # training points come from their own generator
+    assert_equal(np.random.get_state()[1], state[1])
+    assert_equal(PCASurrogate(mod, holo, ntrain=60, seed=4)._centers, surrogate._centers)
+    pars = [.45, .52, 1.]
+    exact = mod._forward(mod._pack(pars), holo)
+    assert_allclose(surrogate.forward(pars)[0], exact, atol=.01)
+    assert_equal(surrogate.lnposterior([.7, .5, 1.]), -np.inf)
+
+def test_delayed_acceptance():
+    mod, holo = setup_model()
+    p0 = np.random.RandomState(1).uniform([.45, .45, .95], [.55, .55, 1.05], (8, 3))
+    # with the exact model as its own surrogate, every screened proposal is accepted
+    chain, lnprobs, stats = sample_delayed_acceptance(mod, mod, holo, 8, 5, p0, seed=3)
+    assert_equal(stats['acceptance_fraction'], stats['surrogate_acceptance_fraction'])
+    assert_allclose(lnprobs[:, -1], [mod.lnposterior(p, holo) for p in chain[:, -1]])
+
+    strat = DelayedAcceptanceStrategy(8, None, ntrain=60, seed=4)
+    r = strat.sample(mod, holo, 40, walker_initial_pos=p0)
+    assert_allclose(r.MAP, [.5, .5, 1.], atol=.03)
+    attrs = r.dataset.attrs
+    assert attrs['exact_evaluations'] < attrs['surrogate_evaluations']
+    assert_equal(attrs['training_evaluations'], 60)
@@ -21,6 +21,7 @@ import numpy as np
 from ...core import detector_grid
 from ...scattering import Mie, Sphere, calc_field
 from .. import propagate
+from .. import convolution_propagation
 from ...core.tests.common import assert_obj_close, verify, get_example_data
 
 def test_propagate_e_field():
@@ -44,3 +45,21 @@ def test_propagate_0_distance():
 
     rec = propagate(im, [0, 3e-6])
     verify(rec, 'recon_multiple_with_0')
+
+def test_propagate_does_not_copy_data():
+    im = get_example_data('image0003')
+    transformed = []
+    fft = convolution_propagation.fft
+    def recording_fft(a, *args, **kwargs):
+        transformed.append(a)
+        return fft(a, *args, **kwargs)
+    convolution_propagation.fft = recording_fft
+    try:
+        propagate(im, 4e-6, medium_index=1.34)
+    finally:
+        convolution_propagation.fft = fft
+    # the hologram itself is transformed, only its metadata was updated
+    assert np.shares_memory(transformed[0].values, im.values)
+    assert transformed[0].medium_index == 1.34
+    assert im.medium_index != 1.34
+
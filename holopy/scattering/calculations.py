@@ -23,7 +23,9 @@ calc_intensity and calc_holo, based on subclass's calc_field
 """
 
 from ..core.holopy_object import SerializableMetaclass
-from ..core.metadata import vector, update_metadata, to_vector, copy_metadata, from_flat, detector_points
+from ..core.metadata import (vector, update_metadata, to_vector, copy_metadata, from_flat,
+                             detector_points, flat, get_values, default_norms,
+                             DetectorGeometry, Schema)
 from ..core.utils import dict_without, is_none
 from .scatterer import Sphere, Spheres, Spheroid, Cylinder
 from .errors import AutoTheoryFailed, MissingParameter
@@ -101,6 +103,8 @@ def calc_intensity(schema, scatterer, medium_index=None, illum_wavelen=None, ill
         scattered intensity
     """
     field = calc_field(schema, scatterer, medium_index=medium_index, illum_wavelen=illum_wavelen, illum_polarization=illum_polarization, theory=theory)
+    if isinstance(schema, Schema):
+        schema = schema._dataarray()
     return finalize(schema, (abs(field*(1-schema.normals))**2).sum(dim=vector))
 
 
@@ -132,12 +136,196 @@ def calc_holo(schema, scatterer, medium_index=None, illum_wavelen=None, illum_po
     if hasattr(scaling, 'guess'):
         scaling = scaling.guess
 
+    if isinstance(schema, Schema):
+        # calculate on plain arrays and only wrap the result in an xarray
+        holo = calc_holo_flat(schema, scatterer, medium_index, illum_wavelen,
+                              illum_polarization, theory, scaling)
+        if not all(is_none(v) for v in (medium_index, illum_wavelen, illum_polarization)):
+            schema = schema.like_me(medium_index=medium_index, illum_wavelen=illum_wavelen,
+                                    illum_polarization=illum_polarization)
+        return schema.to_dataarray(holo)
+
     theory = interpret_theory(scatterer,theory)
     uschema = prep_schema(schema, medium_index, illum_wavelen, illum_polarization)
     scat = theory._calc_field(scatterer.guess(), uschema)
     holo = scattered_field_to_hologram(scat*scaling, uschema.illum_polarization, uschema.normals)
     return finalize(uschema, holo)
 
+def calc_holo_best_scaling(data, scatterer, medium_index=None, illum_wavelen=None, illum_polarization=None, theory='auto'):
+    """
+    Calculate the hologram of scatterer with the reference wave scaling (alpha)
+    that best matches data
+
+    The hologram is quadratic in the scaling, so the scaling minimizing the
+    squared residual to data can be found in closed form from a single
+    scattered field calculation. This lets fits and likelihoods eliminate
+    alpha as a free parameter.
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        The measured hologram. It is also used as the schema for the
+        calculation, so it should carry the usual optical metadata.
+    scatterer : :class:`.scatterer` object
+        (possibly composite) scatterer for which to compute scattering
+    medium_index : float or complex
+        Refractive index of the medium in which the scatter is imbedded
+    illum_wavelen : float or ndarray(float)
+        Wavelength of illumination light.
+    theory : :class:`.theory` object (optional)
+        Scattering theory object to use for the calculation.
+
+    Returns
+    -------
+    holo : :class:`.Image` object
+        Calculated hologram using the best scaling
+    scaling : float
+        The scaling (alpha) that best matches data
+    """
+    theory = interpret_theory(scatterer,theory)
+    uschema = prep_schema(data, medium_index, illum_wavelen, illum_polarization)
+    scat = theory._calc_field(scatterer.guess(), uschema)
+    scaling = best_scaling(data, scat, uschema.illum_polarization, uschema.normals)
+    holo = scattered_field_to_hologram(scat*scaling, uschema.illum_polarization, uschema.normals)
+    return finalize(uschema, holo), scaling
+
+class FlatDetector(object):
+    """
+    A cartesian detector (and the data measured on it) as plain numpy arrays
+
+    calc_holo copies its schema, wraps fields in xarrays and aligns
+    coordinates on every call. Likelihoods and residuals compute many
+    holograms of the same points, so they can prepare the detector once with
+    this class and use calc_holo_flat instead.
+
+    Parameters
+    ----------
+    schema : xarray.DataArray
+        Detector or data with x, y, z coordinates (flattened or not)
+
+    Attributes
+    ----------
+    geometry : :class:`.DetectorGeometry`
+        Positions of the points, shared by every calculation on the detector
+    points : array (3, N)
+        x, y, z of each point, in the order of flat(schema)
+    values : array (N)
+        Values of schema at each point (the data, if schema is data)
+    weights : array (3)
+        1 - normals, the weight of each field component in the hologram
+    medium_index, illum_wavelen, illum_polarization
+        Optical metadata of schema (None if it does not have them)
+
+    Raises
+    ------
+    ValueError
+        If schema is not a single image on a cartesian detector
+    """
+    def __init__(self, schema):
+        f = flat(schema)
+        if f.ndim != 1 or not all(hasattr(f, c) for c in ('x', 'y', 'z')):
+            raise ValueError("Only cartesian detectors can be flattened to arrays")
+        normals = getattr(schema, 'normals', None)
+        if is_none(normals):
+            normals = default_norms(f.coords, 'auto')
+        normals = get_values(to_vector(normals))
+        if normals.shape != (3,):
+            raise ValueError("Only detectors with a single normal can be flattened to arrays")
+
+        self.geometry = DetectorGeometry(f)
+        self.values = np.ravel(f.values)
+        self.weights = 1 - normals
+        self.medium_index = getattr(schema, 'medium_index', None)
+        self.illum_wavelen = getattr(schema, 'illum_wavelen', None)
+        self.illum_polarization = to_vector(getattr(schema, 'illum_polarization', None))
+
+    @property
+    def points(self):
+        return self.geometry.points
+
+    @property
+    def size(self):
+        return self.values.size
+
+def _detector_optics(detector, medium_index, illum_wavelen, illum_polarization):
+    # same precedence and checks as prep_schema, without the copy
+    if medium_index is None:
+        medium_index = detector.medium_index
+    if illum_wavelen is None:
+        illum_wavelen = detector.illum_wavelen
+    if is_none(illum_polarization):
+        illum_polarization = detector.illum_polarization
+    if illum_wavelen is None:
+        raise MissingParameter("wavelength")
+    if medium_index is None:
+        raise MissingParameter("medium refractive index")
+    if is_none(illum_polarization):
+        raise MissingParameter("polarization")
+    return medium_index, illum_wavelen, to_vector(illum_polarization)
+
+def _flat_field(detector, scatterer, medium_index, illum_wavelen, illum_polarization, theory):
+    theory = interpret_theory(scatterer, theory)
+    optics = _detector_optics(detector, medium_index, illum_wavelen, illum_polarization)
+    scat = theory._calc_field_flat(scatterer.guess(), detector.geometry, *optics)
+    return scat, get_values(optics[2])
+
+def calc_holo_flat(detector, scatterer, medium_index=None, illum_wavelen=None, illum_polarization=None, theory='auto', scaling=1.0):
+    """
+    Calculate a hologram at the points of a FlatDetector or Schema
+
+    Equivalent to calc_holo, but returns a plain array in the order of
+    flat(schema) and skips all xarray bookkeeping.
+
+    Parameters
+    ----------
+    detector : :class:`FlatDetector` or :class:`.Schema`
+        Points to calculate at. Its optical metadata is used for any of
+        medium_index, illum_wavelen and illum_polarization not given.
+
+    Other parameters are as for calc_holo.
+
+    Returns
+    -------
+    holo : array (N)
+    """
+    if hasattr(scaling, 'guess'):
+        scaling = scaling.guess
+    scat, ref = _flat_field(detector, scatterer, medium_index, illum_wavelen,
+                            illum_polarization, theory)
+    return (np.abs(scat*scaling + ref)**2 * detector.weights).sum(axis=1)
+
+def calc_holo_flat_best_scaling(detector, scatterer, medium_index=None, illum_wavelen=None, illum_polarization=None, theory='auto'):
+    """
+    calc_holo_best_scaling for a FlatDetector made from the data
+
+    Returns
+    -------
+    holo : array (N)
+    scaling : float
+    """
+    scat, ref = _flat_field(detector, scatterer, medium_index, illum_wavelen,
+                            illum_polarization, theory)
+    scaling = _flat_best_scaling(detector.values, scat, ref, detector.weights)
+    return (np.abs(scat*scaling + ref)**2 * detector.weights).sum(axis=1), scaling
+
+def _calc_holos_flat(detector, scatterers, medium_index=None, illum_wavelen=None, illum_polarization=None, theory='auto', scalings=None):
+    """
+    calc_holo_flat for many scatterers sharing one theory call
+
+    Returns an array (len(scatterers), N) of holograms. If scalings is
+    None each hologram uses the scaling that best matches detector.values,
+    as in calc_holo_flat_best_scaling.
+    """
+    theory = interpret_theory(scatterers[0], theory)
+    optics = _detector_optics(detector, medium_index, illum_wavelen, illum_polarization)
+    scat = theory._calc_fields_flat([s.guess() for s in scatterers], detector.geometry, *optics)
+    ref = get_values(optics[2])
+    if scalings is None:
+        scalings = [_flat_best_scaling(detector.values, field, ref, detector.weights)
+                    for field in scat]
+    scalings = np.asarray(scalings, dtype=float)[:, np.newaxis, np.newaxis]
+    return (np.abs(scat*scalings + ref)**2 * detector.weights).sum(axis=-1)
+
 def calc_cross_sections(scatterer, medium_index=None, illum_wavelen=None, illum_polarization=None, theory='auto'):
     """
     Calculate scattering, absorption, and extinction
@@ -190,6 +378,8 @@ def calc_scat_matrix(schema, scatterer, medium_index=None, illum_wavelen=None, t
         Scattering matrices at specified positions
 
     """
+    if isinstance(schema, Schema):
+        schema = schema._dataarray()
     theory = interpret_theory(scatterer,theory)
     uschema=prep_schema(schema, medium_index=medium_index, illum_wavelen=illum_wavelen, illum_polarization = False)
     return finalize(uschema, theory._calc_scat_matrix(scatterer.guess(), uschema))
@@ -218,9 +408,13 @@ def calc_field(schema, scatterer, medium_index=None, illum_wavelen=None, illum_p
     e_field : :class:`.Vector` object
         Calculated hologram from the given distribution of spheres
     """
+    geometry = None
+    if isinstance(schema, Schema):
+        geometry = schema.geometry
+        schema = schema._dataarray()
     theory = interpret_theory(scatterer,theory)
     uschema = prep_schema(schema, medium_index=medium_index, illum_wavelen=illum_wavelen, illum_polarization=illum_polarization)
-    return finalize(uschema, theory._calc_field(scatterer.guess(), uschema))
+    return finalize(uschema, theory._calc_field(scatterer.guess(), uschema, geometry))
 
 # this is pulled out separate from the calc_holo method because occasionally you
 # want to turn prepared  e_fields into holograms directly
@@ -242,6 +436,55 @@ def scattered_field_to_hologram(scat, ref, normals):
 
     return holo
 
+def best_scaling(data, scat, ref, normals):
+    """
+    Find the scaling of scat that makes its hologram best match data
+
+    The hologram at each point is a + b*alpha + c*alpha**2, so the least
+    squares alpha is the real root of a cubic that minimizes the squared
+    residual.
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        Measured hologram, at the same points as scat
+    scat : xarray.DataArray
+        Unscaled scattered field
+    ref : xarray[vector]
+        The reference field
+    normals : xarray[vector]
+        Vector normal to the detector
+
+    Returns
+    -------
+    scaling : float
+    """
+    weights = 1 - normals
+    a = get_values((abs(ref)**2 * weights).sum(dim=vector))
+    b = get_values((2*(ref.conj()*scat).real * weights).sum(dim=vector))
+    c = get_values((abs(scat)**2 * weights).sum(dim=vector))
+    return _solve_scaling(a - np.ravel(get_values(flat(data))), b, c)
+
+def _flat_best_scaling(data, scat, ref, weights):
+    # best_scaling for plain arrays: data (N), scat (N, 3), ref and weights (3)
+    a = (abs(ref)**2 * weights).sum()
+    b = (2*(ref.conj()*scat).real * weights).sum(axis=1)
+    c = (abs(scat)**2 * weights).sum(axis=1)
+    return _solve_scaling(a - data, b, c)
+
+def _solve_scaling(a, b, c):
+    # minimize sum((a + b*alpha + c*alpha**2)**2) over alpha
+    coeffs = [2*(c*c).sum(), 3*(b*c).sum(), (b*b).sum() + 2*(a*c).sum(), (a*b).sum()]
+    if coeffs[0] == 0:
+        # no scattered field, so any scaling gives the same hologram
+        return 1.0
+    roots = np.roots(coeffs)
+    candidates = roots.real[abs(roots.imag) <= 1e-8 * abs(roots)]
+    if len(candidates) == 0:
+        candidates = roots.real
+    cost = [((a + b*alpha + c*alpha**2)**2).sum() for alpha in candidates]
+    return float(candidates[np.argmin(cost)])
+
 def _field_scalar_shape(e):
     # this is a clever hack with list arithmetic to get [1, 3] or [1,
     # 1, 3] as needed
@@ -84,21 +84,28 @@ class Scatterers(Scatterer):
 
     @classmethod
     def from_parameters(cls, parameters):
-        n_scatterers = len(set([p.split(':')[0] for p in list(parameters.keys())]))
-        collected = [{} for i in range(n_scatterers)]
+        plan = cls._compile_parameters(list(parameters.keys()))
+        return cls._from_compiled(plan, list(parameters.values()))
+
+    @classmethod
+    def _compile_parameters(cls, keys):
+        n_scatterers = len(set([p.split(':')[0] for p in keys]))
+        collected = [[] for i in range(n_scatterers)]
+        indices = [[] for i in range(n_scatterers)]
         types = [None] * n_scatterers
-        for key, val in parameters.items():
+        for i, key in enumerate(keys):
             n, spec = key.split(':', 1)
             n = int(n)
             scat_type, par = spec.split('.', 1)
 
-            collected[n][par] = val
+            collected[n].append(par)
+            indices[n].append(i)
             if types[n]:
                 assert types[n] == scat_type
             else:
                 types[n] = scat_type
 
-        scatterers = []
+        plan = []
         # pull in the scatterer package, this lets us grab scatterers by class
         # name
         # we have to do it here rather than at the top of the file because we
@@ -106,10 +113,15 @@ class Scatterers(Scatterer):
         # happen until import of composite finishes.
         from .. import scatterer
         for i, scat_type in enumerate(types):
-            scatterers.append(getattr(scatterer,
-                              scat_type).from_parameters(collected[i]))
+            scat_cls = getattr(scatterer, scat_type)
+            plan.append((scat_cls, scat_cls._compile_parameters(collected[i]), indices[i]))
 
-        return cls(scatterers)
+        return plan
+
+    @classmethod
+    def _from_compiled(cls, plan, values):
+        return cls([scat_cls._from_compiled(subplan, [values[i] for i in indices])
+                    for scat_cls, subplan, indices in plan])
 
     def _prettystr(self, level, indent="  "):
         '''
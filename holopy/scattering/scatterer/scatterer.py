@@ -241,12 +241,26 @@ class CenteredScatterer(Scatterer):
         scatterer: Scatterer class
             A scatterer with the given parameter values
         """
+        plan = cls._compile_parameters(list(parameters.keys()))
+        return cls._from_compiled(plan, list(parameters.values()))
+
+    @classmethod
+    def _compile_parameters(cls, keys):
+        """
+        Work out how to build a scatterer from values for keys (of the form
+        returned by Scatterer.parameters).
+
+        The result can be reused with _from_compiled to build many scatterers
+        without parsing the keys again, which matters when building scatterers
+        in the inner loop of a fit.
+        """
         # This will need to be overriden for subclasses that do anything
         # complicated with parameters
 
         collected = defaultdict(dict)
 
-        for key, val in parameters.items():
+        for i, key in enumerate(keys):
+            val = _Slot(i)
             tok = key.split('.', 1)
             if len(tok) > 1:
                 collected[tok[0]][tok[1]] = val
@@ -277,7 +291,38 @@ class CenteredScatterer(Scatterer):
         for key, val in collected_arrays.items():
             built[key] = build(val)
 
-        return cls(**built)
+        return built
+
+    @classmethod
+    def _from_compiled(cls, plan, values):
+        """
+        Build a scatterer from a plan made by _compile_parameters
+
+        Parameters
+        ----------
+        plan : object
+            Result of cls._compile_parameters(keys)
+        values : list
+            Parameter values, in the same order as keys
+        """
+        return cls(**{key: _fill_slots(spec, values) for key, spec in plan.items()})
+
+class _Slot(object):
+    """
+    Placeholder for the value of the i'th parameter in a compiled scatterer
+    """
+    def __init__(self, index):
+        self.index = index
+
+    def __repr__(self):
+        return "_Slot({})".format(self.index)
+
+def _fill_slots(spec, values):
+    if isinstance(spec, _Slot):
+        return values[spec.index]
+    if isinstance(spec, list):
+        return [_fill_slots(s, values) for s in spec]
+    return spec
 
 def find_bounds(indicator):
     """
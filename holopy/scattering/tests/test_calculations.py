@@ -22,9 +22,16 @@ calc_intensity and calc_holo, based on subclass's calc_field
 .. moduleauthor:: Thomas G. Dimiduk <tdimiduk@physics.harvard.edu>
 """
 
+import numpy as np
+from numpy.testing import assert_allclose, assert_equal
+
 from .. import Sphere, Spheres, Mie, Multisphere
-from ...core import detector_grid
-from ...core.tests.common import assert_obj_close
+from ...core import detector_grid, metadata
+from ...core.metadata import (update_metadata, copy_metadata, to_vector, Schema, flat,
+                              sphere_coords, detector_points, DetectorGeometry,
+                              detector_geometry)
+from ...core.tests.common import (assert_obj_close, assert_read_matches_write,
+                                  assert_pickle_roundtrip)
 from ..calculations import *
 
 scatterer = Sphere(n = 1.6, r=.5, center=(5, 5, 5))
@@ -51,3 +58,89 @@ def test_calc_scat_matrix():
 def test_determine_theory():
     assert_obj_close(determine_theory(Sphere()), Mie())
     assert_obj_close(determine_theory(Spheres([Sphere(), Sphere()])), Multisphere())
+
+def test_calc_holo_flat():
+    schema = update_metadata(locations, medium_index, wavelen, polarization)
+    detector = FlatDetector(flat(schema))
+    for scat in [scatterer, Spheres([scatterer, Sphere(n=1.6, r=.5, center=(4, 5, 5))])]:
+        holo = flat(calc_holo(schema, scat, scaling=.7))
+        assert_allclose(calc_holo_flat(detector, scat, scaling=.7), holo.values)
+
+    data = calc_holo(schema, scatterer, scaling=.6)
+    holo, scaling = calc_holo_flat_best_scaling(FlatDetector(data), scatterer)
+    assert_allclose(scaling, .6)
+    assert_allclose(holo, flat(data).values)
+
+def test_detector_geometry():
+    schema = update_metadata(locations, medium_index, wavelen, polarization)
+    geometry = DetectorGeometry(schema)
+    expected = sphere_coords(schema, scatterer.center, wavevec=3)
+    positions = geometry.spherical(scatterer.center, wavevec=3)
+    for i, c in enumerate(['r', 'theta', 'phi']):
+        assert_allclose(positions[i], expected[c])
+
+    # FlatDetector and Schema keep one geometry for all their calculations
+    detector = FlatDetector(schema)
+    assert_allclose(detector.geometry.points, geometry.points)
+    grid = Schema.from_dataarray(schema)
+    assert grid.geometry is grid.geometry
+    assert_allclose(grid.points, geometry.points)
+
+    # the xarray and flat paths compute the same fields
+    field = calc_field(flat(schema), Spheres([scatterer, Sphere(n=1.6, r=.5, center=(4, 5, 5))]),
+                       theory=Mie())
+    assert_allclose(field.transpose('flat', 'vector'), Mie()._calc_field_flat(
+        Spheres([scatterer, Sphere(n=1.6, r=.5, center=(4, 5, 5))]), geometry,
+        medium_index, wavelen, to_vector(polarization)))
+    assert_allclose(calc_field(grid, scatterer), calc_field(schema, scatterer))
+
+    # plain xarray detectors with the same coordinates share one geometry
+    assert detector_geometry(schema.copy()) is detector_geometry(schema)
+    assert detector_geometry(schema.assign_coords(x=schema.x + 1)) is not detector_geometry(schema)
+    hits = metadata._geometry_cache.hits
+    holo = calc_holo(schema, scatterer)
+    assert_allclose(calc_holo(schema.copy(), scatterer), holo)
+    assert_equal(metadata._geometry_cache.hits, hits + 2)
+
+    # detectors in spherical coordinates work too
+    points = detector_points(theta=[0, .5, 1], phi=[0, 0, 1], r=[10, 10, 10])
+    field = calc_field(points, scatterer, medium_index, wavelen, polarization)
+    assert_allclose(field.theta, [0, .5, 1])
+
+def test_schema():
+    schema = Schema((20, 15), .1, origin=(1, 2, 0), medium_index=medium_index,
+                    illum_wavelen=wavelen, illum_polarization=polarization)
+    grid = schema.to_dataarray()
+    assert_obj_close(Schema.from_dataarray(grid), schema)
+    assert_allclose(FlatDetector(grid).points, schema.points)
+    assert_read_matches_write(schema)
+    assert_pickle_roundtrip(schema)
+    try:
+        schema.spacing = .2
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("Schema should not be changeable")
+
+    holo = calc_holo(schema, scatterer, scaling=.7)
+    expected = calc_holo(grid, scatterer, scaling=.7)
+    assert_allclose(holo, expected.transpose(*holo.dims))
+    assert_obj_close(holo.attrs, expected.attrs)
+    assert_allclose(calc_holo(schema, scatterer, medium_index=1.).medium_index, 1.)
+    field = calc_field(schema, scatterer)
+    assert_allclose(field, calc_field(grid, scatterer))
+
+def test_calc_does_not_copy_schema():
+    schema = update_metadata(locations, medium_index, wavelen, polarization)
+    assert np.shares_memory(schema.values, locations.values)
+    assert not np.shares_memory(update_metadata(locations, deep=True).values, locations.values)
+    uschema = prep_schema(schema, None, None, None)
+    assert np.shares_memory(uschema.values, schema.values)
+
+    holo = calc_holo(flat(schema), scatterer)
+    result = finalize(flat(uschema), holo)
+    assert np.shares_memory(result.values, holo.values)
+    assert_obj_close(result.attrs, uschema.attrs)
+    result = copy_metadata(uschema, holo, do_coords=False, deep=True)
+    assert not np.shares_memory(result.values, holo.values)
+
@@ -39,6 +39,7 @@ from ..errors import InvalidScatterer, TheoryNotCompatibleError, MultisphereFail
 from .common import xschema, yschema, index, wavelen, xpolarization, ypolarization
 from .common import scaling_alpha, sphere
 from holopy.core.tests.common import assert_obj_close, verify
+from holopy.core.utils import LRUCache
 
 schema = xschema
 
@@ -92,6 +93,27 @@ def test_2_sph():
     assert_obj_close(holo.std(), 0.09558537595025796)
 
 
+def test_coefficient_cache():
+    sc = Spheres(scatterers=[Sphere(center=[7.1e-6, 7e-6, 10e-6],
+                                    n=1.5811+1e-4j, r=5e-07),
+                             Sphere(center=[6e-6, 7e-6, 10e-6],
+                                    n=1.5811+1e-4j, r=5e-07)])
+    theory = Multisphere()
+    theory.coefficient_cache = LRUCache(None, maxbytes=2**20)
+    holo = calc_holo(schema, sc, theory=theory, scaling=.6)
+    moved = calc_holo(schema, sc.translated(1e-7, -2e-7, 3e-7), theory=theory, scaling=.6)
+    assert_equal(theory.coefficient_cache.info['hits'], 1)
+    assert_allclose(holo, calc_holo(schema, sc, theory=Multisphere, scaling=.6))
+    assert_allclose(moved, calc_holo(schema, sc.translated(1e-7, -2e-7, 3e-7),
+                                     theory=Multisphere, scaling=.6))
+
+    # entries beyond maxbytes are dropped, least recently used first
+    theory.coefficient_cache.maxbytes = theory.coefficient_cache.currbytes
+    calc_holo(schema, sc.rotated(0, 1, 0), theory=theory, scaling=.6)
+    assert_equal(theory.coefficient_cache.info['evictions'], 1)
+    assert_equal(len(theory.coefficient_cache), 1)
+
+
 def test_radial_holos():
     # Check that holograms computed with and w/o radial part of E_scat differ
     sc = Spheres(scatterers=[Sphere(center=[7.1e-6, 7e-6, 10e-6],
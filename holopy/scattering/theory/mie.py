@@ -176,7 +176,21 @@ class Mie(ScatteringTheory):
         -----
         See Bohren & Huffman for mathematical description.
 
+        If the theory has a coefficient_cache, coefficients are looked up
+        there first, so spheres that differ only in position share them.
         '''
+        cache = self.coefficient_cache
+        if cache is None:
+            return self._calc_scat_coeffs(s, medium_wavevec, medium_index)
+        key = (tuple(ensure_array(s.r)), tuple(ensure_array(s.n)),
+               medium_wavevec, medium_index)
+        coeffs = cache.get(key)
+        if coeffs is None:
+            coeffs = self._calc_scat_coeffs(s, medium_wavevec, medium_index)
+            cache.put(key, coeffs)
+        return coeffs
+
+    def _calc_scat_coeffs(self, s, medium_wavevec, medium_index):
         if (ensure_array(s.r) == 0).any():
             raise InvalidScatterer(s, "Radius is zero")
         x_arr = medium_wavevec * ensure_array(s.r)
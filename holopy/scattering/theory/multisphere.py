@@ -151,7 +151,32 @@ class Multisphere(ScatteringTheory):
         -------
         amn : arrays of field expansion coefficients
 
+        Notes
+        -----
+        The coefficients only depend on the positions of the spheres relative
+        to their centroid, so if the theory has a coefficient_cache, clusters
+        that differ only by a translation share them. Relative positions are
+        compared to 1e-10 wavelengths/2pi, far below the solver's tolerance.
         """
+        cache = self.coefficient_cache
+        if cache is None:
+            return self._calc_amn(scatterer, medium_wavevec, medium_index)
+        try:
+            spheres = [scatterer] if isinstance(scatterer, Sphere) else scatterer.scatterers
+            centers = np.array([s.center for s in spheres], dtype=float)
+            key = ('amn', tuple(np.round((centers - centers.mean(0)) * medium_wavevec, 10).ravel()),
+                   tuple(np.ravel([s.r for s in spheres])),
+                   tuple(np.ravel([s.n for s in spheres])), medium_wavevec, medium_index)
+        except (AttributeError, TypeError, ValueError):
+            # not a valid cluster, let the calculation report it
+            return self._calc_amn(scatterer, medium_wavevec, medium_index)
+        coeffs = cache.get(key)
+        if coeffs is None:
+            coeffs = self._calc_amn(scatterer, medium_wavevec, medium_index)
+            cache.put(key, coeffs)
+        return coeffs
+
+    def _calc_amn(self, scatterer, medium_wavevec, medium_index):
         if isinstance(scatterer,Sphere):
             scatterer=Spheres([scatterer])
         elif not isinstance(scatterer, Spheres):
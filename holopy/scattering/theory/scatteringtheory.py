@@ -26,11 +26,12 @@ calc_intensity and calc_holo, based on subclass's calc_field
 import numpy as np
 import xarray as xr
 from warnings import warn
+from collections import OrderedDict
 from holopy.core.holopy_object import HoloPyObject
 from ..scatterer import Scatterers, Sphere
 from ..errors import TheoryNotCompatibleError, MissingParameter
-from ...core.metadata import vector, sphere_coords, primdim
-from ...core.utils import dict_without, updated
+from ...core.metadata import vector, sphere_coords, primdim, detector_geometry
+from ...core.utils import dict_without
 try:
     from .mie_f import mieangfuncs
 except ImportError:
@@ -45,6 +46,11 @@ def stack_spherical(a):
     return np.vstack((a['r'],a['theta'],a['phi']))
 
 
+def _shape_key(s):
+    # everything about a scatterer except where it is
+    return repr(s.translated(-np.asarray(s.center, dtype=float)))
+
+
 class ScatteringTheory(HoloPyObject):
     """
     Defines common interface for all scattering theories.
@@ -59,53 +65,107 @@ class ScatteringTheory(HoloPyObject):
     So the simplest thing is to just implement _raw_scat_matrs. You only need to
     do _raw_fields there is a way to compute it more efficently and you care
     about that speed, or if it is easier and you don't care about matrices.
+
+    Theories that compute position independent scattering coefficients may
+    look them up in coefficient_cache (an object with get and put, such as
+    holopy.core.utils.LRUCache) when it is set. It is None by default.
     """
+    coefficient_cache = None
 
-    def _calc_field(self, scatterer, schema):
+    def _calc_field(self, scatterer, schema, geometry=None):
         """
         Calculate fields.  Implemented in derived classes only.
         Parameters
         ----------
         scatterer : :mod:`.scatterer` object
             (possibly composite) scatterer for which to compute scattering
+        geometry : :class:`.DetectorGeometry` (optional)
+            Prepared pixel positions of schema, as kept by a Schema. Looked
+            up with detector_geometry if not given.
         Returns
         -------
         e_field : :mod:`.VectorGrid`
             scattered electric field
         """
-        def get_field(s):
-            if isinstance(scatterer,Sphere) and scatterer.center is None:
-                raise MissingParameter("center")
-            positions = sphere_coords(schema, s.center, wavevec=wavevec(schema))
-            field = np.vstack(self._raw_fields(stack_spherical(positions), s, medium_wavevec=wavevec(schema), medium_index=schema.medium_index, illum_polarization=schema.illum_polarization)).T
-            phase = np.exp(-1j*wavevec(schema)*s.center[2])
+        if geometry is None:
+            geometry = detector_geometry(schema)
+        field = self._calc_field_flat(scatterer, geometry, schema.medium_index,
+                                      schema.illum_wavelen, schema.illum_polarization)
+        return xr.DataArray(field, dims=[geometry.dimstr, vector], coords=geometry.coords,
+                            attrs=schema.attrs)
+
+    def _calc_field_flat(self, scatterer, geometry, medium_index, illum_wavelen, illum_polarization):
+        """
+        Calculate fields at the pixels of a detector as a plain array
+
+        Parameters
+        ----------
+        scatterer : :mod:`.scatterer` object
+            (possibly composite) scatterer for which to compute scattering
+        geometry : :class:`.DetectorGeometry`
+            Pixels to calculate at
+        Returns
+        -------
+        e_field : array (N, 3)
+            scattered electric field, in the same units as _calc_field
+        """
+        return self._calc_fields_flat([scatterer], geometry, medium_index, illum_wavelen,
+                                      illum_polarization)[0]
+
+    def _calc_fields_flat(self, scatterers, geometry, medium_index, illum_wavelen, illum_polarization):
+        """
+        Calculate the fields of several scatterers at the pixels of a detector
+
+        Scatterers (or parts of composite scatterers) that differ only in
+        position have the same field about their centers. Their pixel
+        positions are stacked and their fields computed in one call to
+        _raw_fields, so many walkers of a sampler moving the same particle
+        cost one theory call.
+
+        Parameters
+        ----------
+        scatterers : list of :mod:`.scatterer` objects
+            (possibly composite) scatterers for which to compute scattering
+        geometry : :class:`.DetectorGeometry`
+            Pixels to calculate at
+        Returns
+        -------
+        e_fields : array (len(scatterers), N, 3)
+            scattered electric field of each scatterer
+        """
+        medium_wavevec = 2*np.pi/(illum_wavelen/medium_index)
+
+        # See if we can handle each scatterer in one step, and if it is a
+        # composite try superposition
+        groups = OrderedDict()
+        for i, scatterer in enumerate(scatterers):
+            if self._can_handle(scatterer):
+                parts = [scatterer]
+            elif isinstance(scatterer, Scatterers):
+                parts = scatterer.get_component_list()
+            else:
+                raise TheoryNotCompatibleError(self, scatterer)
+            for s in parts:
+                if isinstance(s, Sphere) and s.center is None:
+                    raise MissingParameter("center")
+                groups.setdefault(_shape_key(s), []).append((i, s))
+
+        fields = None
+        for members in groups.values():
+            positions = np.hstack([geometry.spherical(s.center, wavevec=medium_wavevec)
+                                   for i, s in members])
+            field = np.vstack(self._raw_fields(positions, members[0][1], medium_wavevec=medium_wavevec, medium_index=medium_index, illum_polarization=illum_polarization)).T
             # TODO: fix and re-enable internal fields
             #if self._scatterer_overlaps_schema(scatterer, schema):
             #    inner = scatterer.contains(schema.positions.xyz())
             #    field[inner] = np.vstack(
             #        self._raw_internal_fields(positions[inner].T, s,
             #                                  optics)).T
-            field *= phase
-            dimstr=primdim(positions)
-            coords = {key: (dimstr, val.values) for key, val in positions[dimstr].coords.items()}
-            coords = updated(coords, {dimstr: positions[dimstr], vector: ['x', 'y', 'z']})
-            field = xr.DataArray(field, dims=[dimstr, vector], coords = coords, attrs=schema.attrs)
-            return field
-
-
-        # See if we can handle the scatterer in one step
-        if self._can_handle(scatterer):
-            field = get_field(scatterer)
-        elif isinstance(scatterer, Scatterers):
-        # if it is a composite, try superposition
-            scatterers = scatterer.get_component_list()
-            field = get_field(scatterers[0])
-            for s in scatterers[1:]:
-                field += get_field(s)
-        else:
-            raise TheoryNotCompatibleError(self, scatterer)
-
-        return field
+            if fields is None:
+                fields = np.zeros((len(scatterers), geometry.size, 3), dtype=field.dtype)
+            for (i, s), f in zip(members, field.reshape(len(members), geometry.size, 3)):
+                fields[i] += f * np.exp(-1j*medium_wavevec*s.center[2])
+        return fields
 
     def _calc_cross_sections(self, scatterer, medium_wavevec, medium_index, illum_polarization):
         raw_sections = self._raw_cross_sections(scatterer=scatterer,